@@ -0,0 +1,101 @@
+"""
+iCalendar (RFC 5545) rendering for calendar subscription feeds.
+"""
+
+from django.utils import timezone
+
+from atriacalendar.recurrence import virtual_start
+
+
+PRODID = '-//Atria//Atria Calendar//EN'
+
+# content lines longer than this many octets are folded
+LINE_LENGTH = 75
+
+
+def escape_text(value):
+    # String -> String
+    # Produce value as an iCalendar TEXT value.
+
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;')\
+        .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def format_datetime(value):
+    # Datetime -> String
+    # Produce value as an iCalendar UTC DATE-TIME value.
+
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def content_line(name, value):
+    # String, String -> String
+    # Produce a CRLF terminated content line, folded so that no line is longer
+    # than LINE_LENGTH octets (without splitting multi-byte characters).
+
+    line = '%s:%s' % (name, value)
+    folded = []
+    (current, length) = ('', 0)
+
+    for character in line:
+        size = len(character.encode('utf-8'))
+        if length + size > LINE_LENGTH:
+            folded.append(current)
+            # continuation lines start with a space, which counts too
+            (current, length) = (' ', 1)
+        current += character
+        length += size
+
+    folded.append(current)
+    return '\r\n'.join(folded) + '\r\n'
+
+
+def calendar_header(name):
+    return (
+        content_line('BEGIN', 'VCALENDAR') +
+        content_line('VERSION', '2.0') +
+        content_line('PRODID', PRODID) +
+        content_line('CALSCALE', 'GREGORIAN') +
+        content_line('METHOD', 'PUBLISH') +
+        content_line('X-WR-CALNAME', escape_text(name))
+    )
+
+
+def calendar_footer():
+    return content_line('END', 'VCALENDAR')
+
+
+def occurrence_uid(occurrence, domain):
+    # Occurrence, String -> String
+    # Produce the UID of an occurrence, or of a virtual one by its event and
+    # start.
+
+    if occurrence.pk is None:
+        return 'event-%s-%s@%s' % (occurrence.event_id, virtual_start(occurrence), domain)
+    return 'occurrence-%s@%s' % (occurrence.pk, domain)
+
+
+def occurrence_event(occurrence, domain, dtstamp):
+    # Occurrence, String, Datetime -> String
+    # Produce the VEVENT for a published occurrence.  The occurrence's event
+    # must be select_related as event__atriaevent__event_program.
+
+    event = occurrence.event.atriaevent
+    lines = [
+        ('BEGIN', 'VEVENT'),
+        ('UID', occurrence_uid(occurrence, domain)),
+        ('DTSTAMP', format_datetime(dtstamp)),
+        ('DTSTART', format_datetime(occurrence.start_time)),
+        ('DTEND', format_datetime(occurrence.end_time)),
+        ('SUMMARY', escape_text(event.title)),
+    ]
+    if event.description:
+        lines.append(('DESCRIPTION', escape_text(event.description)))
+    if event.location:
+        lines.append(('LOCATION', escape_text(event.location)))
+    lines += [
+        ('CATEGORIES', escape_text(event.event_program.label)),
+        ('END', 'VEVENT'),
+    ]
+
+    return ''.join(content_line(name, value) for (name, value) in lines)
@@ -2,10 +2,68 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 
 from atriacalendar.models import *
+from atriacalendar.recurrence import virtual_start
 from swingtime import models as swingtime_models
 
 
-class AtriaCalendarSerializer(serializers.Serializer):
+class EagerLoadingMixin(object):
+    """
+    Serializer mixin that declares the relations a serializer reads, so a
+    queryset can be loaded up front instead of one query per object.
+
+    ``select_related_fields`` and ``prefetch_related_fields`` are relative to
+    the serialized model; relations of nested serializers are collected
+    automatically, prefixed by the nested field's source.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def related_fields(cls, prefix='', prefetch_only=False):
+        # String, Boolean -> (List, List)
+        # Produce the select_related and prefetch_related lookups for this
+        # serializer and its nested serializers.
+        select_related = []
+        prefetch_related = [prefix + f for f in cls.prefetch_related_fields]
+
+        if prefetch_only:
+            prefetch_related += [prefix + f for f in cls.select_related_fields]
+        else:
+            select_related += [prefix + f for f in cls.select_related_fields]
+
+        for name, field in cls._declared_fields.items():
+            many = isinstance(field, serializers.ListSerializer)
+            nested = field.child if many else field
+            if not isinstance(nested, EagerLoadingMixin):
+                continue
+
+            lookup = prefix + (field.source or name).replace('.', '__')
+            (nested_select, nested_prefetch) = nested.related_fields(
+                lookup + '__', prefetch_only or many)
+            if many:
+                prefetch_related.append(lookup)
+            elif not prefetch_only:
+                select_related.append(lookup)
+            select_related += nested_select
+            prefetch_related += nested_prefetch
+
+        return (select_related, prefetch_related)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        # QuerySet -> QuerySet
+        # Applies the serializer's declared relations to the queryset.
+        (select_related, prefetch_related) = cls.related_fields()
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+
+        return queryset
+
+
+class AtriaCalendarSerializer(EagerLoadingMixin, serializers.Serializer):
     calendar_id = serializers.IntegerField(source='id')
     org_owner_id = serializers.SerializerMethodField()
     org_owner_name = serializers.SerializerMethodField()
@@ -14,6 +72,8 @@ class AtriaCalendarSerializer(serializers.Serializer):
     calendar_name = serializers.CharField(max_length=40)
     calendar_text = serializers.SerializerMethodField()
 
+    select_related_fields = ('org_owner', 'user_owner')
+
     def get_org_owner_id(self, obj):
         org_owner = getattr(obj, 'org_owner', None)
         if org_owner:
@@ -55,27 +115,35 @@ class AtriaProgramSerializer(serializers.Serializer):
     label = serializers.CharField()
 
 
-class AtriaOpporunitySerializer(serializers.Serializer):
+class AtriaOpporunitySerializer(EagerLoadingMixin, serializers.Serializer):
     opportunity_id = serializers.IntegerField(source='id')
     title = serializers.CharField(max_length=32)
     description = serializers.CharField(max_length=100)
 
 
-class AtriaEventSerializer(serializers.ModelSerializer):
+class AtriaEventSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     event_id = serializers.IntegerField(source='id')
     title = serializers.CharField(max_length=32)
     description = serializers.CharField(max_length=100)
     event_type = serializers.CharField(max_length=4)
-    opportunities = AtriaOpporunitySerializer(source='atriaevent.atriavolunteeropportunity_set', many=True)
+    opportunities = AtriaOpporunitySerializer(source='atriavolunteeropportunity_set', many=True)
+
+    select_related_fields = ('event_type',)
 
     class Meta:
         model = AtriaEvent
         fields = ('event_id', 'title', 'description', 'event_type', 'opportunities')
 
 
-class AtriaOccurrenceSerializer(serializers.Serializer):
+class AtriaOccurrenceSerializer(EagerLoadingMixin, serializers.Serializer):
     occurrence_id = serializers.IntegerField(source='id')
     start_time = serializers.DateTimeField()
     end_time = serializers.DateTimeField()
-    event = AtriaEventSerializer()
+    event = AtriaEventSerializer(source='event.atriaevent')
+    # set for repetitions of a recurrence rule that aren't stored yet, which
+    # have no occurrence_id
+    virtual_start = serializers.SerializerMethodField()
+
+    def get_virtual_start(self, obj):
+        return virtual_start(obj)
 
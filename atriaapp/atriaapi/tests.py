@@ -1,17 +1,30 @@
 from datetime import datetime, timedelta
+from io import StringIO
 import json
+import tempfile
+import threading
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
-from django.utils import timezone
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
 
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from swingtime.models import EventType
 
+from atriacalendar.cache import calendar_cache
+from atriacalendar.routers import ReplicaRouter, request_routing
+from atriacalendar.tests.utils import commit_callbacks
+from atriaapi.views import concurrent_lookups, month_grid_days, query_month_summary
 from atriacalendar.models import (
-    AtriaEvent, AtriaEventProgram, AtriaOccurrence, AtriaOrganization, AtriaCalendar)
+    AtriaEvent, AtriaEventProgram, AtriaOccurrence, AtriaOccurrenceBucket, AtriaOrganization,
+    AtriaCalendar, AtriaRelationship, AtriaVolunteerOpportunity, RelationType)
 
 DT_FORMAT = '%Y-%m-%dT%H:%M:%S'
 DT_TZ_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
@@ -21,7 +34,7 @@ User = get_user_model()
 
 class CalendarAPITests(APITestCase):
     def test_get_week_view(self):
-        now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        now = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
         end_time = now + timedelta(hours=1)
         event_type = EventType.objects.create(
             abbr='test',
@@ -39,6 +52,7 @@ class CalendarAPITests(APITestCase):
             start_time=now,
             end_time=end_time,
             event=atria_event,
+            published=True,
         )
 
         sunday = now - timedelta(days=now.isoweekday() % 7)
@@ -72,7 +86,7 @@ class CalendarAPITests(APITestCase):
         self.assertEqual(event['event_type'], event_type.label)
 
     def test_get_calendar_program_view(self):
-        now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        now = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
         end_time = now + timedelta(hours=1)
 
         org1 = AtriaOrganization.objects.create(
@@ -128,6 +142,7 @@ class CalendarAPITests(APITestCase):
             start_time=now,
             end_time=end_time,
             event=atria_event,
+            published=True,
         )
 
         response = self.client.get(
@@ -178,3 +193,827 @@ class CalendarAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = json.loads(response.content)
         self.assertEqual(len(data['occurrences']), 0)
+
+
+class PeriodOccurrencesTests(APITestCase):
+    def setUp(self):
+        calendar_cache().clear()
+        self.event = AtriaEvent.objects.create(
+            event_program=AtriaEventProgram.objects.create(
+                abbr='test',
+                label='Test Event Program',
+            ),
+            event_type=EventType.objects.create(
+                abbr='test',
+                label='Test Event Type',
+            ),
+        )
+        self.day = timezone.make_aware(datetime(2019, 10, 16))
+
+    def create_occurrence(self, start_time, end_time):
+        return AtriaOccurrence.objects.create(
+            start_time=start_time,
+            end_time=end_time,
+            event=self.event,
+            published=True,
+        )
+
+    def get_day_occurrence_ids(self):
+        response = self.client.get('/api/atria/calendar/2019/10/16/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        data = json.loads(response.content)
+        return set(o['occurrence_id'] for o in data['occurrences'])
+
+    def create_period_fixtures(self):
+        return {
+            'inside': self.create_occurrence(
+                self.day + timedelta(hours=9), self.day + timedelta(hours=10)),
+            'ends_at_start': self.create_occurrence(
+                self.day - timedelta(hours=1), self.day),
+            'starts_before_end': self.create_occurrence(
+                self.day + timedelta(hours=23), self.day + timedelta(hours=25)),
+            'spans_month': self.create_occurrence(
+                self.day - timedelta(days=40), self.day + timedelta(days=40)),
+            'before': self.create_occurrence(
+                self.day - timedelta(hours=3), self.day - timedelta(hours=1)),
+            'after': self.create_occurrence(
+                self.day + timedelta(days=1, hours=1),
+                self.day + timedelta(days=1, hours=2)),
+            'long_before': self.create_occurrence(
+                self.day - timedelta(days=40), self.day - timedelta(days=10)),
+        }
+
+    def assert_period_overlap(self):
+        occurrences = self.create_period_fixtures()
+        expected = set(occurrences[name].id for name in (
+            'inside', 'ends_at_start', 'starts_before_end', 'spans_month'))
+
+        self.assertEqual(self.get_day_occurrence_ids(), expected)
+        self.assertEqual(
+            set(o.id for o in AtriaOccurrence.objects.period_occurrences(
+                self.day.date())),
+            expected)
+
+    def test_period_overlap(self):
+        self.assert_period_overlap()
+
+    @override_settings(OCCURRENCE_INTERVAL_INDEX={'ENABLED': True})
+    def test_period_overlap_interval_index(self):
+        self.assert_period_overlap()
+
+        spans_month = AtriaOccurrence.objects.get(
+            start_time=self.day - timedelta(days=40),
+            end_time=self.day + timedelta(days=40))
+        self.assertTrue(spans_month.atriaoccurrencebucket_set.exists())
+
+    def test_interval_index_disabled(self):
+        occurrences = self.create_period_fixtures()
+        self.assertFalse(AtriaOccurrenceBucket.objects.exists())
+
+        # saves don't touch the index while it is disabled
+        with CaptureQueriesContext(connection) as queries:
+            occurrences['spans_month'].save()
+        self.assertFalse([
+            query for query in queries
+            if AtriaOccurrenceBucket._meta.db_table in query['sql']])
+
+        with override_settings(OCCURRENCE_INTERVAL_INDEX={'ENABLED': True}):
+            output = StringIO()
+            call_command('rebuild_occurrence_buckets', stdout=output)
+            self.assertEqual(
+                output.getvalue().strip(),
+                '%s occurrence bucket(s) rebuilt.' % AtriaOccurrenceBucket.objects.count())
+            self.assertEqual(
+                set(AtriaOccurrenceBucket.objects.values_list('occurrence_id', flat=True)),
+                {occurrences['spans_month'].id, occurrences['long_before'].id})
+            self.assertIn(occurrences['spans_month'].id, self.get_day_occurrence_ids())
+
+
+class QueryBudgetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        event_type = EventType.objects.create(
+            abbr='test',
+            label='Test Event Type',
+        )
+        event_program = AtriaEventProgram.objects.create(
+            abbr='test',
+            label='Test Event Program',
+        )
+        org = AtriaOrganization.objects.create(
+            org_name="Atria Neighbourhood House",
+            status="Active",
+            description="Atria Neighbourhood House test organization",
+            location="Vancouver",
+        )
+        calendar = AtriaCalendar.objects.create(
+            org_owner=org,
+            calendar_name="Test Events",
+        )
+        month_start = timezone.make_aware(datetime(2019, 10, 1, 9))
+
+        for i in range(20):
+            event = AtriaEvent.objects.create(
+                title='Event %s' % i,
+                event_type=event_type,
+                event_program=event_program,
+                calendar=calendar,
+            )
+            for j in range(2):
+                AtriaVolunteerOpportunity.objects.create(
+                    event=event, title='Opportunity %s' % j)
+            for j in range(100):
+                start_time = month_start + timedelta(days=j % 30, minutes=i)
+                AtriaOccurrence.objects.create(
+                    start_time=start_time,
+                    end_time=start_time + timedelta(hours=1),
+                    event=event,
+                    published=True,
+                )
+
+    def setUp(self):
+        calendar_cache().clear()
+
+    def test_month_view_query_budget(self):
+        # change watermarks, occurrences, the events' opportunities, and the
+        # events with recurrence rules
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/atria/calendar/2019/10/')
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data['occurrences']), 2000)
+        self.assertEqual(len(data['occurrences'][0]['event']['opportunities']), 2)
+        self.assertEqual(data['occurrences'][0]['event']['event_type'], 'Test Event Type')
+
+    def test_events_view_query_budget(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/atria/events/')
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data['events']), 20)
+        self.assertEqual(len(data['events'][0]['opportunities']), 2)
+
+    def test_calendars_view_query_budget(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/atria/calendars/')
+
+        data = json.loads(response.content)
+        self.assertEqual(data['calendars'][0]['org_owner_name'], "Atria Neighbourhood House")
+
+
+class MultiCalendarTests(APITestCase):
+    def setUp(self):
+        calendar_cache().clear()
+        self.user = User.objects.create(email='neighbour@example.com')
+        member = RelationType.objects.create(relation_type='Member')
+        event_type = EventType.objects.create(abbr='test', label='Test Event Type')
+        self.programs = [
+            AtriaEventProgram.objects.create(abbr='p%s' % i, label='Program %s' % i)
+            for i in range(2)]
+
+        self.calendars = []
+        start_time = timezone.make_aware(datetime(2019, 10, 16, 9))
+        for i in range(3):
+            org = AtriaOrganization.objects.create(org_name='Org %s' % i)
+            calendar = AtriaCalendar.objects.create(org_owner=org, calendar_name='Events %s' % i)
+            self.calendars.append(calendar)
+            if i < 2:
+                AtriaRelationship.objects.create(
+                    user=self.user, org=org, relation_type=member, status='Active')
+
+            event = AtriaEvent.objects.create(
+                title='Event %s' % i, event_type=event_type,
+                event_program=self.programs[i % 2], calendar=calendar)
+            AtriaOccurrence.objects.create(
+                start_time=start_time - timedelta(hours=i),
+                end_time=start_time - timedelta(hours=i - 1),
+                event=event, published=True)
+
+    def titles(self, query, expected_status=status.HTTP_200_OK):
+        response = self.client.get('/api/atria/calendar/2019/10/' + query)
+        self.assertEqual(response.status_code, expected_status)
+
+        return [o['event']['title'] for o in json.loads(response.content).get('occurrences', [])]
+
+    def test_calendar_lists(self):
+        (first, second, third) = (c.id for c in self.calendars)
+
+        # one query for the occurrences of all the calendars, by start time
+        self.assertEqual(self.titles('?calendar=%s,%s' % (first, third)), ['Event 2', 'Event 0'])
+        self.assertEqual(
+            self.titles('?calendar=%s&calendar=%s' % (second, third)), ['Event 2', 'Event 1'])
+        self.assertEqual(
+            self.titles('?calendar=%s,%s&program=%s' % (first, third, self.programs[0].id)),
+            ['Event 2', 'Event 0'])
+        self.assertEqual(self.titles('?program=%s,%s' % tuple(p.id for p in self.programs)),
+                         ['Event 2', 'Event 1', 'Event 0'])
+
+    def test_connected(self):
+        self.assertEqual(self.titles('?connected=true'), [])
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.titles('?connected=true'), ['Event 1', 'Event 0'])
+        self.assertEqual(
+            self.titles('?connected=true&calendar=%s' % self.calendars[2].id),
+            ['Event 2', 'Event 1', 'Event 0'])
+
+        # other users' connections are neither cached nor matched by ETag
+        response = self.client.get('/api/atria/calendar/2019/10/?connected=true')
+        self.client.force_login(User.objects.create(email='other@example.com'))
+        self.assertEqual(self.titles('?connected=true'), [])
+        response = self.client.get(
+            '/api/atria/calendar/2019/10/?connected=true',
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_invalidation(self):
+        query = '?calendar=%s,%s' % (self.calendars[0].id, self.calendars[1].id)
+        self.titles(query)
+
+        with commit_callbacks():
+            AtriaOccurrence.objects.filter(event__atriaevent__calendar=self.calendars[1])\
+                .get().delete()
+        self.assertEqual(self.titles(query), ['Event 0'])
+
+    @override_settings(API_MAX_FILTER_IDS=2)
+    def test_invalid_filters(self):
+        ids = ','.join(str(c.id) for c in self.calendars)
+        self.titles('?calendar=%s' % ids, status.HTTP_400_BAD_REQUEST)
+        self.titles('?calendar=1,x', status.HTTP_400_BAD_REQUEST)
+        self.titles('?program=x', status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.titles('?calendar=%s' % ids[:ids.rindex(',')])), 2)
+
+
+class CalendarCacheTests(APITestCase):
+    def setUp(self):
+        calendar_cache().clear()
+        translation.activate('en')
+
+        self.calendar = AtriaCalendar.objects.create(
+            org_owner=AtriaOrganization.objects.create(
+                org_name="Atria Neighbourhood House",
+                status="Active",
+                description="Atria Neighbourhood House test organization",
+                location="Vancouver",
+            ),
+            calendar_name="Test Events",
+        )
+        self.event = AtriaEvent.objects.create(
+            title='English Title',
+            event_type=EventType.objects.create(
+                abbr='test',
+                label='Test Event Type',
+            ),
+            event_program=AtriaEventProgram.objects.create(
+                abbr='test',
+                label='Test Event Program',
+            ),
+            calendar=self.calendar,
+        )
+        translation.activate('fr')
+        self.event.title = 'French Title'
+        self.event.save()
+        translation.activate('en')
+
+        self.start_time = timezone.make_aware(datetime(2019, 10, 16, 9))
+        self.occurrence = AtriaOccurrence.objects.create(
+            start_time=self.start_time,
+            end_time=self.start_time + timedelta(hours=1),
+            event=self.event,
+            published=True,
+        )
+        self.url = '/api/atria/calendar/2019/10/?calendar=%s' % self.calendar.id
+
+    def get_occurrences(self, url=None, **extra):
+        response = self.client.get(url or self.url, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        return json.loads(response.content)['occurrences']
+
+    def test_cached_response(self):
+        self.assertEqual(len(self.get_occurrences()), 1)
+
+        # only the change watermarks are read
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.get_occurrences()), 1)
+
+    def test_occurrence_save_invalidates(self):
+        self.assertEqual(len(self.get_occurrences()), 1)
+        self.assertEqual(len(self.get_occurrences('/api/atria/calendar/2019/10/')), 1)
+
+        with commit_callbacks():
+            AtriaOccurrence.objects.create(
+                start_time=self.start_time + timedelta(days=1),
+                end_time=self.start_time + timedelta(days=1, hours=1),
+                event=self.event,
+                published=True,
+            )
+
+        self.assertEqual(len(self.get_occurrences()), 2)
+        self.assertEqual(len(self.get_occurrences('/api/atria/calendar/2019/10/')), 2)
+
+    def test_event_and_opportunity_save_invalidate(self):
+        self.get_occurrences()
+
+        self.event.title = 'New Title'
+        with commit_callbacks():
+            self.event.save()
+        self.assertEqual(self.get_occurrences()[0]['event']['title'], 'New Title')
+
+        with commit_callbacks():
+            AtriaVolunteerOpportunity.objects.create(event=self.event, title='Help')
+        self.assertEqual(len(self.get_occurrences()[0]['event']['opportunities']), 1)
+
+    def test_event_calendar_move_invalidates(self):
+        self.get_occurrences()
+
+        self.event.calendar = None
+        with commit_callbacks():
+            self.event.save()
+
+        self.assertEqual(len(self.get_occurrences()), 0)
+
+    def test_occurrence_delete_invalidates(self):
+        self.get_occurrences()
+
+        with commit_callbacks():
+            self.occurrence.delete()
+
+        self.assertEqual(len(self.get_occurrences()), 0)
+
+    def test_invalidated_on_commit(self):
+        self.get_occurrences()
+
+        # until the commit, reads keep using the old version
+        with commit_callbacks():
+            self.occurrence.delete()
+            self.assertEqual(len(self.get_occurrences()), 1)
+
+        self.assertEqual(len(self.get_occurrences()), 0)
+
+    def test_language_keyed(self):
+        self.assertEqual(
+            self.get_occurrences()[0]['event']['title'], 'English Title')
+        self.assertEqual(
+            self.get_occurrences(HTTP_ACCEPT_LANGUAGE='fr')[0]['event']['title'],
+            'French Title')
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with override_settings(CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': cache_dir}}):
+                self.assertEqual(len(self.get_occurrences()), 1)
+
+                with self.assertNumQueries(1):
+                    self.assertEqual(len(self.get_occurrences()), 1)
+
+                with commit_callbacks():
+                    self.occurrence.delete()
+                self.assertEqual(len(self.get_occurrences()), 0)
+
+
+class EventPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        event_type = EventType.objects.create(
+            abbr='test',
+            label='Test Event Type',
+        )
+        event_program = AtriaEventProgram.objects.create(
+            abbr='test',
+            label='Test Event Program',
+        )
+        for i in range(20):
+            event = AtriaEvent.objects.create(
+                title='Event %s' % i,
+                event_type=event_type,
+                event_program=event_program,
+            )
+            AtriaVolunteerOpportunity.objects.create(
+                event=event, title='Opportunity %s' % i)
+
+        cls.event_ids = list(
+            AtriaEvent.objects.order_by('id').values_list('id', flat=True))
+
+    def test_cursor_pagination(self):
+        event_ids = []
+        cursor = ''
+
+        for page in range(3):
+            response = self.client.get(
+                '/api/atria/events/?page_size=7&cursor=%s' % cursor)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            data = json.loads(response.content)
+            event_ids += [e['event_id'] for e in data['events']]
+            cursor = data['next_cursor']
+
+        self.assertIsNone(cursor)
+        self.assertEqual(event_ids, self.event_ids)
+
+    @override_settings(API_EVENTS_MAX_PAGE_SIZE=5)
+    def test_max_page_size(self):
+        response = self.client.get('/api/atria/events/?page_size=100')
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data['events']), 5)
+        self.assertEqual(data['next_cursor'], self.event_ids[4])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/atria/events/?cursor=abc')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(API_STREAM_CHUNK_SIZE=8)
+    def test_stream(self):
+        response = self.client.get(
+            '/api/atria/events/?stream=true&cursor=%s' % self.event_ids[1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # one query for the events, one opportunity prefetch per chunk
+        with self.assertNumQueries(4):
+            content = b''.join(response.streaming_content)
+
+        data = json.loads(content)
+        self.assertEqual(
+            [e['event_id'] for e in data['events']], self.event_ids[2:])
+        self.assertEqual(len(data['events'][0]['opportunities']), 1)
+
+
+@override_settings(SEARCH_PAGE_SIZE=2)
+class SearchAPITests(APITestCase):
+    def setUp(self):
+        event_type = EventType.objects.create(abbr='test', label='Test Event Type')
+        self.program = AtriaEventProgram.objects.create(abbr='test', label='Test Program')
+        start_time = timezone.now() + timedelta(days=1)
+
+        for (i, title) in enumerate(('Garden one', 'Garden two', 'Garden three', 'Kitchen')):
+            event = AtriaEvent.objects.create(
+                title=title, event_type=event_type, event_program=self.program)
+            AtriaOccurrence.objects.create(
+                start_time=start_time + timedelta(hours=i),
+                end_time=start_time + timedelta(hours=i + 1),
+                event=event,
+                published=i != 2,
+            )
+
+    def test_search(self):
+        response = self.client.get('/api/atria/search/?q=garden')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['num_pages'], 1)
+        self.assertEqual(
+            sorted(o['event']['title'] for o in data['occurrences']),
+            ['Garden one', 'Garden two'])
+
+    def test_pagination(self):
+        response = self.client.get('/api/atria/search/?page=2')
+
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['page'], 2)
+        self.assertEqual(data['num_pages'], 2)
+        self.assertEqual([o['event']['title'] for o in data['occurrences']], ['Kitchen'])
+
+    def test_past_occurrences_excluded(self):
+        response = self.client.get(
+            '/api/atria/search/?q=kitchen&start=%s' % (
+                timezone.now() + timedelta(days=5)).date())
+
+        self.assertEqual(json.loads(response.content)['count'], 0)
+
+
+@override_settings(SEARCH_PAGE_SIZE=1)
+class NeighbourSearchAPITests(APITestCase):
+    def setUp(self):
+        group = Group.objects.get_or_create(name=settings.DEFAULT_USER_ROLE)[0]
+        for (email, last_name) in (('ann@example.com', 'Smith'), ('bob@example.com', 'Smithers')):
+            User.objects.create(email=email, last_name=last_name).groups.add(group)
+
+    def test_search(self):
+        response = self.client.get('/api/atria/neighbours/?q=smith')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertEqual(data['neighbours'], [
+            {'email': 'ann@example.com', 'first_name': '', 'last_name': 'Smith'}])
+        self.assertEqual(data['next'], 'ann@example.com')
+
+        data = json.loads(self.client.get(
+            '/api/atria/neighbours/?q=smith&after=%s' % data['next']).content)
+        self.assertEqual([n['email'] for n in data['neighbours']], ['bob@example.com'])
+        self.assertIsNone(data['next'])
+
+
+class LookupsAPITests(APITestCase):
+    def setUp(self):
+        AtriaCalendar.objects.create(
+            org_owner=AtriaOrganization.objects.create(org_name='Test Org'),
+            calendar_name='Test Events')
+        AtriaEventProgram.objects.create(abbr='test', label='Test Event Program')
+
+    def test_lookups(self):
+        response = self.client.get('/api/atria/lookups/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertEqual(
+            data['calendars'],
+            json.loads(self.client.get('/api/atria/calendars/').content)['calendars'])
+        self.assertEqual(
+            data['programs'],
+            json.loads(self.client.get('/api/atria/programs/').content)['programs'])
+        self.assertEqual(len(data['calendars']), 1)
+
+
+class ConcurrentLookupsTests(SimpleTestCase):
+    def lookup(self):
+        return (threading.get_ident(), translation.get_language())
+
+    def test_threads(self):
+        with translation.override('fr'):
+            results = concurrent_lookups(self.lookup, self.lookup)
+
+        self.assertEqual([language for (_, language) in results], ['fr', 'fr'])
+        self.assertNotIn(threading.get_ident(), [thread for (thread, _) in results])
+
+    def test_threads_routed_like_request(self):
+        def lookup():
+            return ReplicaRouter().db_for_read(AtriaEvent)
+
+        with request_routing('replica', False):
+            self.assertEqual(concurrent_lookups(lookup, lookup), ['replica', 'replica'])
+        with request_routing('replica', True):
+            self.assertEqual(concurrent_lookups(lookup, lookup), [None, None])
+
+    @override_settings(API_LOOKUP_THREADS=1)
+    def test_in_turn(self):
+        self.assertEqual(
+            concurrent_lookups(self.lookup), [(threading.get_ident(), translation.get_language())])
+
+
+class OrganizationSearchAPITests(APITestCase):
+    def setUp(self):
+        for name in ('Community Garden', 'Garden Club'):
+            AtriaOrganization.objects.create(
+                org_name=name, location='Victoria', description='About ' + name)
+
+    def test_search(self):
+        response = self.client.get('/api/atria/organizations/?q=garden')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(
+            [(o['org_name'], o['description']) for o in data['organizations']],
+            [('Garden Club', 'About Garden Club'), ('Community Garden', 'About Community Garden')])
+
+    def test_compact(self):
+        data = json.loads(self.client.get(
+            '/api/atria/organizations/?q=club&compact=1').content)
+
+        self.assertEqual(data['organizations'], [{
+            'id': AtriaOrganization.objects.get(org_name_en='Garden Club').pk,
+            'org_name': 'Garden Club', 'location': 'Victoria', 'tagline': ''}])
+
+
+class CalendarFeedTests(APITestCase):
+    def setUp(self):
+        calendar_cache().clear()
+        event_type = EventType.objects.create(abbr='test', label='Test Event Type')
+        self.program = AtriaEventProgram.objects.create(abbr='gar', label='Gardening')
+        other_program = AtriaEventProgram.objects.create(abbr='oth', label='Other')
+        self.calendar = AtriaCalendar.objects.create(calendar_name='Garden, Club')
+        other_calendar = AtriaCalendar.objects.create(calendar_name='Other')
+        self.start_time = timezone.now().replace(microsecond=0) + timedelta(days=1)
+
+        self.event = AtriaEvent.objects.create(
+            title='Planting; weeding', description='Bring gloves\nand water',
+            location='Main St', event_type=event_type, event_program=self.program,
+            calendar=self.calendar)
+        self.occurrence = self.create_occurrence(self.event)
+        self.create_occurrence(self.event, published=False)
+        self.create_occurrence(AtriaEvent.objects.create(
+            title='Other program', event_type=event_type, event_program=other_program,
+            calendar=self.calendar))
+        self.create_occurrence(AtriaEvent.objects.create(
+            title='Other calendar', event_type=event_type, event_program=self.program,
+            calendar=other_calendar))
+
+    def create_occurrence(self, event, published=True):
+        return AtriaOccurrence.objects.create(
+            start_time=self.start_time, end_time=self.start_time + timedelta(hours=2),
+            event=event, published=published)
+
+    def feed_url(self, query=''):
+        return '/api/atria/calendars/%s/feed.ics%s' % (self.calendar.pk, query)
+
+    def get_feed(self, query='', **headers):
+        response = self.client.get(self.feed_url(query), **headers)
+        content = b''.join(response.streaming_content).decode('utf-8') \
+            if response.status_code == status.HTTP_200_OK else ''
+        return (response, content)
+
+    def test_feed(self):
+        (response, content) = self.get_feed()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertTrue(content.endswith('END:VCALENDAR\r\n'))
+        self.assertIn('X-WR-CALNAME:Garden\\, Club\r\n', content)
+        self.assertEqual(content.count('BEGIN:VEVENT'), 2)
+        self.assertIn('UID:occurrence-%s@testserver\r\n' % self.occurrence.pk, content)
+        self.assertIn('SUMMARY:Planting\\; weeding\r\n', content)
+        self.assertIn('DESCRIPTION:Bring gloves\\nand water\r\n', content)
+        self.assertIn('DTSTART:%s\r\n' % self.start_time.astimezone(
+            timezone.utc).strftime('%Y%m%dT%H%M%SZ'), content)
+        self.assertNotIn('Other calendar', content)
+
+    def test_program_filter(self):
+        (response, content) = self.get_feed('?program=%s' % self.program.pk)
+
+        self.assertEqual(content.count('BEGIN:VEVENT'), 1)
+        self.assertNotIn('Other program', content)
+
+    def test_long_lines_folded(self):
+        self.event.description = 'é' * 200
+        self.event.save()
+
+        (response, content) = self.get_feed()
+
+        for line in content.split('\r\n'):
+            self.assertLessEqual(len(line.encode('utf-8')), 75)
+        self.assertIn('DESCRIPTION:' + 'é' * 200, content.replace('\r\n ', ''))
+
+    def test_conditional_get(self):
+        (response, _) = self.get_feed()
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        with self.assertNumQueries(1):
+            (response, _) = self.get_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        (response, _) = self.get_feed(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.create_occurrence(self.event)
+
+        (response, content) = self.get_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(content.count('BEGIN:VEVENT'), 3)
+
+    def test_missing_calendar(self):
+        response = self.client.get('/api/atria/calendars/0/feed.ics')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CalendarConditionalGetTests(APITestCase):
+    def setUp(self):
+        calendar_cache().clear()
+        event_type = EventType.objects.create(abbr='test', label='Test Event Type')
+        self.program = AtriaEventProgram.objects.create(abbr='test', label='Test Program')
+        self.other_program = AtriaEventProgram.objects.create(abbr='oth', label='Other')
+        self.calendar = AtriaCalendar.objects.create(calendar_name='Test')
+        self.start_time = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.event = AtriaEvent.objects.create(
+            title='Test', event_type=event_type, event_program=self.program,
+            calendar=self.calendar)
+        self.other_event = AtriaEvent.objects.create(
+            title='Other', event_type=event_type, event_program=self.other_program)
+        self.occurrence = AtriaOccurrence.objects.create(
+            start_time=self.start_time, end_time=self.start_time + timedelta(hours=1),
+            event=self.event, published=True)
+
+    def month_url(self, query=''):
+        return '/api/atria/calendar/%s/%s/%s' % (
+            self.start_time.year, self.start_time.month, query)
+
+    def assertNotModified(self, url, etag):
+        # one query for the watermarks, none for the occurrences
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_not_modified(self):
+        for url in (self.month_url(),
+                    self.month_url('?program=%s' % self.program.pk),
+                    '/api/atria/calendar/%s/%s/%s/?week=true' % (
+                        self.start_time.year, self.start_time.month, self.start_time.day)):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(response['ETag'].startswith('W/'))
+
+            self.assertNotModified(url, response['ETag'])
+
+    def test_modified_by_write(self):
+        url = self.month_url('?calendar=%s' % self.calendar.pk)
+        etag = self.client.get(url)['ETag']
+
+        self.occurrence.published = False
+        with commit_callbacks():
+            self.occurrence.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['occurrences'], [])
+
+    def test_other_program_writes_ignored(self):
+        url = self.month_url('?program=%s' % self.program.pk)
+        etag = self.client.get(url)['ETag']
+
+        AtriaVolunteerOpportunity.objects.create(event=self.other_event, title='Other')
+
+        self.assertNotModified(url, etag)
+        self.assertNotEqual(self.client.get(self.month_url())['ETag'], etag)
+
+    def test_moved_event(self):
+        url = self.month_url('?program=%s' % self.program.pk)
+        etag = self.client.get(url)['ETag']
+
+        self.event.event_program = self.other_program
+        self.event.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_language_in_etag(self):
+        etag = self.client.get(self.month_url())['ETag']
+
+        response = self.client.get(
+            self.month_url(), HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT_LANGUAGE='fr')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class MonthSummaryTests(APITestCase):
+    def setUp(self):
+        calendar_cache().clear()
+        event_type = EventType.objects.create(abbr='test', label='Test Event Type')
+        self.program = AtriaEventProgram.objects.create(abbr='p', label='Program')
+        self.calendars = [
+            AtriaCalendar.objects.create(
+                org_owner=AtriaOrganization.objects.create(org_name='Org %s' % i),
+                calendar_name='Events %s' % i)
+            for i in range(2)]
+        self.events = [
+            AtriaEvent.objects.create(
+                title='Event %s' % i, event_type=event_type,
+                event_program=self.program, calendar=calendar)
+            for (i, calendar) in enumerate(self.calendars)]
+
+        # 11pm in Vancouver is the next day in UTC; counted on the local day
+        for (event, day) in ((self.events[0], 16), (self.events[0], 16), (self.events[1], 31)):
+            start_time = timezone.make_aware(datetime(2019, 10, day, 23))
+            AtriaOccurrence.objects.create(
+                start_time=start_time, end_time=start_time + timedelta(hours=1),
+                event=event, published=True)
+        AtriaOccurrence.objects.create(
+            start_time=timezone.make_aware(datetime(2019, 10, 17, 9)),
+            end_time=timezone.make_aware(datetime(2019, 10, 17, 10)),
+            event=self.events[0], published=False)
+
+    def summary(self, query=''):
+        response = self.client.get('/api/atria/calendar/2019/10/summary/' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        return {day['date']: day['count'] for day in json.loads(response.content)['days'] if day['count']}
+
+    def test_summary(self):
+        response = self.client.get('/api/atria/calendar/2019/10/summary/')
+        days = json.loads(response.content)['days']
+
+        # Sunday Sep 29 to Saturday Nov 9
+        self.assertEqual(len(days), 42)
+        self.assertEqual((days[0]['date'], days[-1]['date']), ('2019-09-29', '2019-11-09'))
+        self.assertEqual(self.summary(), {'2019-10-16': 2, '2019-10-31': 1})
+        self.assertEqual(
+            self.summary('?calendar=%s' % self.calendars[1].id), {'2019-10-31': 1})
+        self.assertEqual(self.summary('?connected=true'), {})
+
+    def test_summary_query(self):
+        with self.assertNumQueries(1):
+            query_month_summary(month_grid_days(2019, 10), [c.id for c in self.calendars])
+
+    def test_summary_writes(self):
+        occurrence = AtriaOccurrence.objects.get(published=False)
+        occurrence.published = True
+        occurrence.save()
+        self.assertEqual(self.summary()['2019-10-17'], 1)
+
+        occurrence.start_time = occurrence.start_time + timedelta(days=1)
+        occurrence.save()
+        self.assertEqual(
+            self.summary(), {'2019-10-16': 2, '2019-10-18': 1, '2019-10-31': 1})
+
+        occurrence.delete()
+        self.events[1].calendar = self.calendars[0]
+        self.events[1].save()
+        self.assertEqual(
+            self.summary('?calendar=%s' % self.calendars[0].id),
+            {'2019-10-16': 2, '2019-10-31': 1})
@@ -15,11 +15,17 @@ urlpatterns = [
     path('calendar/', include([
         path('<int:year>/', include([
             path('<int:month>/', event_month_view, name='event-month-view'),
+            path('<int:month>/summary/', event_month_summary_view, name='event-month-summary-view'),
             path('<int:month>/<int:day>/', event_day_view, name='event-day-view'),
         ])),
     ])),    
     path('events/', AtriaEventView.as_view()),
     path('calendars/', AtriaCalendarView.as_view()),
+    path('calendars/<int:calendar_id>/feed.ics', calendar_feed_view, name='calendar-feed'),
     path('programs/', AtriaProgramView.as_view()),
+    path('lookups/', AtriaLookupsView.as_view(), name='lookups'),
+    path('search/', search_view, name='search'),
+    path('neighbours/', neighbour_search_view, name='neighbour-search'),
+    path('organizations/', organization_search_view, name='organization-search'),
 #    url(r'^$', schema_view),
 ]
@@ -1,21 +1,41 @@
-from django.shortcuts import render
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import close_old_connections, connection
+from django.db.models import Sum, prefetch_related_objects
+from django.shortcuts import get_object_or_404, render
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone, translation
+from django.views.decorators.http import condition
 
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
+from rest_framework.utils import encoders
 
 import asyncio
+import hashlib
+import itertools
 import json
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
 import calendar
 
+from atriacalendar.cache import cached_calendar_data
 from atriacalendar.models import *
-from swingtime import models as swingtime_models
-
+from atriacalendar.recurrence import (
+    filter_recurring_events, merge_occurrences, recurring_events, virtual_occurrences)
+from atriacalendar.routers import current_routing, request_routing
+from atriacalendar.search import search_occurrences
+from atriacalendar.directory import (
+    NEIGHBOUR_LIST_FIELDS, ORGANIZATION_LIST_FIELDS, search_neighbours, search_organizations)
+from atriacalendar.views import directory_filters, search_filters
+from atriacalendar.watermarks import request_watermarks
+
+from . import ical
 from .serializers import *
 
 
@@ -23,64 +43,282 @@ from .serializers import *
 ###########################################
 # API views to support REST services
 ###########################################
+def calendar_lookup():
+    calendars = AtriaCalendarSerializer.setup_eager_loading(AtriaCalendar.objects.all())
+    return AtriaCalendarSerializer(calendars, many=True).data
+
+
+def program_lookup():
+    return AtriaProgramSerializer(AtriaEventProgram.objects.all(), many=True).data
+
+
+lookup_executor = None
+lookup_executor_lock = threading.Lock()
+
+
+def get_lookup_executor():
+    global lookup_executor
+
+    with lookup_executor_lock:
+        if lookup_executor is None:
+            lookup_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'API_LOOKUP_THREADS', 4),
+                thread_name_prefix='atria-lookup')
+
+    return lookup_executor
+
+
+def run_lookup(build, language, routing):
+    # Runs a lookup in a worker thread, which keeps its own database
+    # connection between requests (subject to CONN_MAX_AGE), reading from
+    # the database its request reads from.
+    close_old_connections()
+    try:
+        with translation.override(language), request_routing(*routing):
+            return build()
+    finally:
+        close_old_connections()
+
+
+def concurrent_lookups(*builds):
+    # Functions -> List
+    # Produce the results of the independent lookups builds, running them at
+    # the same time in the lookup threads.  Inside a transaction they run in
+    # turn, since other connections would not see its changes.
+    if getattr(settings, 'API_LOOKUP_THREADS', 4) < 2 or connection.in_atomic_block:
+        return [build() for build in builds]
+
+    language = translation.get_language()
+    routing = current_routing()
+    futures = [get_lookup_executor().submit(run_lookup, build, language, routing)
+               for build in builds]
+    return [future.result() for future in futures]
+
+
 class AtriaCalendarView(APIView):
 
     def get(self, request):
-        calendars = AtriaCalendar.objects.all()
-        serializer = AtriaCalendarSerializer(calendars, many=True)
-        return Response({"calendars": serializer.data})
+        return Response({"calendars": calendar_lookup()})
 
 
 class AtriaProgramView(APIView):
 
     def get(self, request):
-        programs = AtriaEventProgram.objects.all()
-        serializer = AtriaProgramSerializer(programs, many=True)
-        return Response({"programs": serializer.data})
+        return Response({"programs": program_lookup()})
+
+
+class AtriaLookupsView(APIView):
+    """
+    The calendars and programs together, for clients building their filters
+    in one request.
+    """
+
+    def get(self, request):
+        (calendars, programs) = concurrent_lookups(calendar_lookup, program_lookup)
+        return Response({"calendars": calendars, "programs": programs})
 
 
 class AtriaEventView(APIView):
+    """
+    Lists events ordered by id, a page at a time.
+
+    Pass the ``next_cursor`` of a response as ``cursor`` to get the next page,
+    and ``page_size`` to change the page size.  With ``stream=true`` all the
+    events after ``cursor`` are written out as they are read from the
+    database.
+    """
     #permission_classes = (IsAuthenticated,)
 
     def get(self, request):
-        events = AtriaEvent.objects.all()
-        serializer = AtriaEventSerializer(events, many=True)
-        return Response({"events": serializer.data})
+        try:
+            cursor = int(request.GET.get('cursor') or 0)
+            page_size = int(request.GET.get(
+                'page_size', getattr(settings, 'API_EVENTS_PAGE_SIZE', 100)))
+        except ValueError:
+            return Response({"detail": "Invalid cursor or page_size."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        page_size = max(1, min(
+            page_size, getattr(settings, 'API_EVENTS_MAX_PAGE_SIZE', 1000)))
+        events = AtriaEvent.objects.filter(id__gt=cursor).order_by('id')
+
+        if request.GET.get('stream'):
+            return StreamingHttpResponse(
+                stream_events(events), content_type='application/json')
+
+        events = list(AtriaEventSerializer.setup_eager_loading(events)[:page_size + 1])
+        next_cursor = events[page_size - 1].id if len(events) > page_size else None
+        serializer = AtriaEventSerializer(events[:page_size], many=True)
+        return Response({"events": serializer.data, "next_cursor": next_cursor})
+
+
+def stream_events(events):
+    # QuerySet -> Iterator
+    # Produce the serialized events as chunks of a JSON document, reading them
+    # in batches so memory use does not depend on the number of events.
+    (select_related, prefetch_related) = AtriaEventSerializer.related_fields()
+    chunk_size = getattr(settings, 'API_STREAM_CHUNK_SIZE', 500)
+    events = events.select_related(*select_related).iterator(chunk_size=chunk_size)
+    separator = ''
+
+    yield '{"events": ['
+    while True:
+        chunk = list(itertools.islice(events, chunk_size))
+        if not chunk:
+            break
+
+        prefetch_related_objects(chunk, *prefetch_related)
+        for event in chunk:
+            yield separator + json.dumps(
+                AtriaEventSerializer(event).data, cls=encoders.JSONEncoder)
+            separator = ','
+    yield ']}'
+
+
+def filter_ids(request, name):
+    # HttpRequest, String -> List
+    # Produce the sorted ids passed as name (repeated, or comma separated),
+    # or None if there are none.  Raises ValueError for ids that aren't
+    # numbers, or more of them than API_MAX_FILTER_IDS.
+
+    values = [
+        value.strip() for param in request.GET.getlist(name)
+        for value in param.split(',') if value.strip()
+    ]
+    if not values:
+        return None
+
+    try:
+        ids = sorted(set(int(value) for value in values))
+    except ValueError:
+        raise ValueError('Invalid %s id.' % name)
+
+    max_ids = getattr(settings, 'API_MAX_FILTER_IDS', 100)
+    if len(ids) > max_ids:
+        raise ValueError('At most %d %s ids can be given.' % (max_ids, name))
+
+    return ids
+
+
+def connected_calendar_ids(request):
+    # HttpRequest -> List
+    # Produce the ids of the calendars of the orgs the user is a member of,
+    # read once per request.
+
+    if '_atria_connected_calendars' not in request.__dict__:
+        calendar_ids = []
+        if request.user.is_authenticated:
+            calendar_ids = list(AtriaCalendar.objects.filter(
+                org_owner__atriarelationship__user=request.user,
+                org_owner__atriarelationship__relation_type__relation_type='Member',
+            ).order_by('id').values_list('id', flat=True).distinct())
+        request._atria_connected_calendars = calendar_ids
+
+    return request._atria_connected_calendars
 
 
 def get_event_filters(request):
-    atriacalendar = request.GET.get('calendar')
-    program = request.GET.get('program')
-    return (atriacalendar, program)
-
-
-def period_occurrences(start, end, atriacalendar=None, program=None):
-    occurrences = swingtime_models.Occurrence.objects.filter(
-            models.Q(
-                start_time__gte=start,
-                start_time__lte=end,
-            ) |
-            models.Q(
-                end_time__gte=start,
-                end_time__lte=end,
-            ) |
-            models.Q(
-                start_time__lt=start,
-                end_time__gt=end
-            )).all()
-    if atriacalendar:
-        occurrences = occurrences.filter(event__atriaevent__calendar__id=atriacalendar).all()
-    if program:
-        occurrences = occurrences.filter(event__atriaevent__event_program__id=program).all()
-    occurrences = occurrences.filter(atriaoccurrence__published=True).all()
-    occurrences = occurrences.order_by("start_time")
+    # HttpRequest -> Tuple
+    # Produce the (calendar ids, program ids) a calendar request is limited
+    # to, each None for no limit.  With connected=true the calendars of the
+    # user's orgs are added to the calendar ids (so a user without any
+    # gets no occurrences).
+
+    calendar_ids = filter_ids(request, 'calendar')
+    program_ids = filter_ids(request, 'program')
+
+    if request.GET.get('connected') in ('1', 'true'):
+        calendar_ids = sorted(set(calendar_ids or []) | set(connected_calendar_ids(request)))
+        max_ids = getattr(settings, 'API_MAX_FILTER_IDS', 100)
+        if len(calendar_ids) > max_ids:
+            raise ValueError('At most %d calendar ids can be given.' % max_ids)
+
+    return (calendar_ids, program_ids)
+
+
+def event_filters_error(error):
+    return JsonResponse({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def calendar_etag(request, *args, **kwargs):
+    # The calendar views give the same response for the same URL, filters and
+    # language until one of the watermarks covering their filters moves.
+    try:
+        (calendar_ids, program_ids) = get_event_filters(request)
+    except ValueError:
+        return None
+    (versions, _) = request_watermarks(request, calendar_ids, program_ids)
+    raw_etag = repr((request.get_full_path(), calendar_ids, program_ids,
+                     translation.get_language(), versions))
+    return hashlib.md5(raw_etag.encode('utf-8')).hexdigest()
+
+
+def calendar_last_modified(request, *args, **kwargs):
+    try:
+        (calendar_ids, program_ids) = get_event_filters(request)
+    except ValueError:
+        return None
+    return request_watermarks(request, calendar_ids, program_ids)[1]
+
+
+calendar_condition = condition(
+    etag_func=calendar_etag, last_modified_func=calendar_last_modified)
+
+
+def period_occurrences(start, end, calendar_ids=None, program_ids=None):
+    return cached_calendar_data(
+        'period-occurrences',
+        (calendar_ids, program_ids, start.isoformat(), end.isoformat()),
+        lambda: query_period_occurrences(start, end, calendar_ids, program_ids))
+
+
+def published_occurrences(start, end, calendar_ids=None, program_ids=None):
+    # Datetime, Datetime, List, List -> QuerySet
+    # Produce the published occurrences overlapping start to end, of the
+    # given calendars and programs (None for any), by start time.
+    occurrences = AtriaOccurrence.objects.filter(
+            period_overlap_q(start, end)).all()
+    if calendar_ids is not None:
+        occurrences = occurrences.filter(event__atriaevent__calendar__id__in=calendar_ids).all()
+    if program_ids is not None:
+        occurrences = occurrences.filter(event__atriaevent__event_program__id__in=program_ids).all()
+    occurrences = occurrences.filter(published=True).all()
+    return occurrences.order_by("start_time")
+
+
+def published_virtual_occurrences(start, end, calendar_ids=None, program_ids=None):
+    # Datetime, Datetime, List, List -> List
+    # Produce the published repetitions of the recurrence rules of the given
+    # calendars and programs (None for any) overlapping start to end, that
+    # aren't stored as occurrences.
+    events = filter_recurring_events(
+        recurring_events(start, end).filter(recurrence_published=True),
+        calendar_ids, program_ids)
+    events = AtriaEventSerializer.setup_eager_loading(events)\
+        .select_related('event_program')
+    return virtual_occurrences(events, start, end)
+
+
+def query_period_occurrences(start, end, calendar_ids=None, program_ids=None):
+    if calendar_ids == [] or program_ids == []:
+        return []
+
+    occurrences = published_occurrences(start, end, calendar_ids, program_ids)
+    occurrences = AtriaOccurrenceSerializer.setup_eager_loading(occurrences)
+    virtual = published_virtual_occurrences(start, end, calendar_ids, program_ids)
+    if virtual:
+        occurrences = merge_occurrences(occurrences, virtual)
     serializer = AtriaOccurrenceSerializer(occurrences, many=True)
 
     return serializer.data
 
 
+@calendar_condition
 def event_month_view(request, year, month):
-    (atriacalendar, program) = get_event_filters(request)
+    try:
+        (calendar_ids, program_ids) = get_event_filters(request)
+    except ValueError as e:
+        return event_filters_error(e)
 
     start_dt = datetime(year, month, 1)
     end_dt = datetime(year, month, calendar.monthrange(year, month)[1])
@@ -93,18 +331,63 @@ def event_month_view(request, year, month):
     idx = (end.weekday() + 1) % 7 # MON = 0, SUN = 6 -> SUN = 0 .. SAT = idx-6
     end = end + timedelta(7-(idx+1))
 
-    occurrence_data = period_occurrences(start, end, atriacalendar, program)
+    occurrence_data = period_occurrences(start, end, calendar_ids, program_ids)
 
     return JsonResponse({"year": year, "month": month, "start_dt": start, "end_dt": end,  "occurrences": occurrence_data})
 
 
+def month_grid_days(year, month):
+    # Integer, Integer -> List
+    # Produce the 42 days of a month grid, from the Sunday on or before the
+    # first of the month.
+    first = date(year, month, 1)
+    start = first - timedelta((first.weekday() + 1) % 7)
+    return [start + timedelta(days=i) for i in range(42)]
+
+
+def query_month_summary(days, calendar_ids=None, program_ids=None):
+    # List, List, List -> List
+    # Produce the number of published occurrences starting on each of the
+    # days, of the given calendars and programs (None for any), from the
+    # daily counts.
+    if calendar_ids == [] or program_ids == []:
+        counts = {}
+    else:
+        cells = AtriaDailyCount.objects.filter(day__gte=days[0], day__lte=days[-1])
+        if calendar_ids is not None:
+            cells = cells.filter(calendar_id__in=calendar_ids)
+        if program_ids is not None:
+            cells = cells.filter(event_program_id__in=program_ids)
+        counts = dict(cells.order_by().values_list('day').annotate(total=Sum('count')))
+
+    return [{"date": day, "count": counts.get(day, 0)} for day in days]
+
+
+@calendar_condition
+def event_month_summary_view(request, year, month):
+    try:
+        (calendar_ids, program_ids) = get_event_filters(request)
+    except ValueError as e:
+        return event_filters_error(e)
+
+    # one query on the daily counts, cheap enough not to cache
+    days = month_grid_days(year, month)
+    summary = query_month_summary(days, calendar_ids, program_ids)
+
+    return JsonResponse({"year": year, "month": month, "start_dt": days[0], "end_dt": days[-1], "days": summary})
+
+
+@calendar_condition
 def event_week_view(request, year, month, day):
-    (atriacalendar, program) = get_event_filters(request)
+    try:
+        (calendar_ids, program_ids) = get_event_filters(request)
+    except ValueError as e:
+        return event_filters_error(e)
 
     start = datetime(year, month, day)
     end = start + timedelta(weeks=1, seconds=-1)
 
-    occurrence_data = period_occurrences(start, end, atriacalendar, program)
+    occurrence_data = period_occurrences(start, end, calendar_ids, program_ids)
 
     return JsonResponse({
         "year": year,
@@ -115,19 +398,146 @@ def event_week_view(request, year, month, day):
     })
 
 
+@calendar_condition
 def event_day_view(request, year, month, day):
     if request.GET.get('week'):
         return event_week_view(request, year, month, day)
 
-    (atriacalendar, program) = get_event_filters(request)
+    try:
+        (calendar_ids, program_ids) = get_event_filters(request)
+    except ValueError as e:
+        return event_filters_error(e)
 
     start_dt = datetime(year, month, day)
     end_dt = start_dt
     start = datetime(start_dt.year, start_dt.month, start_dt.day)
     end = end_dt.replace(hour=23, minute=59, second=59)
 
-    occurrence_data = period_occurrences(start, end, atriacalendar, program)
+    occurrence_data = period_occurrences(start, end, calendar_ids, program_ids)
 
     return JsonResponse({"year": year, "month": month, "day": day, "start_dt": start, "end_dt": end,  "occurrences": occurrence_data})
 
 
+def feed_window():
+    # -> Tuple
+    # Produce the start and end of the period a calendar feed covers.
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    return (today - timedelta(days=getattr(settings, 'ICAL_FEED_PAST_DAYS', 30)),
+            today + timedelta(days=getattr(settings, 'ICAL_FEED_FUTURE_DAYS', 365)))
+
+
+def feed_program_ids(request):
+    try:
+        return filter_ids(request, 'program')
+    except ValueError:
+        return None
+
+
+def feed_etag(request, calendar_id):
+    program_ids = feed_program_ids(request)
+    (start, _) = feed_window()
+    (versions, _) = request_watermarks(request, [calendar_id], program_ids)
+    raw_etag = repr((calendar_id, program_ids, translation.get_language(),
+                     versions, start.date().isoformat()))
+    return hashlib.md5(raw_etag.encode('utf-8')).hexdigest()
+
+
+def feed_last_modified(request, calendar_id):
+    # the feed window moves every day, even if the calendar doesn't change
+    program_ids = feed_program_ids(request)
+    modified = request_watermarks(request, [calendar_id], program_ids)[1]
+    return max(modified or feed_window()[0], feed_window()[0])
+
+
+@condition(etag_func=feed_etag, last_modified_func=feed_last_modified)
+def calendar_feed_view(request, calendar_id):
+    """
+    An iCalendar feed of the published occurrences of a calendar, optionally
+    limited to some ``program`` ids, for calendar clients to subscribe to.
+    """
+    atriacalendar = get_object_or_404(AtriaCalendar, pk=calendar_id)
+    try:
+        program_ids = filter_ids(request, 'program')
+    except ValueError as e:
+        return event_filters_error(e)
+    (start, end) = feed_window()
+
+    occurrences = published_occurrences(start, end, [calendar_id], program_ids)\
+        .select_related('event__atriaevent__event_program')
+    virtual = published_virtual_occurrences(start, end, [calendar_id], program_ids)
+    response = StreamingHttpResponse(
+        stream_calendar_feed(
+            atriacalendar, occurrences, request.get_host(),
+            feed_last_modified(request, calendar_id), virtual),
+        content_type='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = 'inline; filename="calendar-%s.ics"' % calendar_id
+    return response
+
+
+def stream_calendar_feed(atriacalendar, occurrences, domain, dtstamp, virtual=()):
+    # AtriaCalendar, QuerySet, String, Datetime, List -> Iterator
+    # Produce the feed a VEVENT at a time, reading the occurrences through a
+    # (server-side, where supported) cursor, then the virtual occurrences.
+    yield ical.calendar_header(atriacalendar.calendar_name)
+    for occurrence in occurrences.iterator(
+            chunk_size=getattr(settings, 'API_STREAM_CHUNK_SIZE', 500)):
+        yield ical.occurrence_event(occurrence, domain, dtstamp)
+    for occurrence in virtual:
+        yield ical.occurrence_event(occurrence, domain, dtstamp)
+    yield ical.calendar_footer()
+
+
+def search_view(request):
+    filters = search_filters(request)
+    filters['start'] = filters['start'] or timezone.now().date()
+
+    occurrences = search_occurrences(
+        AtriaOccurrence.objects.filter(published=True), **filters)
+    occurrences = AtriaOccurrenceSerializer.setup_eager_loading(occurrences)
+    page = Paginator(
+        occurrences, getattr(settings, 'SEARCH_PAGE_SIZE', 25)
+    ).get_page(request.GET.get('page'))
+    serializer = AtriaOccurrenceSerializer(page.object_list, many=True)
+
+    return JsonResponse({
+        "query": filters['query'],
+        "page": page.number,
+        "num_pages": page.paginator.num_pages,
+        "count": page.paginator.count,
+        "occurrences": serializer.data,
+    })
+
+
+def neighbour_search_view(request):
+    filters = directory_filters(request)
+    (neighbours, next_after) = search_neighbours(**filters)
+
+    return JsonResponse({
+        "query": filters['query'],
+        "match": filters['match'],
+        "next": next_after,
+        "neighbours": [
+            {field: getattr(neighbour, field) for field in NEIGHBOUR_LIST_FIELDS}
+            for neighbour in neighbours
+        ],
+    })
+
+
+def organization_search_view(request):
+    filters = directory_filters(request)
+    del filters['after']
+    filters['compact'] = request.GET.get('compact') == '1'
+    page = search_organizations(page=request.GET.get('page'), **filters)
+
+    fields = ORGANIZATION_LIST_FIELDS + (() if filters['compact'] else ('description',))
+    return JsonResponse({
+        "query": filters['query'],
+        "match": filters['match'],
+        "page": page.number,
+        "num_pages": page.paginator.num_pages,
+        "count": page.paginator.count,
+        "organizations": [
+            {field: getattr(org, field) for field in fields}
+            for org in page.object_list
+        ],
+    })
@@ -45,8 +45,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'atriacalendar.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'atriacalendar.middleware.RequestMetricsMiddleware',
     'atriacalendar.middleware.URLPermissionsMiddleware',
 ]
 
@@ -82,11 +84,35 @@ URL_NAMESPACE_PERMISSIONS = {
     ORG_NAMESPACE: (DEFAULT_ORG_ROLE,),
 }
 
+# number of URLs the snurl template tag keeps reversed, by view, arguments
+# and language
+SNURL_CACHE_SIZE = 4096
+
 SWINGTIME = {
     'TIMESLOT_START_TIME': datetime.time(14),
     'TIMESLOT_END_TIME_DURATION': datetime.timedelta(hours=6.5)
 }
 
+# Occurrences longer than LONG_OCCURRENCE_DURATION are also indexed in
+# fixed-width buckets, so that period queries can bound their start_time range
+# (run rebuild_occurrence_buckets after enabling it or changing the durations)
+OCCURRENCE_INTERVAL_INDEX = {
+    'ENABLED': False,
+    'LONG_OCCURRENCE_DURATION': datetime.timedelta(days=1),
+    'BUCKET_DURATION': datetime.timedelta(days=7),
+}
+
+# Per-request query/timing metrics (see atriacalendar.metrics), served to
+# METRICS_ALLOWED_IPS and staff at /metrics
+REQUEST_METRICS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'SLOW_REQUEST_QUERIES': 100,
+    'SLOW_REQUEST_TOP_SQL': 5,
+    'METRICS_ALLOWED_IPS': ('127.0.0.1', '::1'),
+}
+
 try:
     import django_extensions
 except ImportError:
@@ -104,8 +130,57 @@ DATABASES = {
     }
 }
 
+# Read replicas (see atriacalendar.routers).  GET and HEAD requests to
+# REPLICA_READ_PATHS read from a healthy alias of DATABASE_REPLICAS, unless
+# their client wrote in the last REPLICA_PIN_SECONDS; replicas are checked
+# every REPLICA_HEALTH_CHECK_SECONDS and reads fall back to default when none
+# is healthy.
+#
+# To try it out locally with two SQLite files, migrate, copy db.sqlite3 to
+# db-replica.sqlite3 and run with ATRIA_SQLITE_REPLICA=1; rows written after
+# the copy are only visible to clients pinned to the primary.
+
+if os.environ.get('ATRIA_SQLITE_REPLICA'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['atriacalendar.routers.ReplicaRouter']
+
+REPLICA_READ_PATHS = (
+    r'^/api/atria/',
+    r'^(/[^/]+)?/(event|opportunity)/\d+/(at/[^/]+/)?(\d+/)?$',
+    r'^(/[^/]+)?/(search_event|search_opportunity|search_neighbour|search_organization)/$',
+    r'^(/[^/]+)?/(view_neighbour|view_organization)/',
+)
+REPLICA_PIN_SECONDS = 5
+REPLICA_HEALTH_CHECK_SECONDS = 30
+
 AUTH_USER_MODEL = 'atriacalendar.User'
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+#
+# Any backend supporting incr() works for the calendar cache, e.g.
+# django.core.cache.backends.filebased.FileBasedCache or a Redis backend such
+# as django_redis.cache.RedisCache for multi-process deployments.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CALENDAR_CACHE_ALIAS = 'default'
+CALENDAR_CACHE_TIMEOUT = 60 * 60 * 24
+
+# rendered event news-feed cards, kept in the template_fragments cache if
+# there is one, otherwise default
+NEWSFEED_CARD_CACHE_TIMEOUT = 60 * 60
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -156,3 +231,39 @@ STATIC_URL = '/static/'
 REST_FRAMEWORK = {
     'DATETIME_FORMAT': '%Y-%m-%dT%H:%M:%S%z',
 }
+
+API_EVENTS_PAGE_SIZE = 100
+API_EVENTS_MAX_PAGE_SIZE = 1000
+API_STREAM_CHUNK_SIZE = 500
+
+# Most calendar or program ids one calendar API request can be limited to
+API_MAX_FILTER_IDS = 100
+
+# Threads (per process) running the lookups of the combined lookups endpoint
+# at the same time; less than 2 runs them in turn
+API_LOOKUP_THREADS = 4
+
+# Days before and after today covered by the iCalendar feeds
+ICAL_FEED_PAST_DAYS = 30
+ICAL_FEED_FUTURE_DAYS = 365
+
+# Full-text search over events and opportunities (see atriacalendar.search)
+SEARCH_PAGE_SIZE = 25
+SEARCH_MAX_EVENTS = 500
+
+# How repeating series are stored (see atriacalendar.recurrence): 'rows'
+# stores every repetition as an occurrence, 'rule' stores an event's first
+# series as a recurrence rule, expanded when calendars are queried
+EVENT_RECURRENCE_STORAGE = 'rows'
+
+# Rows per page of the Create/Manage occurrence list
+CREATE_MANAGE_PAGE_SIZE = 50
+
+# Bulk publish/unpublish/copy (see atriacalendar.bulk): occurrences per
+# transaction, and whether background operations run in a thread of the web
+# process (otherwise they wait for the run_bulk_operations command)
+BULK_OPERATION_CHUNK_SIZE = 500
+BULK_OPERATION_THREADS = True
+# a running operation whose runner hasn't finished a chunk for this long is
+# taken to have died, and can be claimed again
+BULK_OPERATION_LEASE_SECONDS = 10 * 60
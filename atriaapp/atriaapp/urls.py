@@ -4,6 +4,7 @@ from django.urls import include, path
 from django.conf.urls import url
 
 from atriacalendar.urls import urlpatterns as atriacalendar_urlpatterns
+from atriacalendar.views import metrics_view
 
 
 urlpatterns = [
@@ -11,6 +12,7 @@ urlpatterns = [
     #url(r'^api-auth/', include('rest_framework.urls')),
     path('api/atria/', include('atriaapi.urls')),
     path('i18n/', include('django.conf.urls.i18n')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 urlpatterns += i18n_patterns(
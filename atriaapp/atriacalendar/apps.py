@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class AtriacalendarConfig(AppConfig):
     name = 'atriacalendar'
+
+    def ready(self):
+        # connect the cache invalidation, profile summary, search indexing,
+        # change watermark and daily count signal handlers
+        from . import cache, profiles, rollups, search, watermarks
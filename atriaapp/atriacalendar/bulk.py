@@ -0,0 +1,317 @@
+"""
+Bulk publish, unpublish and copy of occurrences.
+
+An ``AtriaBulkOperation`` selects occurrences by id, by id range or by the
+Create/Manage list filters (status, program, dates), and is applied in
+chunks of BULK_OPERATION_CHUNK_SIZE occurrences in id order, each in its
+own transaction.  That keeps every UPDATE's id list and lock short however
+many occurrences are selected, and records progress (``processed`` out of
+``total``) after every chunk.  Occurrences created after the operation
+started, including its own copies, are never picked up.  A publish or
+unpublish can also select recurring events by id (``event_ids``), whose
+rules are published after the occurrences (``publish_recurrence``).
+
+Operations run in the request that creates them, in a background thread
+(BULK_OPERATION_THREADS), or in the run_bulk_operations command.  A runner
+holds its operation by renewing ``heartbeat`` after every chunk; if it dies,
+the operation can be claimed again once the heartbeat is older than
+BULK_OPERATION_LEASE_SECONDS, and resumes from ``last_id``.
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .cache import bump_calendar_versions
+from .models import AtriaBulkOperation, AtriaEvent, AtriaOccurrence
+from .recurrence import publish_recurrence
+from .rollups import occurrences_counts_changed
+from .series import create_occurrences
+from .watermarks import touch_watermarks
+
+
+logger = logging.getLogger('atriacalendar.bulk')
+
+OCCURRENCE_STATUSES = ('upcoming', 'past', 'draft', 'published')
+CRITERIA_FILTERS = ('status', 'program', 'start', 'end')
+
+
+def filter_occurrences(occurrences, status='', program=None, start=None, end=None):
+    # QuerySet, String, Integer, Date, Date -> QuerySet
+    # Produce the occurrences with the given status and program, starting in
+    # the given date range.  Dates are compared as local day boundaries so
+    # the start_time index stays usable.
+
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    if status == 'upcoming':
+        occurrences = occurrences.filter(start_time__gte=today)
+    elif status == 'past':
+        occurrences = occurrences.filter(start_time__lt=today)
+    elif status == 'draft':
+        occurrences = occurrences.filter(published=False)
+    elif status == 'published':
+        occurrences = occurrences.filter(published=True)
+
+    if program:
+        occurrences = occurrences.filter(event__atriaevent__event_program__id=program)
+    if start:
+        occurrences = occurrences.filter(
+            start_time__gte=timezone.make_aware(datetime.combine(start, datetime.min.time())))
+    if end:
+        occurrences = occurrences.filter(
+            start_time__lt=timezone.make_aware(
+                datetime.combine(end + timezone.timedelta(days=1), datetime.min.time())))
+
+    return occurrences
+
+
+def filter_recurrences(events, status='', program=None, start=None, end=None):
+    # QuerySet, String, Integer, Date, Date -> QuerySet
+    # Produce the recurring events with repetitions matching the
+    # filter_occurrences criteria: upcoming or past repetitions, a draft or
+    # published rule, the program and repetitions in the date range.
+
+    events = events.exclude(recurrence_rule='')
+
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    if status == 'upcoming':
+        events = events.filter(recurrence_end__gte=today)
+    elif status == 'past':
+        events = events.filter(recurrence_start__lt=today)
+    elif status == 'draft':
+        events = events.filter(recurrence_published=False)
+    elif status == 'published':
+        events = events.filter(recurrence_published=True)
+
+    if program:
+        events = events.filter(event_program__id=program)
+    if start:
+        events = events.filter(
+            recurrence_end__gte=timezone.make_aware(datetime.combine(start, datetime.min.time())))
+    if end:
+        events = events.filter(
+            recurrence_start__lt=timezone.make_aware(
+                datetime.combine(end + timezone.timedelta(days=1), datetime.min.time())))
+
+    return events
+
+
+def occurrences_changed(queryset):
+    # Invalidates cached calendar data, moves the change watermarks and
+    # recounts the daily counts for occurrences updated in bulk
+    # (queryset.update() sends no signals).
+    events = set(queryset.values_list(
+        'event__atriaevent__calendar_id', 'event__atriaevent__event_program_id'))
+    bump_calendar_versions(calendar_id for (calendar_id, _) in events)
+    touch_watermarks(
+        [calendar_id for (calendar_id, _) in events],
+        [program_id for (_, program_id) in events])
+    occurrences_counts_changed(queryset)
+
+
+def operation_occurrences(operation):
+    # AtriaBulkOperation -> QuerySet
+    # Produce the occurrences of the operation's org (or user's orgs)
+    # matching its id range and filter criteria.  Explicit ids are applied
+    # chunk by chunk in operation_chunks.
+
+    if operation.org_id:
+        occurrences = AtriaOccurrence.objects.get_for_org_id(operation.org_id)
+    else:
+        occurrences = AtriaOccurrence.objects.get_for_user(operation.user)
+
+    criteria = json.loads(operation.criteria)
+    filters = {name: criteria[name] for name in CRITERIA_FILTERS if criteria.get(name)}
+    for name in ('start', 'end'):
+        if name in filters:
+            filters[name] = parse_date(filters[name])
+    occurrences = filter_occurrences(occurrences, **filters)
+
+    id_ranges = criteria.get('id_ranges')
+    if id_ranges:
+        in_ranges = models.Q()
+        for (first, last) in id_ranges:
+            in_ranges |= models.Q(id__range=(first, last))
+        occurrences = occurrences.filter(in_ranges)
+
+    if operation.max_id is not None:
+        occurrences = occurrences.filter(id__lte=operation.max_id)
+
+    return occurrences
+
+
+def operation_recurrences(operation):
+    # AtriaBulkOperation -> QuerySet
+    # Produce the recurring events of the operation's org (or user's orgs)
+    # it selects by id, if it publishes or unpublishes.
+
+    event_ids = json.loads(operation.criteria).get('event_ids')
+    if not event_ids or operation.action not in ('publish', 'unpublish'):
+        return AtriaEvent.objects.none()
+
+    if operation.org_id:
+        events = AtriaEvent.objects.filter(calendar__org_owner_id=operation.org_id)
+    else:
+        events = AtriaEvent.objects.filter(
+            calendar__org_owner__atriarelationship__user=operation.user)
+
+    return events.exclude(recurrence_rule='').filter(pk__in=event_ids)
+
+
+def operation_chunks(operation, occurrences, chunk_size):
+    # AtriaBulkOperation, QuerySet, Integer -> Generator
+    # Produce (ids, considered, last id) for each chunk of the operation's
+    # occurrences after operation.last_id, where considered is the number of
+    # selected ids the chunk accounts for.
+
+    ids = json.loads(operation.criteria).get('ids')
+    last_id = operation.last_id
+
+    while True:
+        if ids is not None:
+            candidates = [pk for pk in ids if pk > last_id][:chunk_size]
+            if not candidates:
+                return
+            chunk = list(occurrences.filter(id__in=candidates)
+                         .order_by('id').values_list('id', flat=True))
+            last_id = candidates[-1]
+            yield (chunk, len(candidates), last_id)
+        else:
+            chunk = list(occurrences.filter(id__gt=last_id)
+                         .order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not chunk:
+                return
+            last_id = chunk[-1]
+            yield (chunk, len(chunk), last_id)
+
+
+def apply_chunk(operation, ids):
+    # Applies the operation's action to the occurrences with the given ids.
+    occurrences = AtriaOccurrence.objects.filter(id__in=ids)
+
+    if operation.action == 'publish':
+        occurrences.update(published=True, publisher=operation.user)
+    elif operation.action == 'unpublish':
+        occurrences.update(published=False, publisher=None)
+    elif operation.action == 'copy':
+        shift = timezone.timedelta(days=operation.copy_days)
+        create_occurrences([
+            AtriaOccurrence(
+                start_time=occurrence.start_time + shift,
+                end_time=occurrence.end_time + shift,
+                event_id=occurrence.event_id)
+            for occurrence in occurrences.order_by('id').only(
+                'start_time', 'end_time', 'event_id')
+        ], contact=operation.user)
+
+    occurrences_changed(occurrences)
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def claimable_operations(now=None):
+    # Datetime -> Q
+    # Produce a filter for the operations a runner may claim: pending and
+    # failed ones, and running ones whose lease has run out.
+
+    expired = (now or timezone.now()) - timezone.timedelta(
+        seconds=getattr(settings, 'BULK_OPERATION_LEASE_SECONDS', 600))
+    return models.Q(status__in=('pending', 'failed')) | \
+        models.Q(status='running', heartbeat__lt=expired) | \
+        models.Q(status='running', heartbeat__isnull=True, started__lt=expired)
+
+
+def run_bulk_operation(operation_id, chunk_size=None):
+    # Integer, Integer -> AtriaBulkOperation
+    # Claims a pending operation (or a failed or abandoned one, to resume it)
+    # and applies it a chunk at a time, producing the operation as it ended.
+    # Operations that are running elsewhere or done are left alone.
+
+    chunk_size = chunk_size or getattr(settings, 'BULK_OPERATION_CHUNK_SIZE', 500)
+
+    now = timezone.now()
+    claimed = AtriaBulkOperation.objects.filter(claimable_operations(now), pk=operation_id)\
+        .update(status='running', started=now, heartbeat=now, error='')
+    operation = AtriaBulkOperation.objects.select_related('user').get(pk=operation_id)
+    if not claimed:
+        return operation
+
+    def renew_lease(**fields):
+        # Saves fields and renews the heartbeat, if this runner still holds
+        # the operation.
+        heartbeat = timezone.now()
+        if not AtriaBulkOperation.objects.filter(
+                pk=operation.pk, status='running', heartbeat=operation.heartbeat,
+        ).update(heartbeat=heartbeat, **fields):
+            raise LeaseLost('Bulk operation %s was claimed by another runner.' % operation.pk)
+        operation.heartbeat = heartbeat
+
+    try:
+        occurrences = operation_occurrences(operation)
+        if operation.max_id is None:
+            operation.max_id = occurrences.aggregate(max_id=models.Max('id'))['max_id'] or 0
+            ids = json.loads(operation.criteria).get('ids')
+            operation.total = len(ids) if ids is not None \
+                else occurrences.filter(id__lte=operation.max_id).count()
+            renew_lease(max_id=operation.max_id, total=operation.total)
+            occurrences = occurrences.filter(id__lte=operation.max_id)
+
+        for (chunk, considered, last_id) in operation_chunks(operation, occurrences, chunk_size):
+            with transaction.atomic():
+                if chunk:
+                    apply_chunk(operation, chunk)
+                operation.processed += considered
+                operation.last_id = last_id
+                renew_lease(processed=operation.processed, last_id=operation.last_id)
+
+        # rules already in the wanted state are skipped, so resuming
+        # doesn't refresh them again
+        published = operation.action == 'publish'
+        with transaction.atomic():
+            for event in operation_recurrences(operation).select_for_update():
+                if event.recurrence_published != published:
+                    publish_recurrence(event, published)
+            renew_lease()
+
+        operation.status = 'done'
+    except LeaseLost:
+        logger.warning('Bulk operation %s lost its lease', operation.pk)
+        return AtriaBulkOperation.objects.select_related('user').get(pk=operation.pk)
+    except Exception as e:
+        logger.exception('Bulk operation %s failed', operation.pk)
+        operation.status = 'failed'
+        operation.error = str(e)
+
+    operation.finished = timezone.now()
+    AtriaBulkOperation.objects.filter(pk=operation.pk, heartbeat=operation.heartbeat).update(
+        status=operation.status, error=operation.error, finished=operation.finished)
+
+    return operation
+
+
+def start_bulk_operation(operation):
+    # AtriaBulkOperation -> AtriaBulkOperation
+    # Runs operation in a background thread once the current transaction
+    # commits, or leaves it pending for the run_bulk_operations command if
+    # BULK_OPERATION_THREADS is off.
+
+    if getattr(settings, 'BULK_OPERATION_THREADS', True):
+        transaction.on_commit(lambda: threading.Thread(
+            target=run_in_thread, args=(operation.pk,), daemon=True).start())
+
+    return operation
+
+
+def run_in_thread(operation_id):
+    try:
+        run_bulk_operation(operation_id)
+    finally:
+        connections.close_all()
@@ -0,0 +1,153 @@
+"""
+Versioned caching for public calendar data.
+
+Each calendar has a version counter in the cache, plus one shared counter
+for queries that are not limited to a calendar.  Writes to occurrences,
+events and volunteer opportunities bump the counters of the calendar they
+belong to once the write commits, so cached entries keyed by an old version
+are simply never read again.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import translation
+
+from .models import AtriaEvent, AtriaOccurrence, AtriaVolunteerOpportunity
+
+
+ALL_CALENDARS = 'all'
+
+
+def calendar_cache():
+    return caches[getattr(settings, 'CALENDAR_CACHE_ALIAS', 'default')]
+
+
+def calendar_cache_timeout():
+    return getattr(settings, 'CALENDAR_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def new_version():
+    # -> Integer
+    # Produce a version number that was not handed out before, even if the
+    # counter itself has been evicted from the cache.
+
+    return int(time.time() * 1000)
+
+
+def version_key(calendar_id):
+    return 'atria:calendar-version:%s' % (calendar_id or ALL_CALENDARS)
+
+
+def calendar_version(calendar_id=None):
+    # Integer -> Integer
+    # Produce the current version of the given calendar, or of the shared
+    # version for all calendars if calendar_id is None.
+
+    cache = calendar_cache()
+    key = version_key(calendar_id)
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+
+    return version
+
+
+def calendar_versions(calendar_ids):
+    # Iterable -> Tuple
+    # Produce the current versions of the given calendars, read together.
+
+    keys = [version_key(calendar_id) for calendar_id in calendar_ids]
+    versions = calendar_cache().get_many(keys)
+
+    return tuple(
+        versions[key] if key in versions else calendar_version(calendar_id)
+        for (key, calendar_id) in zip(keys, calendar_ids))
+
+
+def bump_calendar_versions(calendar_ids):
+    # Iterable ->
+    # Invalidates cached data for the given calendars, and for all queries not
+    # limited to a calendar, once the current transaction commits (right
+    # away outside one).  Bumping before the commit would let a reader cache
+    # the old rows under the new version.
+
+    keys = set(version_key(calendar_id) for calendar_id in calendar_ids)
+    keys.add(version_key(None))
+
+    transaction.on_commit(lambda: bump_versions(keys))
+
+
+def bump_versions(keys):
+    cache = calendar_cache()
+
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), None)
+
+
+def cached_calendar_data(prefix, params, build):
+    # String, Tuple, Function -> Object
+    # Produce the data for params from the cache, building and storing it with
+    # build() on a miss.  The first entry of params is the calendar id (or
+    # None), or a list of calendar ids, and the active language is always
+    # part of the key.
+
+    if isinstance(params[0], (list, tuple)):
+        version = calendar_versions(params[0])
+    else:
+        version = calendar_version(params[0])
+    raw_key = repr((params, translation.get_language(), version))
+    key = 'atria:%s:%s' % (prefix, hashlib.md5(raw_key.encode('utf-8')).hexdigest())
+
+    cache = calendar_cache()
+    data = cache.get(key)
+
+    if data is None:
+        data = build()
+        cache.set(key, data, calendar_cache_timeout())
+
+    return data
+
+
+def event_calendar_id(event_id):
+    return AtriaEvent.objects.filter(pk=event_id)\
+        .values_list('calendar_id', flat=True).first()
+
+
+def capture_previous_calendar(sender, instance, raw=False, **kwargs):
+    # Remembers the calendar an event is being moved away from.
+    if not raw and instance.pk:
+        instance._previous_calendar_id = event_calendar_id(instance.pk)
+
+
+def invalidate_event(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_calendar_versions((
+            instance.calendar_id,
+            getattr(instance, '_previous_calendar_id', None),
+        ))
+
+
+def invalidate_event_child(sender, instance, raw=False, **kwargs):
+    # Handles occurrences and volunteer opportunities of an event
+    if not raw:
+        bump_calendar_versions((event_calendar_id(instance.event_id),))
+
+
+pre_save.connect(capture_previous_calendar, sender=AtriaEvent)
+post_save.connect(invalidate_event, sender=AtriaEvent)
+post_delete.connect(invalidate_event, sender=AtriaEvent)
+
+post_save.connect(invalidate_event_child, sender=AtriaOccurrence)
+post_delete.connect(invalidate_event_child, sender=AtriaOccurrence)
+post_save.connect(invalidate_event_child, sender=AtriaVolunteerOpportunity)
+post_delete.connect(invalidate_event_child, sender=AtriaVolunteerOpportunity)
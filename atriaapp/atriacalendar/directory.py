@@ -0,0 +1,166 @@
+"""
+Directory search over neighbours and organizations.
+
+Searches match case-insensitively against LOWER() of the searched columns,
+which migrations 0023 and 0024 index (see create_lower_indexes): with
+trigram GIN indexes on PostgreSQL (pg_trgm), which serve both prefix and
+substring LIKE patterns, and with expression indexes on SQLite, which serve
+prefix matches written as a range.  Substring matches on SQLite scan.
+
+Neighbours are keyset paginated on the (unique, indexed) email, and load
+only the columns the result list shows.  Organizations are ranked by how
+well their name matches, and can be listed without their long description.
+"""
+
+import re
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection, models, transaction
+from django.db.models.functions import Lower
+from modeltranslation.utils import get_translation_fields
+
+from .models import AtriaOrganization, User
+
+
+NEIGHBOUR_SEARCH_FIELDS = ('email', 'first_name', 'last_name')
+NEIGHBOUR_LIST_FIELDS = ('email', 'first_name', 'last_name')
+ORGANIZATION_NAME_FIELDS = tuple(get_translation_fields('org_name'))
+ORGANIZATION_SEARCH_FIELDS = ORGANIZATION_NAME_FIELDS + ('location', 'tagline')
+ORGANIZATION_LIST_FIELDS = ('id', 'org_name', 'location', 'tagline')
+MATCH_MODES = ('contains', 'prefix')
+
+SQLITE_INDEX_SQL = 'CREATE INDEX {table}_lower_{field} ON {table} (LOWER({field}))'
+POSTGRESQL_TRIGRAM_SQL = (
+    'CREATE INDEX {table}_lower_{field} ON {table} '
+    'USING GIN (LOWER({field}) gin_trgm_ops)')
+POSTGRESQL_PATTERN_SQL = (
+    'CREATE INDEX {table}_lower_{field} ON {table} (LOWER({field}) text_pattern_ops)')
+
+
+def create_lower_indexes(schema_editor, table, fields):
+    # Creates lower() indexes over the searched columns of a table (for
+    # migrations): trigram indexes on PostgreSQL if pg_trgm can be installed,
+    # else prefix-only pattern indexes.
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statement = SQLITE_INDEX_SQL
+    elif vendor == 'postgresql':
+        statement = POSTGRESQL_TRIGRAM_SQL
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError:
+            statement = POSTGRESQL_PATTERN_SQL
+    else:
+        return
+
+    for field in fields:
+        schema_editor.execute(statement.format(table=table, field=field))
+
+
+def drop_lower_indexes(schema_editor, table, fields):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        for field in fields:
+            schema_editor.execute('DROP INDEX IF EXISTS %s_lower_%s' % (table, field))
+
+
+def directory_terms(query):
+    # String -> List
+    # Produce the lower case words of a directory query.
+
+    return [term.lower() for term in re.findall(r'[^\s,]+', query or '')]
+
+
+def lower_name(field):
+    return 'lower_' + field
+
+
+def term_q(fields, term, match):
+    # Iterable, String, String -> Q
+    # Produce a filter for rows where any of the annotated lower() fields
+    # starts with or contains term.
+
+    q = models.Q()
+    for field in fields:
+        if match == 'contains':
+            q |= models.Q(**{lower_name(field) + '__contains': term})
+        elif connection.vendor == 'sqlite':
+            # SQLite only uses an index for LIKE on a plain column, but does
+            # for a range over the lower() expression
+            q |= models.Q(**{
+                lower_name(field) + '__gte': term,
+                lower_name(field) + '__lt': term[:-1] + chr(ord(term[-1]) + 1),
+            })
+        else:
+            q |= models.Q(**{lower_name(field) + '__startswith': term})
+
+    return q
+
+
+def search_neighbours(query='', match='contains', after=None, limit=None):
+    # String, String, String, Integer -> (List, String)
+    # Produce a page of the neighbours matching every word in query, ordered
+    # by email and starting after the email after, and the email to pass as
+    # after for the next page (or None on the last page).
+
+    limit = limit or getattr(settings, 'SEARCH_PAGE_SIZE', 25)
+    neighbours = User.objects.filter(groups__name=settings.DEFAULT_USER_ROLE)
+
+    terms = directory_terms(query)
+    if terms:
+        neighbours = neighbours.annotate(**{
+            lower_name(field): Lower(field) for field in NEIGHBOUR_SEARCH_FIELDS
+        })
+        for term in terms:
+            neighbours = neighbours.filter(term_q(NEIGHBOUR_SEARCH_FIELDS, term, match))
+
+    if after:
+        neighbours = neighbours.filter(email__gt=after)
+
+    neighbours = list(neighbours.only(*NEIGHBOUR_LIST_FIELDS).order_by('email')[:limit + 1])
+    next_after = neighbours[limit - 1].email if len(neighbours) > limit else None
+
+    return (neighbours[:limit], next_after)
+
+
+def search_organizations(query='', match='contains', compact=False, page=None):
+    # String, String, Boolean, String -> Page
+    # Produce a page of the organizations matching every word in query, best
+    # name match first: the whole query equal to one of the translated
+    # names, then a name starting with it, then a name containing it, then
+    # the rest (matched in location or tagline).  Compact pages leave out
+    # (and don't load) the description.
+
+    orgs = AtriaOrganization.objects.all()
+    if compact:
+        orgs = orgs.only(*(ORGANIZATION_LIST_FIELDS + ORGANIZATION_NAME_FIELDS))
+
+    terms = directory_terms(query)
+    if terms:
+        orgs = orgs.annotate(**{
+            lower_name(field): Lower(field) for field in ORGANIZATION_SEARCH_FIELDS
+        })
+        for term in terms:
+            orgs = orgs.filter(term_q(ORGANIZATION_SEARCH_FIELDS, term, match))
+
+        phrase = ' '.join(terms)
+
+        def name_q(lookup):
+            return reduce(or_, (
+                models.Q(**{lower_name(field) + lookup: phrase})
+                for field in ORGANIZATION_NAME_FIELDS))
+
+        orgs = orgs.annotate(search_rank=models.Case(
+            models.When(name_q(''), then=3),
+            models.When(name_q('__startswith'), then=2),
+            models.When(name_q('__contains'), then=1),
+            default=0,
+            output_field=models.IntegerField(),
+        )).order_by('-search_rank', 'org_name', 'id')
+    else:
+        orgs = orgs.order_by('org_name', 'id')
+
+    return Paginator(orgs, getattr(settings, 'SEARCH_PAGE_SIZE', 25)).get_page(page)
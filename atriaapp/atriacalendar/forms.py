@@ -1,3 +1,5 @@
+import json
+
 from django import forms
 from modeltranslation.forms import TranslationModelForm
 from django.contrib.auth.forms import UserCreationForm
@@ -7,7 +9,10 @@ from django.utils import timezone
 from swingtime import models as swingtime_models
 from swingtime import forms as swingtime_forms
 
+from .bulk import OCCURRENCE_STATUSES
 from .models import *
+from .recurrence import RECURRENCE_FIELDS, rule_storage_enabled, set_recurrence
+from .series import create_series
 
 
 # class EventForm(TranslationModelForm):
@@ -31,6 +36,7 @@ class AtriaEventForm(swingtime_forms.EventForm, TranslationModelForm):
     class Meta:
         model = AtriaEvent
         fields = "__all__"
+        exclude = RECURRENCE_FIELDS
 
     def __init__(self, *args, **kwargs):
         request = kwargs.pop('request') if 'request' in kwargs else None
@@ -57,8 +63,43 @@ class AtriaEventForm(swingtime_forms.EventForm, TranslationModelForm):
 
 
 class AtriaOccurrenceForm(swingtime_forms.MultipleOccurrenceForm):
+    """
+    A form for adding one or more occurrences to an event, written in bulk.
+    """
     model = AtriaOccurrence
 
+    def __init__(self, *args, **kwargs):
+        self.contact = kwargs.pop('contact') if 'contact' in kwargs else None
+
+        super(AtriaOccurrenceForm, self).__init__(*args, **kwargs)
+
+    def save(self, event):
+        if self.cleaned_data['repeats'] == 'count' and self.cleaned_data['count'] == 1:
+            params = {}
+        else:
+            params = self._build_rrule_params()
+
+        # with rule storage, an event's first series is kept as its rule
+        if params and rule_storage_enabled() and not event.recurrence_rule:
+            set_recurrence(
+                event,
+                self.cleaned_data['start_time'],
+                self.cleaned_data['end_time'],
+                contact=self.contact,
+                **params
+            )
+            return event
+
+        create_series(
+            event,
+            self.cleaned_data['start_time'],
+            self.cleaned_data['end_time'],
+            contact=self.contact,
+            **params
+        )
+
+        return event
+
 
 class AtriaEventOccurrenceForm(AtriaEventForm):
     """
@@ -142,6 +183,92 @@ class AtriaCopyOccurrenceForm(forms.ModelForm):
         return atriaoccurrence
 
 
+class AtriaBulkOperationForm(forms.ModelForm):
+    """
+    A form for publishing, unpublishing or copying (shifted by copy_days)
+    the occurrences selected by ids ("1,2,3"), id ranges ("10-200,300-400")
+    and/or the Create/Manage list filters.  Publishing and unpublishing can
+    also select recurring events by event_ids ("4,5").
+    """
+    ids = forms.CharField(required=False)
+    event_ids = forms.CharField(required=False)
+    id_ranges = forms.CharField(required=False)
+    status = forms.ChoiceField(
+        required=False, choices=[('', '')] + [(s, s) for s in OCCURRENCE_STATUSES])
+    program = forms.IntegerField(required=False)
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    background = forms.BooleanField(required=False)
+
+    class Meta:
+        model = AtriaBulkOperation
+        fields = ('action', 'copy_days')
+
+    def __init__(self, *args, **kwargs):
+        super(AtriaBulkOperationForm, self).__init__(*args, **kwargs)
+        self.fields['copy_days'].required = False
+
+    def clean_ids(self):
+        return self.clean_id_list('ids')
+
+    def clean_event_ids(self):
+        return self.clean_id_list('event_ids')
+
+    def clean_id_list(self, name):
+        try:
+            return sorted(set(
+                int(pk) for pk in self.cleaned_data[name].split(',') if pk.strip()))
+        except ValueError:
+            raise forms.ValidationError('Enter a comma separated list of ids.')
+
+    def clean_id_ranges(self):
+        id_ranges = []
+        try:
+            for id_range in self.cleaned_data['id_ranges'].split(','):
+                if id_range.strip():
+                    (first, last) = (int(pk) for pk in id_range.split('-'))
+                    id_ranges.append((first, last))
+        except ValueError:
+            raise forms.ValidationError('Enter a comma separated list of id ranges, like 10-200.')
+
+        return id_ranges
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        # an operation over every occurrence of the org has to be asked for
+        # with a filter
+        if not any(cleaned_data.get(name) for name in (
+                'ids', 'event_ids', 'id_ranges', 'status', 'program', 'start', 'end')):
+            raise forms.ValidationError('Select some occurrences.')
+        if cleaned_data.get('action') == 'copy' and not cleaned_data.get('copy_days'):
+            raise forms.ValidationError('Copies need a number of days to move by.')
+
+        return cleaned_data
+
+    def save(self, org=None, user=None):
+        cd = self.cleaned_data
+        criteria = {
+            name: cd[name] for name in ('ids', 'event_ids', 'id_ranges', 'status', 'program')
+            if cd.get(name)
+        }
+        for name in ('start', 'end'):
+            if cd.get(name):
+                criteria[name] = cd[name].isoformat()
+        # event_ids alone select no occurrences, rather than all of them
+        if list(criteria) == ['event_ids']:
+            criteria['ids'] = []
+
+        operation = super().save(commit=False)
+        operation.org = org
+        operation.user = user
+        operation.criteria = json.dumps(criteria)
+        operation.copy_days = cd.get('copy_days') or 0
+        operation.save()
+
+        return operation
+
+
 class AtriaEventOpportunityForm(forms.ModelForm):
     """
     A simple form for adding volunteer opportunities to events
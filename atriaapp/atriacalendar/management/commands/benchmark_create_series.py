@@ -0,0 +1,95 @@
+"""
+Times creating recurring event series one occurrence at a time against
+the bulk series builder, against a throwaway test database.
+
+    python manage.py benchmark_create_series --sizes 10 100 1000
+"""
+
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from dateutil import rrule
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from swingtime.models import EventType
+
+from ...models import (
+    AtriaEvent, AtriaEventAttendance, AtriaEventProgram, AtriaOccurrence,
+    EventAttendanceType)
+from ...series import create_series, expand_series
+
+
+class Command(BaseCommand):
+    help = 'Benchmark creating recurring event series.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[10, 100, 1000],
+            help='Numbers of occurrences in the series.')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of series created per size and method.')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            self.contact = get_user_model().objects.create(email='contact@example.com')
+            self.event_type = EventType.objects.create(abbr='bnch', label='Benchmark')
+            self.program = AtriaEventProgram.objects.create(abbr='bnch', label='Benchmark')
+            EventAttendanceType.objects.get_or_create(attendance_type='Contact')
+
+            for size in options['sizes']:
+                self.report(size, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def create_one_at_a_time(self, event, start_time, end_time, **rrule_params):
+        # The previous path: one AtriaOccurrence and one attendance per save.
+        attendance_type = EventAttendanceType.objects.filter(attendance_type='Contact').get()
+
+        with transaction.atomic():
+            for (start, end) in expand_series(start_time, end_time, **rrule_params):
+                occurrence = AtriaOccurrence.objects.create(
+                    start_time=start, end_time=end, event=event)
+                AtriaEventAttendance.objects.create(
+                    occurrence=occurrence,
+                    user=self.contact,
+                    attendance_type=attendance_type,
+                    user_count=1)
+
+    def create_bulk(self, event, start_time, end_time, **rrule_params):
+        create_series(event, start_time, end_time, contact=self.contact, **rrule_params)
+
+    def time_series(self, method, size, repeat):
+        start_time = timezone.make_aware(datetime(2020, 1, 6, 18))
+        timings = []
+
+        for _ in range(repeat):
+            event = AtriaEvent.objects.create(
+                title='Benchmark', event_type=self.event_type, event_program=self.program)
+
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                began = time.perf_counter()
+                method(event, start_time, start_time + timedelta(hours=1),
+                       freq=rrule.DAILY, count=size)
+                timings.append((time.perf_counter() - began) * 1000)
+
+        return statistics.median(timings), len(queries)
+
+    def report(self, size, repeat):
+        (before, before_queries) = self.time_series(self.create_one_at_a_time, size, repeat)
+        (after, after_queries) = self.time_series(self.create_bulk, size, repeat)
+
+        self.stdout.write(
+            '%5d occurrences: one at a time %9.2f ms (%d queries), '
+            'bulk %8.2f ms (%d queries)' % (
+                size, before, before_queries, after, after_queries))
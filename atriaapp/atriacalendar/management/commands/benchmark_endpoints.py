@@ -0,0 +1,186 @@
+"""
+Times the hot pages and API endpoints against data made by
+generate_load_data, and writes the results as JSON for tracking
+regressions between runs.
+
+    python manage.py generate_load_data --seed 1
+    python manage.py benchmark_endpoints --output results.json
+
+or, against a throwaway test database filled with the default load data:
+
+    python manage.py benchmark_endpoints --generate --seed 1
+"""
+
+import json
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from ...cache import calendar_cache
+from ...models import (
+    AtriaCalendar, AtriaEvent, AtriaEventAttendance, AtriaOccurrence,
+    AtriaOrganization, AtriaRelationship, User)
+from .generate_load_data import LOAD_DATA_EMAIL_DOMAIN
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the calendar API, search, Create/Manage and profile pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--generate', action='store_true',
+            help='Run against a throwaway test database filled by '
+                 'generate_load_data.')
+        parser.add_argument(
+            '--seed', type=int, default=1,
+            help='Seed for generate_load_data, with --generate.')
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Number of timed requests per endpoint.')
+        parser.add_argument(
+            '--language', default='en',
+            help='Language prefix of the page URLs.')
+        parser.add_argument('--output', help='File to write the JSON results to.')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        if options['generate']:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            call_command('generate_load_data', seed=options['seed'], stdout=self.stderr)
+
+        setup_test_environment()
+        try:
+            with translation.override(options['language']):
+                results = self.run_benchmarks(options['repeat'])
+        finally:
+            teardown_test_environment()
+            if options['generate']:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        results.update({
+            'database': connection.vendor,
+            'generated': options['generate'],
+            'seed': options['seed'] if options['generate'] else None,
+            'repeat': options['repeat'],
+            'timestamp': timezone.now().isoformat(),
+        })
+        output = json.dumps(results, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_benchmarks(self, repeat):
+        neighbour = User.objects.filter(
+            email__endswith='@' + LOAD_DATA_EMAIL_DOMAIN,
+            email__startswith='neighbour').order_by('email').first()
+        admin_relation = AtriaRelationship.objects.filter(
+            user__email__endswith='@' + LOAD_DATA_EMAIL_DOMAIN,
+            relation_type__is_org_relation=True,
+        ).select_related('user', 'org').order_by('user__email').first()
+        if neighbour is None or admin_relation is None:
+            raise CommandError(
+                'No load data found; run generate_load_data first, or pass '
+                '--generate.')
+
+        org = admin_relation.org
+        calendar = AtriaCalendar.objects.filter(org_owner=org).order_by('pk').first()
+        first = AtriaOccurrence.objects.filter(
+            event__atriaevent__calendar=calendar).order_by('start_time').first()
+        day = timezone.localtime(first.start_time)
+        sunday = day - timezone.timedelta(days=day.isoweekday() % 7)
+        program = AtriaEvent.objects.filter(calendar=calendar)\
+            .values_list('event_program__label', flat=True).first()
+
+        anonymous = Client()
+        neighbour_client = Client()
+        neighbour_client.force_login(neighbour)
+        admin_client = Client()
+        admin_client.force_login(admin_relation.user)
+        session = admin_client.session
+        session['ACTIVE_ORG'] = str(org.pk)
+        session['ACTIVE_ROLE'] = 'Admin'
+        session['URL_NAMESPACE'] = 'organization:'
+        session.save()
+
+        api_month = '/api/atria/calendar/%s/%s/' % (day.year, day.month)
+        endpoints = [
+            ('api-month', anonymous, api_month),
+            ('api-month-calendar', anonymous, api_month + '?calendar=%s' % calendar.pk),
+            ('api-week', anonymous, '/api/atria/calendar/%s/%s/%s/?week=true' % (
+                sunday.year, sunday.month, sunday.day)),
+            ('api-day', anonymous, '/api/atria/calendar/%s/%s/%s/' % (
+                day.year, day.month, day.day)),
+            ('search-events', anonymous, reverse('search_event')),
+            ('search-events-query', anonymous,
+             reverse('search_event') + '?q=%s' % program.split()[0]),
+            ('search-opportunities', anonymous, reverse('search_opportunity')),
+            ('create-manage', admin_client, reverse('organization:create_manage')),
+            ('organization-profile', admin_client, reverse('organization:profile')),
+            ('neighbour-profile', neighbour_client, reverse('neighbour:profile')),
+            ('view-organization', anonymous,
+             reverse('view_organization_id', kwargs={'id': org.pk})),
+            ('view-neighbour', anonymous,
+             reverse('view_neighbour_id', kwargs={'email': neighbour.email})),
+        ]
+
+        return {
+            'counts': {
+                model.__name__: model.objects.count()
+                for model in (User, AtriaOrganization, AtriaCalendar, AtriaEvent,
+                              AtriaOccurrence, AtriaEventAttendance)
+            },
+            'results': [
+                self.time_endpoint(name, client, url, repeat)
+                for (name, client, url) in endpoints
+            ],
+        }
+
+    def time_endpoint(self, name, client, url, repeat):
+        # Times requests with a warm and a cleared calendar cache, then makes
+        # one more request to count its queries.
+        timings = {'warm': [], 'cold': []}
+
+        for cache_state in ('cold', 'warm'):
+            for _ in range(repeat):
+                if cache_state == 'cold':
+                    calendar_cache().clear()
+                began = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings[cache_state].append((time.perf_counter() - began) * 1000)
+
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+            content = b''.join(response.streaming_content) \
+                if response.streaming else response.content
+
+        warm = sorted(timings['warm'])
+        result = {
+            'name': name,
+            'url': url,
+            'status': response.status_code,
+            'bytes': len(content),
+            'queries': len(queries),
+            'median_ms': round(statistics.median(warm), 2),
+            'p95_ms': round(warm[min(len(warm) - 1, int(len(warm) * 0.95))], 2),
+            'cold_median_ms': round(statistics.median(timings['cold']), 2),
+        }
+        self.stderr.write(
+            '%-22s %3d %8.2f ms (cold %8.2f ms) %4d queries' % (
+                name, result['status'], result['median_ms'],
+                result['cold_median_ms'], result['queries']))
+
+        return result
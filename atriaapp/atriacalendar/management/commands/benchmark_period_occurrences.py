@@ -0,0 +1,152 @@
+"""
+Times month-view occurrence lookups before and after the interval overlap
+rewrite, against a throwaway test database.
+
+    python manage.py benchmark_period_occurrences --sizes 100000 1000000 5000000
+"""
+
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from swingtime import models as swingtime_models
+from swingtime.models import EventType
+
+from ...models import (
+    AtriaEvent, AtriaEventProgram, AtriaOccurrence, AtriaOccurrenceBucket,
+    interval_bucket, interval_index_settings, period_overlap_q)
+
+
+def legacy_overlap_q(start, end):
+    # The three-branch predicate used before the interval overlap rewrite.
+    return (
+        models.Q(start_time__gte=start, start_time__lte=end) |
+        models.Q(end_time__gte=start, end_time__lte=end) |
+        models.Q(start_time__lt=start, end_time__gt=end)
+    )
+
+
+class Command(BaseCommand):
+    help = 'Benchmark month-view period_occurrences queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[100000, 1000000, 5000000],
+            help='Occurrence table sizes to benchmark.')
+        parser.add_argument(
+            '--years', type=int, default=10,
+            help='Number of years the occurrences are spread over.')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Number of month queries timed per predicate.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            for size in options['sizes']:
+                self.load_occurrences(size, options['years'], options['seed'])
+                self.report(size, options['years'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def load_occurrences(self, size, years, seed):
+        rand = random.Random(seed)
+        start_of_range = timezone.make_aware(datetime(2015, 1, 1))
+        minutes = years * 365 * 24 * 60
+        index_settings = interval_index_settings()
+        bucket_duration = index_settings['BUCKET_DURATION']
+
+        AtriaOccurrence.objects.all().delete()
+        swingtime_models.Occurrence.objects.all().delete()
+        event = AtriaEvent.objects.create(
+            title='Benchmark',
+            event_type=EventType.objects.get_or_create(
+                abbr='bnch', label='Benchmark')[0],
+            event_program=AtriaEventProgram.objects.get_or_create(
+                abbr='bnch', label='Benchmark')[0],
+        )
+
+        occurrence_table = swingtime_models.Occurrence._meta.db_table
+        atriaoccurrence_table = AtriaOccurrence._meta.db_table
+        bucket_table = AtriaOccurrenceBucket._meta.db_table
+        batch_size = 10000
+
+        with connection.cursor() as cursor:
+            for batch_start in range(1, size + 1, batch_size):
+                occurrences = []
+                buckets = []
+                for pk in range(batch_start, min(batch_start + batch_size, size + 1)):
+                    start_time = start_of_range + timedelta(
+                        minutes=rand.randrange(minutes))
+                    if rand.random() < 0.005:
+                        # a small share of multi-week programs and exhibits
+                        end_time = start_time + timedelta(days=rand.randint(2, 90))
+                        buckets.extend(
+                            (pk, bucket) for bucket in range(
+                                interval_bucket(start_time, bucket_duration),
+                                interval_bucket(end_time, bucket_duration) + 1))
+                    else:
+                        end_time = start_time + timedelta(
+                            minutes=rand.choice((30, 60, 90, 120, 180)))
+                    occurrences.append((pk, start_time, end_time, event.pk))
+
+                cursor.executemany(
+                    'INSERT INTO %s (id, start_time, end_time, event_id) '
+                    'VALUES (%%s, %%s, %%s, %%s)' % occurrence_table,
+                    [
+                        (pk, connection.ops.adapt_datetimefield_value(start_time),
+                         connection.ops.adapt_datetimefield_value(end_time),
+                         event_id)
+                        for (pk, start_time, end_time, event_id) in occurrences
+                    ])
+                cursor.executemany(
+                    'INSERT INTO %s (occurrence_ptr_id, published, '
+                    'attendee_count, volunteer_count) '
+                    'VALUES (%%s, %%s, 0, 0)' % atriaoccurrence_table,
+                    [(pk, True) for (pk, _, _, _) in occurrences])
+                if buckets:
+                    cursor.executemany(
+                        'INSERT INTO %s (occurrence_id, bucket) '
+                        'VALUES (%%s, %%s)' % bucket_table, buckets)
+
+            cursor.execute('ANALYZE')
+
+    def time_months(self, predicate, months):
+        timings = []
+        for (start, end) in months:
+            began = time.perf_counter()
+            list(swingtime_models.Occurrence.objects.filter(
+                predicate(start, end),
+                atriaoccurrence__published=True,
+            ).order_by('start_time').values_list('id', flat=True))
+            timings.append((time.perf_counter() - began) * 1000)
+
+        return statistics.median(timings)
+
+    def report(self, size, years, repeat):
+        rand = random.Random(size)
+        months = []
+        for _ in range(repeat):
+            first = timezone.make_aware(
+                datetime(2015 + rand.randrange(years), rand.randint(1, 12), 1))
+            # six week month grid, as requested by event_month_view
+            start = first - timedelta(days=(first.weekday() + 1) % 7)
+            months.append((start, start + timedelta(weeks=6, seconds=-1)))
+
+        before = self.time_months(legacy_overlap_q, months)
+        after = self.time_months(period_overlap_q, months)
+        with override_settings(OCCURRENCE_INTERVAL_INDEX={'ENABLED': True}):
+            bucketed = self.time_months(period_overlap_q, months)
+
+        self.stdout.write(
+            '%9d occurrences: before %8.2f ms, after %8.2f ms, '
+            'after (interval index) %8.2f ms' % (size, before, after, bucketed))
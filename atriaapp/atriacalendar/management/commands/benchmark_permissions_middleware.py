@@ -0,0 +1,112 @@
+"""
+Times the per-request overhead of URLPermissionsMiddleware against the
+previous implementation, which matched each URL_NAMESPACE_PATHS regex in
+turn and ran one group query per allowed role, on a throwaway test database.
+
+    python manage.py benchmark_permissions_middleware --requests 10000
+"""
+
+import re
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from ...middleware import URLPermissionsMiddleware
+
+
+class LegacyURLPermissionsMiddleware(URLPermissionsMiddleware):
+
+    def applicable_path(self, path):
+        for pattern in getattr(settings, 'URL_NAMESPACE_PATHS', ()):
+            if re.match(pattern, path):
+                return True
+
+        return False
+
+    def request_allowed(self, request):
+        user = request.user
+        path = request.path
+        url_permissions = getattr(settings, 'URL_NAMESPACE_PERMISSIONS', {})
+
+        url_namespace = request.session.get('URL_NAMESPACE', None)
+
+        if url_namespace is None:
+            if user.is_anonymous:
+                return True
+            return False
+
+        if user.is_anonymous:
+            return False
+
+        url_namespace = url_namespace.replace(':', '')
+
+        if url_namespace in path:
+
+            if user.is_staff:
+                return True
+
+            for role in url_permissions.get(url_namespace, ()):
+                if user.groups.filter(name=role).exists():
+                    return True
+
+        return False
+
+
+class Command(BaseCommand):
+    help = 'Benchmark URLPermissionsMiddleware overhead per request.'
+
+    PATHS = (
+        '/static/atriacalendar/style.css',
+        '/api/atria/calendar/2019/10/',
+        '/en/neighbour/calendar/2019/10/',
+        '/en/neighbour/profile/',
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        user_namespace = getattr(settings, 'USER_NAMESPACE', 'neighbour')
+        org_namespace = getattr(settings, 'ORG_NAMESPACE', 'organization')
+        paths = (r'^(/[^/]+)?/(%s|%s)($|/.*$)' % (user_namespace, org_namespace),)
+
+        try:
+            with override_settings(URL_NAMESPACE_PATHS=paths):
+                self.run_benchmark(user_namespace + ':', options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_benchmark(self, namespace, count):
+        factory = RequestFactory()
+        user = get_user_model().objects.create(email='benchmark@example.com')
+        user.add_role(getattr(settings, 'DEFAULT_USER_ROLE', 'Attendee'))
+
+        requests = []
+        for path in self.PATHS:
+            request = factory.get(path)
+            request.user = user
+            request.session = {'URL_NAMESPACE': namespace}
+            requests.append(request)
+
+        response = HttpResponse()
+
+        for middleware_class in (LegacyURLPermissionsMiddleware, URLPermissionsMiddleware):
+            middleware = middleware_class(lambda request: response)
+            began = time.perf_counter()
+            for i in range(count):
+                # each request loads its user, and so its roles, afresh
+                user.clear_role_cache()
+                middleware(requests[i % len(requests)])
+            elapsed = time.perf_counter() - began
+
+            self.stdout.write('%-32s %8.2f us/request' % (
+                middleware_class.__name__, elapsed / count * 1000000))
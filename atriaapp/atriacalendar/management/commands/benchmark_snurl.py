@@ -0,0 +1,94 @@
+"""
+Times rendering a 200-row page of {% snurl %} links (like the Create/Manage
+occurrence table) with the snurl tag against its previous implementation,
+which rewrote the view name on the shared template node and reversed every
+URL in full.  No database is needed.
+
+    python manage.py benchmark_snurl --rows 200 --renders 50
+"""
+
+import time
+
+from django import template
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import Context, Engine
+from django.template.defaulttags import URLNode
+from django.test import RequestFactory
+from django.utils import translation
+
+from ...templatetags import session_namespaced_url
+from ...templatetags.session_namespaced_url import has_namespace_already
+
+
+# the previous tag, loaded by the legacy template as session_namespaced_url
+register = template.Library()
+
+
+class LegacySNURLNode(URLNode):
+    def render(self, context):
+        request = context.get('request')
+
+        if request:
+            url_namespace = request.session.get('URL_NAMESPACE')
+
+            if url_namespace:
+                if not has_namespace_already(self.view_name.var):
+                    self.view_name.var = url_namespace + self.view_name.var
+
+        return super().render(context)
+
+
+@register.tag('snurl')
+def legacy_snurl(parser, token):
+    node = session_namespaced_url.snurl(parser, token)
+    node.__class__ = LegacySNURLNode
+    return node
+
+
+PAGE = '''{% load session_namespaced_url %}
+<a href="{% snurl 'event' %}">New event</a>
+<table>
+{% for occ_id in rows %}
+  <tr>
+    <td><a href="{% snurl 'swingtime-occurrence' occ_id occ_id %}">Edit</a></td>
+    <td><a href="{% snurl 'copy_occurrance' occ_id %}">Copy</a></td>
+    <td><a href="{% snurl 'opportunities' occ_id %}">Opportunities</a></td>
+  </tr>
+{% endfor %}
+</table>
+'''
+
+
+class Command(BaseCommand):
+    help = 'Benchmark rendering a 200-row page of snurl links.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200)
+        parser.add_argument('--renders', type=int, default=50)
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/')
+        request.session = {
+            'URL_NAMESPACE': getattr(settings, 'ORG_NAMESPACE', 'organization') + ':'}
+        context = {'request': request, 'rows': range(1, options['rows'] + 1)}
+
+        translation.activate(settings.LANGUAGE_CODE)
+        session_namespaced_url.cached_reverse.cache_clear()
+
+        pages = []
+        for (name, library) in (
+                ('legacy snurl', __name__),
+                ('snurl', 'atriacalendar.templatetags.session_namespaced_url')):
+            page = Engine(libraries={'session_namespaced_url': library}).from_string(PAGE)
+            began = time.perf_counter()
+            for i in range(options['renders']):
+                rendered = page.render(Context(context))
+            elapsed = time.perf_counter() - began
+            pages.append(rendered)
+
+            self.stdout.write('%-16s %8.2f ms/render' % (
+                name, elapsed / options['renders'] * 1000))
+
+        if pages[0] != pages[1]:
+            self.stderr.write('The rendered pages differ.')
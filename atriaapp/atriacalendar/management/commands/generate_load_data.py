@@ -0,0 +1,367 @@
+"""
+Bulk-creates a realistic volume of organizations, neighbours, calendars,
+programs, recurring events, volunteer opportunities, relationships and
+attendance, for load testing and benchmarks.
+
+The data only depends on --seed, --start and the volume options, so two
+runs with the same options produce the same rows.
+
+    python manage.py generate_load_data --orgs 50 --neighbours 5000 --seed 1
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from dateutil import rrule
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from swingtime.models import EventType
+
+from ...cache import bump_calendar_versions
+from ...models import (
+    AtriaCalendar, AtriaEvent, AtriaEventAttendance, AtriaEventProgram,
+    AtriaEventSearchDocument, AtriaOccurrence, AtriaOccurrenceBucket,
+    AtriaOrganization, AtriaRelationship, AtriaVolunteerOpportunity,
+    EventAttendanceType, RelationType, User, USER_ROLES, occurrence_buckets,
+    reconcile_occurrence_counters)
+from ...rollups import rebuild_daily_counts
+from ...search import build_search_document
+from ...series import bulk_create_inherited, expand_series
+from ...watermarks import touch_watermarks
+
+
+LOAD_DATA_EMAIL_DOMAIN = 'load.example.com'
+LOAD_DATA_PASSWORD = 'atria-load-data'
+LOAD_DATA_ORG_PREFIX = 'Load Test Org'
+
+BATCH_SIZE = 2000
+# keeps id__in lookups under SQLite's default limit on query parameters
+LOOKUP_BATCH_SIZE = 500
+
+PROGRAM_NAMES = (
+    'Gardening', 'Cooking', 'Literacy', 'Seniors', 'Youth', 'Arts', 'Music',
+    'Sports', 'Newcomers', 'Environment', 'Health', 'Housing', 'Technology',
+    'Language', 'Food Bank', 'Repair Cafe',
+)
+TOPICS = (
+    'workshop', 'meetup', 'class', 'drop-in', 'clean-up', 'potluck',
+    'tutoring', 'clinic', 'fair', 'tour', 'circle', 'training',
+)
+TRANSLATED_TOPICS = {
+    'es': 'taller', 'fr': 'atelier', 'zh-hans': '工作坊',
+}
+STREETS = ('Main St', 'Oak Ave', 'Park Rd', 'Cedar Ln', 'Elm St', 'Harbour Way')
+OPPORTUNITY_TITLES = ('Set up', 'Greeter', 'Clean up', 'Cook', 'Tutor', 'Driver')
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic volume of synthetic load-test data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--start', default=None,
+            help='First day of the generated schedule (YYYY-MM-DD); defaults '
+                 'to the first day of the current month.')
+        parser.add_argument('--orgs', type=int, default=20)
+        parser.add_argument('--neighbours', type=int, default=2000)
+        parser.add_argument('--programs', type=int, default=10)
+        parser.add_argument('--calendars-per-org', type=int, default=2)
+        parser.add_argument('--events-per-calendar', type=int, default=25)
+        parser.add_argument(
+            '--max-occurrences', type=int, default=52,
+            help='Most occurrences in an event series.')
+        parser.add_argument('--max-opportunities', type=int, default=3)
+        parser.add_argument(
+            '--max-attendances', type=int, default=8,
+            help='Most attendance rows per occurrence.')
+        parser.add_argument(
+            '--max-memberships', type=int, default=3,
+            help='Most organizations a neighbour is connected to.')
+
+    def handle(self, *args, **options):
+        self.rand = random.Random(options['seed'])
+        self.options = options
+
+        start = parse_date(options['start']) if options['start'] else \
+            timezone.localdate().replace(day=1)
+        if start is None:
+            raise CommandError('Invalid --start date: %s' % options['start'])
+        self.start = timezone.make_aware(datetime(start.year, start.month, start.day))
+
+        if User.objects.filter(email__endswith='@' + LOAD_DATA_EMAIL_DOMAIN).exists():
+            raise CommandError(
+                'This database already has load data; generate it into an '
+                'empty database.')
+
+        with transaction.atomic():
+            self.create_types()
+            neighbours = self.create_neighbours()
+            orgs = self.create_orgs()
+            self.create_relationships(orgs, neighbours)
+            programs = self.create_programs()
+            calendars = self.create_calendars(orgs)
+            events = self.create_events(calendars, programs)
+            opportunities = self.create_opportunities(events, calendars)
+            occurrences = self.create_occurrences(events)
+            self.create_attendances(occurrences, neighbours, opportunities, calendars)
+            self.index_events(events)
+            rebuild_daily_counts()
+
+        bump_calendar_versions(calendar.pk for calendar in calendars)
+        touch_watermarks(
+            [calendar.pk for calendar in calendars],
+            [program.pk for program in programs])
+
+        self.stdout.write(
+            'Created %d organizations, %d neighbours, %d calendars, %d events '
+            'and %d occurrences.' % (
+                len(orgs), len(neighbours), len(calendars), len(events),
+                len(occurrences)))
+
+    def create_types(self):
+        for attendance_type in ('Attendee', 'Volunteer', 'Organizer', 'Staff', 'Contact'):
+            EventAttendanceType.objects.get_or_create(
+                attendance_type=attendance_type,
+                defaults={'attendance_description': attendance_type})
+        for (relation_type, is_org_relation) in (('Employee', True), ('Member', False)):
+            RelationType.objects.get_or_create(
+                relation_type=relation_type,
+                defaults={'relation_description': relation_type,
+                          'is_org_relation': is_org_relation})
+        for role in USER_ROLES:
+            Group.objects.get_or_create(name=role)
+
+        self.attendance_types = dict(
+            EventAttendanceType.objects.values_list('attendance_type', 'id'))
+        self.relation_types = dict(
+            RelationType.objects.values_list('relation_type', 'id'))
+        self.groups = dict(Group.objects.values_list('name', 'id'))
+        self.event_type = EventType.objects.get_or_create(
+            abbr='load', defaults={'label': 'Load test'})[0]
+
+    def create_users(self, prefix, count):
+        # the same (salted) hash for everyone, rather than hashing per user
+        password = make_password(LOAD_DATA_PASSWORD, salt='atrialoaddata')
+        first_names = ('Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley')
+        last_names = ('Smith', 'Nguyen', 'Garcia', 'Wong', 'Singh', 'Martin', 'Brown')
+
+        users = User.objects.bulk_create([
+            User(
+                email='%s%05d@%s' % (prefix, n, LOAD_DATA_EMAIL_DOMAIN),
+                first_name=self.rand.choice(first_names),
+                last_name=self.rand.choice(last_names),
+                password=password,
+                date_joined=self.start - timedelta(days=self.rand.randrange(365)),
+            )
+            for n in range(count)
+        ])
+
+        # reload for the ids, which SQLite doesn't return from bulk inserts
+        return list(User.objects.filter(
+            email__startswith=prefix,
+            email__endswith='@' + LOAD_DATA_EMAIL_DOMAIN).order_by('email'))
+
+    def add_users_to_group(self, users, role):
+        User.groups.through.objects.bulk_create([
+            User.groups.through(user_id=user.pk, group_id=self.groups[role])
+            for user in users
+        ])
+
+    def create_neighbours(self):
+        neighbours = self.create_users('neighbour', self.options['neighbours'])
+        self.add_users_to_group(neighbours, 'Attendee')
+        self.add_users_to_group(
+            [user for user in neighbours if self.rand.random() < 0.3], 'Volunteer')
+
+        return neighbours
+
+    def create_orgs(self):
+        AtriaOrganization.objects.bulk_create([
+            AtriaOrganization(
+                org_name='%s %03d' % (LOAD_DATA_ORG_PREFIX, n),
+                date_joined=self.start - timedelta(days=self.rand.randrange(730)),
+                status='Active',
+                description='A community organization offering %s.' % (
+                    ', '.join(self.rand.sample(TOPICS, 3))),
+                location='%d %s' % (self.rand.randint(1, 999), self.rand.choice(STREETS)),
+                tagline='Together in %s' % self.rand.choice(PROGRAM_NAMES),
+            )
+            for n in range(self.options['orgs'])
+        ])
+        orgs = list(AtriaOrganization.objects.filter(
+            org_name__startswith=LOAD_DATA_ORG_PREFIX).order_by('org_name'))
+
+        admins = self.create_users('orgadmin', len(orgs))
+        self.add_users_to_group(admins, 'Admin')
+        AtriaRelationship.objects.bulk_create([
+            AtriaRelationship(
+                user=admin, org=org, status='Active', effective_date=org.date_joined,
+                relation_type_id=self.relation_types['Employee'])
+            for (admin, org) in zip(admins, orgs)
+        ])
+
+        return orgs
+
+    def create_relationships(self, orgs, neighbours):
+        if not orgs:
+            return
+
+        AtriaRelationship.objects.bulk_create([
+            AtriaRelationship(
+                user=neighbour, org=org, status='Active',
+                effective_date=max(neighbour.date_joined, org.date_joined),
+                relation_type_id=self.relation_types['Member'])
+            for neighbour in neighbours
+            for org in self.rand.sample(
+                orgs, min(len(orgs), self.rand.randint(0, self.options['max_memberships'])))
+        ])
+
+    def create_programs(self):
+        programs = []
+        for n in range(self.options['programs']):
+            name = PROGRAM_NAMES[n % len(PROGRAM_NAMES)]
+            if n >= len(PROGRAM_NAMES):
+                name += ' %d' % (n // len(PROGRAM_NAMES) + 1)
+            programs.append(AtriaEventProgram.objects.get_or_create(
+                abbr='L%03d' % n, defaults={'label': name})[0])
+
+        return programs
+
+    def create_calendars(self, orgs):
+        AtriaCalendar.objects.bulk_create([
+            AtriaCalendar(org_owner=org, calendar_name='%s %d' % (org.org_name[-7:], n))
+            for org in orgs
+            for n in range(self.options['calendars_per_org'])
+        ])
+
+        return list(AtriaCalendar.objects.filter(org_owner__in=orgs).order_by('pk'))
+
+    def create_events(self, calendars, programs):
+        events = []
+        for calendar in calendars:
+            for n in range(self.options['events_per_calendar']):
+                program = self.rand.choice(programs)
+                topic = self.rand.choice(TOPICS)
+                event = AtriaEvent(
+                    event_type=self.event_type,
+                    event_program=program,
+                    calendar=calendar,
+                    location='%d %s' % (self.rand.randint(1, 999), self.rand.choice(STREETS)),
+                    title_en='%s %s' % (program.label, topic),
+                    description_en='A %s for %s at %s, all welcome.' % (
+                        topic, program.label.lower(), calendar.calendar_name),
+                )
+                event.title = event.title_en
+                event.description = event.description_en
+                # about a third of the events are translated
+                for (language, translated_topic) in TRANSLATED_TOPICS.items():
+                    if self.rand.random() < 0.3:
+                        setattr(event, 'title_%s' % language.replace('-', '_'),
+                                '%s %s' % (program.label, translated_topic))
+                events.append(event)
+
+        for i in range(0, len(events), BATCH_SIZE):
+            bulk_create_inherited(AtriaEvent, events[i:i + BATCH_SIZE])
+
+        return events
+
+    def create_opportunities(self, events, calendars):
+        AtriaVolunteerOpportunity.objects.bulk_create([
+            AtriaVolunteerOpportunity(
+                event_id=event.pk,
+                title=title,
+                description='%s volunteers needed for the %s.' % (title, event.title_en),
+                start_date=self.start,
+                date_added=self.start,
+            )
+            for event in events
+            for title in self.rand.sample(
+                OPPORTUNITY_TITLES, self.rand.randint(0, self.options['max_opportunities']))
+        ])
+
+        opportunities = {}
+        for (event_id, opportunity_id) in AtriaVolunteerOpportunity.objects.filter(
+                event__calendar__in=calendars).order_by('pk').values_list('event_id', 'pk'):
+            opportunities.setdefault(event_id, []).append(opportunity_id)
+
+        return opportunities
+
+    def create_occurrences(self, events):
+        occurrences = []
+        for event in events:
+            start_time = self.start + timedelta(
+                days=self.rand.randrange(28), hours=self.rand.randint(8, 20))
+            end_time = start_time + timedelta(minutes=self.rand.choice((60, 90, 120, 180)))
+            freq = self.rand.choice((rrule.DAILY, rrule.WEEKLY, rrule.WEEKLY, rrule.MONTHLY))
+            published = self.rand.random() < 0.8
+
+            for (start, end) in expand_series(
+                    start_time, end_time, freq=freq,
+                    count=self.rand.randint(1, self.options['max_occurrences'])):
+                occurrences.append(AtriaOccurrence(
+                    event_id=event.pk, start_time=start, end_time=end,
+                    published=published))
+
+        for i in range(0, len(occurrences), BATCH_SIZE):
+            bulk_create_inherited(AtriaOccurrence, occurrences[i:i + BATCH_SIZE])
+
+        AtriaOccurrenceBucket.objects.bulk_create([
+            bucket for occurrence in occurrences
+            for bucket in occurrence_buckets(occurrence)
+        ])
+
+        return occurrences
+
+    def create_attendances(self, occurrences, neighbours, opportunities, calendars):
+        weights = (
+            ('Attendee', 6), ('Volunteer', 3), ('Contact', 1),
+        )
+        attendance_types = [name for (name, weight) in weights for _ in range(weight)]
+
+        attendances = []
+        for occurrence in occurrences:
+            if not occurrence.published or not neighbours:
+                continue
+            event_opportunities = opportunities.get(occurrence.event_id)
+            for _ in range(self.rand.randint(0, self.options['max_attendances'])):
+                attendance_type = self.rand.choice(attendance_types)
+                opportunity_id = None
+                if attendance_type == 'Volunteer':
+                    if event_opportunities:
+                        opportunity_id = self.rand.choice(event_opportunities)
+                    else:
+                        attendance_type = 'Attendee'
+                attendances.append(AtriaEventAttendance(
+                    occurrence_id=occurrence.pk,
+                    attendance_type_id=self.attendance_types[attendance_type],
+                    volunteer_opportunity_id=opportunity_id,
+                    user_id=self.rand.choice(neighbours).pk,
+                    user_count=1 if attendance_type == 'Contact' else self.rand.randint(1, 4),
+                    date_added=occurrence.start_time - timedelta(
+                        days=self.rand.randint(1, 30)),
+                ))
+
+        AtriaEventAttendance.objects.bulk_create(attendances)
+
+        # bulk_create sends no signals, so count the attendances afterwards
+        reconcile_occurrence_counters(
+            AtriaOccurrence.objects.filter(event__atriaevent__calendar__in=calendars),
+            AtriaEventAttendance)
+
+    def index_events(self, events):
+        for i in range(0, len(events), LOOKUP_BATCH_SIZE):
+            batch = AtriaEvent.objects.filter(
+                pk__in=[e.pk for e in events[i:i + LOOKUP_BATCH_SIZE]])\
+                .select_related('event_program')\
+                .prefetch_related('atriavolunteeropportunity_set')
+            AtriaEventSearchDocument.objects.bulk_create([
+                AtriaEventSearchDocument(event=event, document=build_search_document(event))
+                for event in batch
+            ])
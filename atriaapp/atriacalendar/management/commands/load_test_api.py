@@ -0,0 +1,141 @@
+"""
+Load tests the calendar API of running servers with concurrent clients, and
+writes requests/sec and latency percentiles per endpoint as JSON.  Pass
+--base-url more than once to compare servers, e.g. the development server
+against gunicorn (see web_tasks.sh):
+
+    python manage.py runserver 8000
+    gunicorn atriaapp.wsgi --bind 127.0.0.1:8001 --threads 8 --worker-class gthread
+    python manage.py load_test_api --base-url http://127.0.0.1:8000 \\
+        --base-url http://127.0.0.1:8001 --clients 16 --output results.json
+
+The "lookups-separate" endpoint makes the two requests a client needs
+without the combined lookups endpoint, and is timed as one request.
+"""
+
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+def percentile(timings, fraction):
+    # List, Float -> Float
+    # Produce the value at fraction of the sorted timings.
+
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+class Command(BaseCommand):
+    help = 'Load test the calendar API of running servers with concurrent clients.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url', action='append', dest='base_urls',
+            help='Server to load test (repeat to compare servers); '
+                 'default http://127.0.0.1:8000.')
+        parser.add_argument(
+            '--clients', type=int, default=8,
+            help='Number of concurrent clients.')
+        parser.add_argument(
+            '--requests', type=int, default=25,
+            help='Number of requests each client makes per endpoint.')
+        parser.add_argument(
+            '--date', help='Day (YYYY-MM-DD) of the calendar periods; default today.')
+        parser.add_argument(
+            '--calendar', type=int, help='Limit the calendar periods to one calendar.')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--output', help='File to write the JSON results to.')
+
+    def handle(self, *args, **options):
+        try:
+            day = timezone.datetime.strptime(options['date'], '%Y-%m-%d').date() \
+                if options['date'] else timezone.localdate()
+        except ValueError:
+            raise CommandError('--date must look like YYYY-MM-DD.')
+
+        results = [
+            self.load_test(base_url.rstrip('/'), self.endpoints(day, options['calendar']), options)
+            for base_url in options['base_urls'] or ['http://127.0.0.1:8000']
+        ]
+        output = json.dumps({
+            'clients': options['clients'],
+            'requests': options['requests'],
+            'timestamp': timezone.now().isoformat(),
+            'servers': results,
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def endpoints(self, day, calendar_id):
+        sunday = day - timezone.timedelta(days=day.isoweekday() % 7)
+        query = '?calendar=%s' % calendar_id if calendar_id else ''
+
+        return [
+            ('month', ['/api/atria/calendar/%s/%s/%s' % (day.year, day.month, query)]),
+            ('week', ['/api/atria/calendar/%s/%s/%s/%s' % (
+                sunday.year, sunday.month, sunday.day,
+                (query + '&' if query else '?') + 'week=true')]),
+            ('day', ['/api/atria/calendar/%s/%s/%s/%s' % (day.year, day.month, day.day, query)]),
+            ('events', ['/api/atria/events/']),
+            ('lookups-separate', ['/api/atria/calendars/', '/api/atria/programs/']),
+            ('lookups', ['/api/atria/lookups/']),
+        ]
+
+    def load_test(self, base_url, endpoints, options):
+        self.stderr.write(base_url)
+        return {
+            'base_url': base_url,
+            'results': [
+                self.load_test_endpoint(base_url, name, paths, options)
+                for (name, paths) in endpoints
+            ],
+        }
+
+    def load_test_endpoint(self, base_url, name, paths, options):
+        # Has each client make its requests in turn, all clients at once, and
+        # times every request and the whole run.
+        def fetch(_):
+            began = time.perf_counter()
+            try:
+                for path in paths:
+                    with urlopen(base_url + path, timeout=options['timeout']) as response:
+                        response.read()
+            except HTTPError as e:
+                return (None, e.code)
+            except URLError as e:
+                raise CommandError('Could not reach %s: %s' % (base_url, e.reason))
+            return ((time.perf_counter() - began) * 1000, 200)
+
+        total = options['clients'] * options['requests']
+        with ThreadPoolExecutor(max_workers=options['clients']) as executor:
+            began = time.perf_counter()
+            responses = list(executor.map(fetch, range(total)))
+            elapsed = time.perf_counter() - began
+
+        timings = sorted(timing for (timing, _) in responses if timing is not None)
+        errors = sorted(set(code for (timing, code) in responses if timing is None))
+        result = {
+            'name': name,
+            'paths': paths,
+            'requests': total,
+            'errors': total - len(timings),
+            'error_statuses': errors,
+            'requests_per_second': round(len(timings) / elapsed, 1),
+            'median_ms': round(statistics.median(timings), 2) if timings else None,
+            'p99_ms': round(percentile(timings, 0.99), 2) if timings else None,
+        }
+        self.stderr.write('  %-18s %8.1f req/s %8s ms median %8s ms p99 %4d errors' % (
+            name, result['requests_per_second'], result['median_ms'],
+            result['p99_ms'], result['errors']))
+
+        return result
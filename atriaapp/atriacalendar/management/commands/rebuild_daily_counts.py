@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ...rollups import rebuild_daily_counts
+
+
+class Command(BaseCommand):
+    help = 'Recount the per-day published occurrence counts of the month grid summary.'
+
+    def handle(self, *args, **options):
+        cells = rebuild_daily_counts()
+
+        self.stdout.write('%s daily count(s) rebuilt.' % cells)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ...models import rebuild_occurrence_buckets
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the interval index buckets of long occurrences.'
+
+    def handle(self, *args, **options):
+        buckets = rebuild_occurrence_buckets()
+
+        self.stdout.write('%s occurrence bucket(s) rebuilt.' % buckets)
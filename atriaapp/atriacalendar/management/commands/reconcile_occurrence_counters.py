@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ...models import AtriaOccurrence, reconcile_occurrence_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount AtriaOccurrence attendee and volunteer counters that have drifted.'
+
+    def handle(self, *args, **options):
+        fixed = reconcile_occurrence_counters(AtriaOccurrence.objects.all())
+
+        self.stdout.write('%s occurrence(s) with drifted counters reconciled.' % fixed)
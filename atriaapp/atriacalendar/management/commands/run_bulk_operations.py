@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from ...bulk import claimable_operations, run_bulk_operation
+from ...models import AtriaBulkOperation
+
+
+class Command(BaseCommand):
+    help = 'Apply pending (and resume abandoned) bulk publish/unpublish/copy operations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--resume-failed', action='store_true',
+            help='Also resume failed operations from where they stopped.')
+        parser.add_argument(
+            '--chunk-size', type=int,
+            help='Occurrences per transaction (default BULK_OPERATION_CHUNK_SIZE).')
+
+    def handle(self, *args, **options):
+        # abandoned running operations (see BULK_OPERATION_LEASE_SECONDS) are
+        # always resumed
+        operations = AtriaBulkOperation.objects.filter(claimable_operations())
+        if not options['resume_failed']:
+            operations = operations.exclude(status='failed')
+        operation_ids = operations.order_by('created', 'pk').values_list('pk', flat=True)
+
+        for operation_id in list(operation_ids):
+            operation = run_bulk_operation(operation_id, options['chunk_size'])
+            self.stdout.write('Bulk operation %s (%s): %s, %s of %s occurrence(s).' % (
+                operation.pk, operation.action, operation.status,
+                operation.processed, operation.total))
@@ -0,0 +1,127 @@
+"""
+In-process request metrics, exposed in the Prometheus text format.
+
+RequestMetricsMiddleware observes every request into the histograms below,
+labelled by the resolved view name.  Each server process keeps its own
+histograms, so with several worker processes every worker has to be
+scraped (or the metrics summed) to get the full picture.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def request_metrics_settings():
+    # -> Dictionary
+    # Produce the request metrics settings, with defaults filled in.
+
+    metrics_settings = {
+        'ENABLED': True,
+        'SERVER_TIMING': True,
+        'SLOW_REQUEST_SECONDS': 1.0,
+        'SLOW_REQUEST_QUERIES': 100,
+        'SLOW_REQUEST_TOP_SQL': 5,
+        'METRICS_ALLOWED_IPS': ('127.0.0.1', '::1'),
+    }
+    metrics_settings.update(getattr(settings, 'REQUEST_METRICS', {}))
+
+    return metrics_settings
+
+
+class Histogram:
+    """
+    A Prometheus histogram with one series per view name.
+    """
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = OrderedDict()
+        self.lock = threading.Lock()
+
+    def observe(self, view, value):
+        with self.lock:
+            (counts, total) = self.series.get(view) or ([0] * (len(self.buckets) + 1), 0)
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.series[view] = (counts, total + value)
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def exposition(self):
+        # -> List
+        # Produce the lines of the histogram in the text exposition format.
+
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s histogram' % self.name,
+        ]
+        with self.lock:
+            series = [(view, list(counts), total)
+                      for (view, (counts, total)) in self.series.items()]
+
+        for (view, counts, total) in series:
+            view = escape_label(view)
+            for (bound, count) in zip(self.buckets, counts):
+                lines.append('%s_bucket{view="%s",le="%s"} %d' % (
+                    self.name, view, bound, count))
+            lines += [
+                '%s_bucket{view="%s",le="+Inf"} %d' % (self.name, view, counts[-1]),
+                '%s_sum{view="%s"} %s' % (self.name, view, repr(float(total))),
+                '%s_count{view="%s"} %d' % (self.name, view, counts[-1]),
+            ]
+
+        return lines
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram(
+    'atria_request_duration_seconds',
+    'Time to answer a request, by view.', DURATION_BUCKETS)
+REQUEST_SQL_DURATION = Histogram(
+    'atria_request_sql_duration_seconds',
+    'Time spent in SQL queries per request, by view.', DURATION_BUCKETS)
+REQUEST_RENDER_DURATION = Histogram(
+    'atria_request_render_duration_seconds',
+    'Time spent rendering template responses per request, by view.', DURATION_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    'atria_request_queries',
+    'Number of SQL queries per request, by view.', QUERY_COUNT_BUCKETS)
+
+HISTOGRAMS = (REQUEST_DURATION, REQUEST_SQL_DURATION, REQUEST_RENDER_DURATION, REQUEST_QUERIES)
+
+
+def observe_request(view, duration, sql_duration, render_duration, queries):
+    REQUEST_DURATION.observe(view, duration)
+    REQUEST_SQL_DURATION.observe(view, sql_duration)
+    REQUEST_RENDER_DURATION.observe(view, render_duration)
+    REQUEST_QUERIES.observe(view, queries)
+
+
+def metrics_exposition():
+    # -> String
+    # Produce all the request metrics in the Prometheus text format.
+
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.exposition()
+
+    return '\n'.join(lines) + '\n'
+
+
+def clear_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
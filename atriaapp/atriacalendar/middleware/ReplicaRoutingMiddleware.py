@@ -0,0 +1,52 @@
+from django.conf import settings
+
+from ..routers import PIN_COOKIE, choose_replica, request_routing, routing_state
+from .URLPermissionsMiddleware import compile_namespace_paths
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Chooses the database alias each request reads from, and pins clients
+    that write to the primary (see atriacalendar.routers).  Goes after the
+    session and authentication middleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths_source = None
+        self.paths_regex = None
+
+    def __call__(self, request):
+        # evaluating the lazy request.user reads the session and user from
+        # the primary, so a client sees its own login and session changes
+        if hasattr(request, 'user'):
+            request.user.is_authenticated
+
+        alias = choose_replica() if self.replica_request(request) else None
+        with request_routing(alias, False):
+            response = self.get_response(request)
+            wrote = routing_state.wrote
+
+        if wrote or request.method not in ('GET', 'HEAD'):
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                httponly=True)
+
+        return response
+
+    def read_paths(self):
+        # -> Pattern
+        # Produce the compiled REPLICA_READ_PATHS, recompiling only if they
+        # were replaced (e.g. by override_settings).
+        paths = getattr(settings, 'REPLICA_READ_PATHS', ())
+        if self.paths_source is not paths:
+            self.paths_source = paths
+            self.paths_regex = compile_namespace_paths(paths)
+
+        return self.paths_regex
+
+    def replica_request(self, request):
+        paths_regex = self.read_paths()
+
+        return request.method in ('GET', 'HEAD') and \
+            PIN_COOKIE not in request.COOKIES and \
+            paths_regex is not None and paths_regex.match(request.path) is not None
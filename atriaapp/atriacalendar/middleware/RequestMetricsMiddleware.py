@@ -0,0 +1,117 @@
+import logging
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.db import connections
+
+from ..metrics import observe_request, request_metrics_settings
+
+
+logger = logging.getLogger('atriacalendar.metrics')
+
+UNRESOLVED_VIEW = '<unresolved>'
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper that counts and times every query.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - began))
+
+    @property
+    def duration(self):
+        return sum(duration for (_, duration) in self.queries)
+
+    def top_statements(self, count):
+        # Integer -> List
+        # Produce the (total time, executions, sql) of the statements that
+        # took the longest overall, so a query repeated per row stands out.
+
+        statements = defaultdict(lambda: [0, 0])
+        for (sql, duration) in self.queries:
+            statements[sql][0] += duration
+            statements[sql][1] += 1
+
+        return sorted(
+            ((total, executions, sql) for (sql, (total, executions)) in statements.items()),
+            reverse=True)[:count]
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the query count, SQL time, template render time and total time of
+    each request by resolved view name (see atriacalendar.metrics).
+
+    Staff users get the figures back in a Server-Timing header, and requests
+    over the slow request thresholds are logged with their most expensive
+    SQL statements.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics_settings = request_metrics_settings()
+        if not metrics_settings['ENABLED']:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        request._metrics_render_duration = 0
+
+        began = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - began
+
+        view = request.resolver_match.view_name \
+            if getattr(request, 'resolver_match', None) else UNRESOLVED_VIEW
+        render_duration = request._metrics_render_duration
+        observe_request(
+            view, duration, recorder.duration, render_duration, len(recorder.queries))
+
+        user = getattr(request, 'user', None)
+        if metrics_settings['SERVER_TIMING'] and user is not None and user.is_staff:
+            response['Server-Timing'] = ', '.join((
+                'db;dur=%.2f;desc="%d queries"' % (
+                    recorder.duration * 1000, len(recorder.queries)),
+                'render;dur=%.2f' % (render_duration * 1000),
+                'total;dur=%.2f;desc="%s"' % (duration * 1000, view),
+            ))
+
+        if duration > metrics_settings['SLOW_REQUEST_SECONDS'] or \
+                len(recorder.queries) > metrics_settings['SLOW_REQUEST_QUERIES']:
+            self.log_slow_request(
+                request, view, duration, recorder, metrics_settings['SLOW_REQUEST_TOP_SQL'])
+
+        return response
+
+    def process_template_response(self, request, response):
+        # Times the deferred rendering of TemplateResponses, which happens
+        # right after this hook.  Views that render eagerly (render()) have
+        # it counted in their view time instead.
+        began = time.perf_counter()
+
+        def rendered(response):
+            request._metrics_render_duration += time.perf_counter() - began
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow_request(self, request, view, duration, recorder, top_count):
+        statements = '\n'.join(
+            '  %8.2f ms %4dx %s' % (total * 1000, executions, sql[:500])
+            for (total, executions, sql) in recorder.top_statements(top_count))
+        logger.warning(
+            'Slow request %s %s (%s): %.2f ms, %d queries, %.2f ms SQL\n%s',
+            request.method, request.get_full_path(), view, duration * 1000,
+            len(recorder.queries), recorder.duration * 1000, statements)
@@ -4,13 +4,45 @@ from django.conf import settings
 from django.core.exceptions import PermissionDenied
 
 
+def compile_namespace_paths(patterns):
+    # Iterable -> Pattern
+    # Produce a single regex matching any of the given URL regexes, or None.
+
+    if not patterns:
+        return None
+
+    return re.compile('|'.join('(?:%s)' % pattern for pattern in patterns))
+
+
+def compile_namespace_permissions(permissions):
+    # Dictionary -> (Dictionary, Dictionary)
+    # Produce a bit per role, and a bitset of the allowed roles per namespace.
+
+    role_bits = {}
+    namespace_masks = {}
+
+    for (namespace, roles) in permissions.items():
+        mask = 0
+        for role in roles:
+            mask |= role_bits.setdefault(role, 1 << len(role_bits))
+        namespace_masks[namespace] = mask
+
+    return (role_bits, namespace_masks)
+
+
 class URLPermissionsMiddleware:
     """
     Simple permissions middleware that checks permissions against URL regexes
     according to settings.
+
+    The settings are compiled into one combined path regex and a role bitset
+    per namespace, so each request is decided with one regex match and one
+    bitwise test against the user's (cached) roles.
     """
     def __init__(self, get_response):
         self.get_response = get_response
+        self.routing_source = None
+        self.routing_table()
 
     def __call__(self, request):
         if not self.applicable_path(request.path) or \
@@ -19,17 +51,30 @@ class URLPermissionsMiddleware:
         else:
             raise PermissionDenied
 
+    def routing_table(self):
+        # -> (Pattern, Dictionary, Dictionary)
+        # Produce the compiled settings, recompiling only if they were
+        # replaced (e.g. by override_settings).
+        paths = getattr(settings, 'URL_NAMESPACE_PATHS', ())
+        permissions = getattr(settings, 'URL_NAMESPACE_PERMISSIONS', {})
+
+        if self.routing_source is None or \
+                self.routing_source[0] is not paths or \
+                self.routing_source[1] is not permissions:
+            self.routing_source = (paths, permissions)
+            self.routing = (compile_namespace_paths(paths),) + \
+                compile_namespace_permissions(permissions)
+
+        return self.routing
+
     def applicable_path(self, path):
-        for pattern in getattr(settings, 'URL_NAMESPACE_PATHS', ()):
-            if re.match(pattern, path):
-                return True
+        paths_regex = self.routing_table()[0]
 
-        return False
+        return paths_regex is not None and paths_regex.match(path) is not None
 
     def request_allowed(self, request):
         user = request.user
         path = request.path
-        url_permissions = getattr(settings, 'URL_NAMESPACE_PERMISSIONS', {})
 
         url_namespace = request.session.get('URL_NAMESPACE', None)
 
@@ -48,10 +93,12 @@ class URLPermissionsMiddleware:
             if user.is_staff:
                 return True
 
-            allowed_roles = url_permissions.get(url_namespace, ())
+            (_, role_bits, namespace_masks) = self.routing_table()
+
+            user_mask = 0
+            for role in user.role_names:
+                user_mask |= role_bits.get(role, 0)
 
-            for role in allowed_roles:
-                if user.has_role(role):
-                    return True
+            return bool(user_mask & namespace_masks.get(url_namespace, 0))
 
         return False
@@ -1 +1,3 @@
 from .URLPermissionsMiddleware import URLPermissionsMiddleware
+from .RequestMetricsMiddleware import RequestMetricsMiddleware
+from .ReplicaRoutingMiddleware import ReplicaRoutingMiddleware
@@ -0,0 +1,57 @@
+# Generated by Django 2.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from ..models import interval_bucket, interval_index_settings
+
+
+def index_long_occurrences(apps, schema_editor):
+    # Builds interval index rows for existing long-running occurrences, if
+    # the index is enabled; otherwise rebuild_occurrence_buckets fills it in
+    # once it is.
+    AtriaOccurrence = apps.get_model('atriacalendar', 'AtriaOccurrence')
+    AtriaOccurrenceBucket = apps.get_model('atriacalendar', 'AtriaOccurrenceBucket')
+    index_settings = interval_index_settings()
+    bucket_duration = index_settings['BUCKET_DURATION']
+
+    if not index_settings['ENABLED']:
+        return
+
+    for occurrence in AtriaOccurrence.objects.all().iterator():
+        if occurrence.end_time - occurrence.start_time > index_settings['LONG_OCCURRENCE_DURATION']:
+            AtriaOccurrenceBucket.objects.bulk_create([
+                AtriaOccurrenceBucket(occurrence=occurrence, bucket=bucket)
+                for bucket in range(
+                    interval_bucket(occurrence.start_time, bucket_duration),
+                    interval_bucket(occurrence.end_time, bucket_duration) + 1)
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swingtime', '0001_initial'),
+        ('atriacalendar', '0017_merge_20190909_2058'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS swingtime_occurrence_start_end_idx '
+            'ON swingtime_occurrence (start_time, end_time)',
+            'DROP INDEX IF EXISTS swingtime_occurrence_start_end_idx',
+        ),
+        migrations.CreateModel(
+            name='AtriaOccurrenceBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.IntegerField()),
+                ('occurrence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='atriacalendar.AtriaOccurrence')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='atriaoccurrencebucket',
+            unique_together={('bucket', 'occurrence')},
+        ),
+        migrations.RunPython(index_long_occurrences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+from ..models import reconcile_occurrence_counters
+
+
+def count_attendances(apps, schema_editor):
+    # Fills in the occurrence counters from existing attendances
+    reconcile_occurrence_counters(
+        apps.get_model('atriacalendar', 'AtriaOccurrence').objects.all(),
+        apps.get_model('atriacalendar', 'AtriaEventAttendance'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atriacalendar', '0018_occurrence_interval_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='atriaoccurrence',
+            name='attendee_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='atriaoccurrence',
+            name='volunteer_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_attendances, migrations.RunPython.noop),
+    ]
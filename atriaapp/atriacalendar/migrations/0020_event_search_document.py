@@ -0,0 +1,80 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:20
+
+from django.db import DatabaseError, migrations, models, transaction
+import django.db.models.deletion
+
+from ..search import POSTGRESQL_SEARCH_CONFIG, SEARCH_TABLE, SQLITE_FTS_TABLE, build_search_document
+
+
+SQLITE_FTS_SQL = (
+    "CREATE VIRTUAL TABLE {fts} USING fts5(document, content='{table}', "
+    "content_rowid='event_id', tokenize='unicode61 remove_diacritics 1')",
+    "CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {fts} (rowid, document) VALUES (new.event_id, new.document); END",
+    "CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {fts} ({fts}, rowid, document) VALUES ('delete', old.event_id, old.document); END",
+    "CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+    "INSERT INTO {fts} ({fts}, rowid, document) VALUES ('delete', old.event_id, old.document); "
+    "INSERT INTO {fts} (rowid, document) VALUES (new.event_id, new.document); END",
+)
+
+POSTGRESQL_INDEX_SQL = (
+    "CREATE INDEX {table}_gin ON {table} USING GIN (to_tsvector('{config}', document))",
+)
+
+
+def create_search_index(apps, schema_editor):
+    # Creates the vendor-specific full-text index over the search documents
+    if schema_editor.connection.vendor == 'sqlite':
+        statements = SQLITE_FTS_SQL
+    elif schema_editor.connection.vendor == 'postgresql':
+        statements = POSTGRESQL_INDEX_SQL
+    else:
+        return
+
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for statement in statements:
+                schema_editor.execute(statement.format(
+                    fts=SQLITE_FTS_TABLE, table=SEARCH_TABLE,
+                    config=POSTGRESQL_SEARCH_CONFIG))
+    except DatabaseError:
+        # e.g. SQLite built without FTS5; search falls back to substring match
+        pass
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % SQLITE_FTS_TABLE)
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS %s_gin' % SEARCH_TABLE)
+
+
+def index_events(apps, schema_editor):
+    # Builds the search documents of existing events
+    AtriaEvent = apps.get_model('atriacalendar', 'AtriaEvent')
+    AtriaEventSearchDocument = apps.get_model('atriacalendar', 'AtriaEventSearchDocument')
+
+    for event in AtriaEvent.objects.select_related('event_program')\
+            .prefetch_related('atriavolunteeropportunity_set'):
+        AtriaEventSearchDocument.objects.create(
+            event=event, document=build_search_document(event))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atriacalendar', '0019_occurrence_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AtriaEventSearchDocument',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='atriacalendar.AtriaEvent')),
+                ('document', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(index_events, migrations.RunPython.noop),
+    ]
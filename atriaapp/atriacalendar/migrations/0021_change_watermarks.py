@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:28
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atriacalendar', '0020_event_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AtriaChangeWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=40, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+                ('modified', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from ..directory import NEIGHBOUR_SEARCH_FIELDS, create_lower_indexes, drop_lower_indexes
+
+
+USER_TABLE = 'atriacalendar_user'
+
+
+def create_directory_indexes(apps, schema_editor):
+    create_lower_indexes(schema_editor, USER_TABLE, NEIGHBOUR_SEARCH_FIELDS)
+
+
+def drop_directory_indexes(apps, schema_editor):
+    drop_lower_indexes(schema_editor, USER_TABLE, NEIGHBOUR_SEARCH_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atriacalendar', '0022_bulk_operations'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_directory_indexes, drop_directory_indexes),
+    ]
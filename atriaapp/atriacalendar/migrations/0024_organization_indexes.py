@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from ..directory import ORGANIZATION_SEARCH_FIELDS, create_lower_indexes, drop_lower_indexes
+
+
+ORGANIZATION_TABLE = 'atriacalendar_atriaorganization'
+
+
+def create_organization_indexes(apps, schema_editor):
+    create_lower_indexes(schema_editor, ORGANIZATION_TABLE, ORGANIZATION_SEARCH_FIELDS)
+
+
+def drop_organization_indexes(apps, schema_editor):
+    drop_lower_indexes(schema_editor, ORGANIZATION_TABLE, ORGANIZATION_SEARCH_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atriacalendar', '0023_directory_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_organization_indexes, drop_organization_indexes),
+    ]
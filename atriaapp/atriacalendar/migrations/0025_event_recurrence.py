@@ -0,0 +1,59 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atriacalendar', '0024_organization_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='atriaevent',
+            name='recurrence_contact',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='atriaevent',
+            name='recurrence_duration',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='atriaevent',
+            name='recurrence_end',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='atriaevent',
+            name='recurrence_exdates',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='atriaevent',
+            name='recurrence_published',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='atriaevent',
+            name='recurrence_rule',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='atriaevent',
+            name='recurrence_start',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='atriaoccurrence',
+            name='recurrence_start',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='atriaevent',
+            index=models.Index(fields=['recurrence_start', 'recurrence_end'], name='atriacalend_recurre_a3d927_idx'),
+        ),
+    ]
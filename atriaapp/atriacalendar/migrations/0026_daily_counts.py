@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from ..rollups import rebuild_daily_counts
+
+
+def count_days(apps, schema_editor):
+    # Fills in the daily counts from existing occurrences and published rules
+    rebuild_daily_counts(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atriacalendar', '0025_event_recurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AtriaDailyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('calendar', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='atriacalendar.AtriaCalendar')),
+                ('event_program', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='atriacalendar.AtriaEventProgram')),
+            ],
+            options={
+                'unique_together': {('day', 'calendar', 'event_program')},
+            },
+        ),
+        migrations.RunPython(count_days, migrations.RunPython.noop),
+    ]
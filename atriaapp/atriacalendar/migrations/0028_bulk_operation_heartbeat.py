@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atriacalendar', '0027_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='atriabulkoperation',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import Group, PermissionsMixin
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.conf import settings
 
@@ -149,7 +150,30 @@ class User(AbstractBaseUser, PermissionsMixin):
         # String -> Boolean
         # Produce true if user is in the given role group.
 
-        return self.groups.filter(name=role).exists()
+        return role in self.role_names
+
+    @property
+    def role_names(self):
+        # -> Frozenset
+        # Produce the names of the user's groups, loaded once per instance
+        # (i.e. once per request for request.user).
+
+        if not hasattr(self, '_role_names'):
+            self._role_names = frozenset(self.groups.values_list('name', flat=True))
+
+        return self._role_names
+
+    def clear_role_cache(self):
+        self.__dict__.pop('_role_names', None)
+
+
+def clear_user_role_cache(sender, instance, action, reverse, **kwargs):
+    # Drops the cached role names of a user whose groups changed.
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        instance.clear_role_cache()
+
+
+models.signals.m2m_changed.connect(clear_user_role_cache, sender=User.groups.through)
 
 
 # Code table for event programs - senior, youth, etc.
@@ -204,6 +228,22 @@ class AtriaEvent(swingtime_models.Event):
         on_delete=models.CASCADE
     )
     location = models.CharField(max_length=100, blank=True)
+    # a repeating series stored as a rule instead of occurrences, see
+    # atriacalendar.recurrence
+    recurrence_rule = models.TextField(blank=True)
+    recurrence_start = models.DateTimeField(blank=True, null=True)
+    recurrence_end = models.DateTimeField(blank=True, null=True)
+    recurrence_duration = models.DurationField(blank=True, null=True)
+    recurrence_exdates = models.TextField(blank=True)
+    recurrence_published = models.BooleanField(default=False)
+    recurrence_contact = models.ForeignKey(
+        User, blank=True, null=True, on_delete=models.SET_NULL, related_name='+')
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recurrence_start', 'recurrence_end']),
+        ]
 
     def __str__(self):
         return self.title + ", " + self.location
@@ -239,27 +279,80 @@ class AtriaOccurrenceManager(swingtime_models.OccurrenceManager):
         start = datetime(start_dt.year, start_dt.month, start_dt.day)
         end_dt = end_dt or start
         end = end_dt.replace(hour=23, minute=59, second=59)
-        qs = self.filter(
-            models.Q(
-                start_time__gte=start,
-                start_time__lte=end,
-            ) |
-            models.Q(
-                end_time__gte=start,
-                end_time__lte=end,
-            ) |
-            models.Q(
-                start_time__lt=start,
-                end_time__gt=end
-            )
-        )
+        qs = self.filter(period_overlap_q(start, end))
 
         return qs.filter(event=event) if event else qs
 
 
+def interval_index_settings():
+    # -> Dictionary
+    # Produce the occurrence interval index settings, with defaults filled in.
+
+    index_settings = {
+        'ENABLED': False,
+        'LONG_OCCURRENCE_DURATION': timedelta(days=1),
+        'BUCKET_DURATION': timedelta(days=7),
+    }
+    index_settings.update(getattr(settings, 'OCCURRENCE_INTERVAL_INDEX', {}))
+
+    return index_settings
+
+
+BUCKET_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def interval_bucket(dt, bucket_duration):
+    # Datetime, Timedelta -> Integer
+    # Produce the number of the fixed-width bucket containing dt.
+
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+
+    return int((dt - BUCKET_EPOCH) // bucket_duration)
+
+
+def period_overlap_q(start, end):
+    '''
+    Returns a filter matching occurrences that have any overlap with the
+    (inclusive) period ``start`` to ``end``.
+
+    The plain form, ``start_time <= end AND end_time >= start``, is a single
+    range on the ``(start_time, end_time)`` index.  When the interval index
+    is enabled, the ``start_time`` range is also bounded from below by the
+    long occurrence duration, and the few occurrences longer than that are
+    found through ``AtriaOccurrenceBucket`` instead.  Only ``AtriaOccurrence``
+    rows are bucketed, so the filter is for ``AtriaOccurrence`` querysets.
+    '''
+    overlap = models.Q(start_time__lte=end, end_time__gte=start)
+    index_settings = interval_index_settings()
+
+    if not index_settings['ENABLED']:
+        return overlap
+
+    bucket_duration = index_settings['BUCKET_DURATION']
+    long_occurrences = AtriaOccurrenceBucket.objects.filter(
+        bucket__gte=interval_bucket(start, bucket_duration),
+        bucket__lte=interval_bucket(end, bucket_duration),
+    ).values('occurrence_id')
+
+    return (
+        models.Q(
+            overlap,
+            start_time__gte=start - index_settings['LONG_OCCURRENCE_DURATION'],
+        ) |
+        models.Q(overlap, pk__in=long_occurrences)
+    )
+
+
 class AtriaOccurrence(swingtime_models.Occurrence):
     published = models.BooleanField(default=False)
     publisher = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+    # totals of AtriaEventAttendance.user_count, maintained by signals below
+    attendee_count = models.IntegerField(default=0)
+    volunteer_count = models.IntegerField(default=0)
+    # the start of the repetition of its event's rule this was stored for
+    recurrence_start = models.DateTimeField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True)
 
     objects = AtriaOccurrenceManager()
 
@@ -288,19 +381,74 @@ class AtriaOccurrence(swingtime_models.Occurrence):
 
     @property
     def volunteer_total(self):
-        total = self.atriaeventattendance_set\
-                .filter(attendance_type__attendance_type='Volunteer')\
-                .aggregate(sum=models.Sum('user_count'))['sum']
-
-        return total if total else 0
+        return self.volunteer_count
 
     @property
     def attendee_total(self):
-        total = self.atriaeventattendance_set\
-                .filter(attendance_type__attendance_type='Attendee')\
-                .aggregate(sum=models.Sum('user_count'))['sum']
+        return self.attendee_count
+
+
+# interval index entries for occurrences longer than the configured
+# LONG_OCCURRENCE_DURATION, one row per bucket the occurrence spans
+class AtriaOccurrenceBucket(models.Model):
+    occurrence = models.ForeignKey(AtriaOccurrence, on_delete=models.CASCADE)
+    bucket = models.IntegerField()
+
+    class Meta:
+        unique_together = (('bucket', 'occurrence'),)
+
+    def __str__(self):
+        return str(self.occurrence) + ':' + str(self.bucket)
+
+
+def occurrence_buckets(occurrence):
+    # AtriaOccurrence -> List
+    # Produce the interval index rows of an occurrence; only occurrences
+    # longer than LONG_OCCURRENCE_DURATION are bucketed, and none while the
+    # index is disabled.
+
+    index_settings = interval_index_settings()
+    bucket_duration = index_settings['BUCKET_DURATION']
+
+    if not index_settings['ENABLED']:
+        return []
+    if occurrence.end_time - occurrence.start_time <= index_settings['LONG_OCCURRENCE_DURATION']:
+        return []
+
+    return [
+        AtriaOccurrenceBucket(occurrence_id=occurrence.pk, bucket=bucket)
+        for bucket in range(
+            interval_bucket(occurrence.start_time, bucket_duration),
+            interval_bucket(occurrence.end_time, bucket_duration) + 1)
+    ]
+
+
+def index_occurrence_buckets(sender, instance, raw=False, **kwargs):
+    # Rebuilds the interval index rows for a saved occurrence.
+    if raw or not interval_index_settings()['ENABLED']:
+        return
+
+    AtriaOccurrenceBucket.objects.filter(occurrence=instance).delete()
+    AtriaOccurrenceBucket.objects.bulk_create(occurrence_buckets(instance))
+
+
+models.signals.post_save.connect(index_occurrence_buckets, sender=AtriaOccurrence)
+
+
+def rebuild_occurrence_buckets():
+    # -> Integer
+    # Rebuilds the interval index rows of every occurrence, producing the
+    # number of rows; saves don't maintain the index while it is disabled.
+
+    AtriaOccurrenceBucket.objects.all().delete()
+    buckets = [
+        bucket
+        for occurrence in AtriaOccurrence.objects.only('start_time', 'end_time').iterator()
+        for bucket in occurrence_buckets(occurrence)
+    ]
+    AtriaOccurrenceBucket.objects.bulk_create(buckets, batch_size=500)
 
-        return total if total else 0
+    return len(buckets)
 
 
 # general announcements from an Org (will show up on a user's feed if they have an org relationship)
@@ -376,11 +524,86 @@ class AtriaVolunteerOpportunity(models.Model):
     description = models.TextField(max_length=4000, blank=True)
     start_date = models.DateTimeField(default=timezone.now)
     date_added = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return str(self.event) + ':' + self.title
 
 
+# denormalized text of an event and its opportunities in all languages, for
+# the full-text index (see search.py)
+class AtriaEventSearchDocument(models.Model):
+    event = models.OneToOneField(AtriaEvent, on_delete=models.CASCADE, primary_key=True)
+    document = models.TextField(blank=True)
+
+    def __str__(self):
+        return str(self.event)
+
+
+# the last change to the events of a calendar or program, or to any event
+# (scope "all"), for conditional GETs on the calendar API (see watermarks.py)
+class AtriaChangeWatermark(models.Model):
+    scope = models.CharField(max_length=40, unique=True)
+    version = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.scope + ':' + str(self.version)
+
+
+# the published occurrences (stored and virtual) starting on each local day,
+# per calendar and program, kept up to date by atriacalendar.rollups for the
+# month grid summary
+class AtriaDailyCount(models.Model):
+    day = models.DateField()
+    calendar = models.ForeignKey(AtriaCalendar, blank=True, null=True, on_delete=models.CASCADE)
+    event_program = models.ForeignKey(AtriaEventProgram, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('day', 'calendar', 'event_program'),)
+
+    def __str__(self):
+        return '%s:%s:%s = %s' % (self.day, self.calendar_id, self.event_program_id, self.count)
+
+
+# a publish, unpublish or copy over many occurrences, applied in chunks by
+# bulk.run_bulk_operation; last_id records how far it got so an interrupted
+# operation can resume, and heartbeat is renewed after every chunk so that
+# a running operation whose runner died can be claimed again
+class AtriaBulkOperation(models.Model):
+    ACTIONS = (
+        ('publish', 'Publish'),
+        ('unpublish', 'Unpublish'),
+        ('copy', 'Copy'),
+    )
+    STATUSES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    org = models.ForeignKey(AtriaOrganization, on_delete=models.CASCADE, blank=True, null=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    criteria = models.TextField(default='{}')
+    copy_days = models.IntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    last_id = models.IntegerField(default=0)
+    max_id = models.IntegerField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    heartbeat = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return self.action + ':' + str(self.pk) + ' - ' + self.status
+
+
 # event history tracking (for an organization)
 # can be related to a specific user, or just a general count of attendees, volunteers etc.
 class AtriaEventAttendance(models.Model):
@@ -397,3 +620,99 @@ class AtriaEventAttendance(models.Model):
         return str(self.occurrence) + ':' + self.user.email + ' - ' + str(self.attendance_type)
 
 
+
+
+# AtriaOccurrence counter column for each counted attendance type
+ATTENDANCE_COUNTERS = {
+    'Attendee': 'attendee_count',
+    'Volunteer': 'volunteer_count',
+}
+
+
+def attendance_counter(occurrence_id, attendance_type, user_count):
+    # Integer, String, Integer -> Tuple
+    # Produce the (occurrence id, counter column, amount) an attendance adds
+    # to, or None if it isn't counted.
+
+    counter = ATTENDANCE_COUNTERS.get(attendance_type)
+    if occurrence_id is None or counter is None or not user_count:
+        return None
+
+    return (occurrence_id, counter, user_count)
+
+
+def apply_attendance_counter(counted, sign):
+    if counted:
+        (occurrence_id, counter, user_count) = counted
+        AtriaOccurrence.objects.filter(pk=occurrence_id).update(
+            **{counter: models.F(counter) + sign * user_count})
+
+
+def capture_previous_attendance(sender, instance, raw=False, **kwargs):
+    # Remembers what an existing attendance counted before it is changed.
+    instance._previous_counted = None
+
+    if not raw and instance.pk:
+        previous = AtriaEventAttendance.objects.filter(pk=instance.pk).values_list(
+            'occurrence_id', 'attendance_type__attendance_type', 'user_count').first()
+        if previous:
+            instance._previous_counted = attendance_counter(*previous)
+
+
+def count_saved_attendance(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    apply_attendance_counter(getattr(instance, '_previous_counted', None), -1)
+    apply_attendance_counter(attendance_counter(
+        instance.occurrence_id,
+        instance.attendance_type.attendance_type,
+        instance.user_count), 1)
+
+
+def count_deleted_attendance(sender, instance, **kwargs):
+    apply_attendance_counter(attendance_counter(
+        instance.occurrence_id,
+        instance.attendance_type.attendance_type,
+        instance.user_count), -1)
+
+
+models.signals.pre_save.connect(capture_previous_attendance, sender=AtriaEventAttendance)
+models.signals.post_save.connect(count_saved_attendance, sender=AtriaEventAttendance)
+models.signals.post_delete.connect(count_deleted_attendance, sender=AtriaEventAttendance)
+
+
+def attendance_totals(attendance_model=None):
+    # -> Dictionary
+    # Produce a subquery expression per counter column that recomputes its
+    # value from the attendances of the outer occurrence.
+
+    attendance_model = attendance_model or AtriaEventAttendance
+    totals = {}
+    for (attendance_type, counter) in ATTENDANCE_COUNTERS.items():
+        totals[counter] = Coalesce(models.Subquery(
+            attendance_model.objects.filter(
+                occurrence=models.OuterRef('pk'),
+                attendance_type__attendance_type=attendance_type,
+            ).order_by().values('occurrence')
+             .annotate(total=models.Sum('user_count')).values('total'),
+            output_field=models.IntegerField(),
+        ), 0)
+
+    return totals
+
+
+def reconcile_occurrence_counters(queryset, attendance_model=None):
+    # QuerySet -> Integer
+    # Recounts the counters of the occurrences in queryset that have drifted,
+    # and produces the number of occurrences fixed.
+
+    totals = attendance_totals(attendance_model)
+    drifted = queryset.annotate(**{
+        'actual_' + counter: total for (counter, total) in totals.items()
+    }).exclude(**{
+        counter: models.F('actual_' + counter) for counter in totals
+    }).values_list('pk', flat=True)
+
+    # recount in the UPDATE itself, so concurrent F() increments aren't lost
+    return queryset.model.objects.filter(pk__in=list(drifted)).update(**totals)
@@ -0,0 +1,190 @@
+"""
+Profile page loaders for neighbours and organizations.
+
+The loaders fetch a page of a profile's connections and (most recent)
+attendances with their related rows joined in, so a profile page costs the
+same number of queries however long its history is.  The pages are
+PROFILE_LIST_LIMIT rows long, and picked by the connections_page and
+attendances_page parameters.  The counts shown on a profile
+(connections, upcoming attendances or events, volunteer hours) are cached
+per profile and dropped by the signal handlers below when the rows they
+count change.  Organization summaries are also keyed by the shared calendar
+version (see cache.py), so bulk occurrence changes, which send no signals,
+refresh them too; PROFILE_SUMMARY_TIMEOUT bounds how long "upcoming" can
+lag behind the clock.
+"""
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .cache import calendar_cache, calendar_version
+from .models import AtriaEventAttendance, AtriaOccurrence, AtriaRelationship
+
+
+MEMBER_RELATION = 'Member'
+
+
+def profile_list_limit():
+    return getattr(settings, 'PROFILE_LIST_LIMIT', 50)
+
+
+def profile_page(queryset, number):
+    # QuerySet, String -> Page
+    # Produce a page of a profile list; its paginator counts the whole list.
+
+    return Paginator(queryset, profile_list_limit()).get_page(number)
+
+
+def neighbour_summary_key(user_id):
+    return 'atria:profile-summary:user:%s' % user_id
+
+
+def organization_summary_key(org_id):
+    return 'atria:profile-summary:org:%s:%s' % (org_id, calendar_version())
+
+
+def volunteer_hours(attendances):
+    # QuerySet -> Float
+    # Produce the hours of volunteering in attendances, counting each
+    # attendance's occurrence duration once per person (user_count).
+    # Durations can't be multiplied in SQL on every database, so they are
+    # summed per distinct user_count.
+
+    durations = attendances.filter(
+        attendance_type__attendance_type='Volunteer',
+    ).order_by().values('user_count').annotate(duration=models.Sum(
+        models.ExpressionWrapper(
+            models.F('occurrence__end_time') - models.F('occurrence__start_time'),
+            output_field=models.DurationField())))
+
+    seconds = sum(
+        row['duration'].total_seconds() * row['user_count']
+        for row in durations if row['duration'])
+
+    return round(seconds / 3600, 1)
+
+
+def cached_summary(key, build):
+    cache = calendar_cache()
+    summary = cache.get(key)
+
+    if summary is None:
+        summary = build()
+        cache.set(key, summary, getattr(settings, 'PROFILE_SUMMARY_TIMEOUT', 60 * 10))
+
+    return summary
+
+
+def neighbour_summary(user_id):
+    # Integer -> Dictionary
+    # Produce the connection, upcoming attendance and volunteer hour counts
+    # of a neighbour.
+
+    def build():
+        attendances = AtriaEventAttendance.objects.filter(user_id=user_id)
+        return {
+            'connections': AtriaRelationship.objects.filter(
+                user_id=user_id, relation_type__relation_type=MEMBER_RELATION).count(),
+            'upcoming': attendances.filter(occurrence__start_time__gte=timezone.now()).count(),
+            'volunteer_hours': volunteer_hours(attendances),
+        }
+
+    return cached_summary(neighbour_summary_key(user_id), build)
+
+
+def organization_summary(org_id):
+    # Integer -> Dictionary
+    # Produce the member connection, upcoming published occurrence and
+    # volunteer hour counts of an organization.
+
+    def build():
+        return {
+            'connections': AtriaRelationship.objects.filter(
+                org_id=org_id, relation_type__relation_type=MEMBER_RELATION).count(),
+            'upcoming': AtriaOccurrence.objects.get_for_org_id(org_id).filter(
+                published=True, start_time__gte=timezone.now()).count(),
+            'volunteer_hours': volunteer_hours(AtriaEventAttendance.objects.filter(
+                occurrence__event__atriaevent__calendar__org_owner_id=org_id)),
+        }
+
+    return cached_summary(organization_summary_key(org_id), build)
+
+
+def neighbour_profile(neighbour, attendances=True, pages=None):
+    # User, Boolean, Dictionary -> Dictionary
+    # Produce the template context of a neighbour's profile: the neighbour,
+    # a page of their org connections, a page of their latest attendances
+    # (if asked for) and their summary.  pages holds the page numbers, like
+    # request.GET.
+
+    pages = pages or {}
+    connections = profile_page(neighbour.atriarelationship_set.filter(
+        relation_type__relation_type=MEMBER_RELATION,
+    ).select_related('org', 'relation_type').order_by('org__org_name', 'pk'),
+        pages.get('connections_page'))
+
+    context = {
+        'neighbour': neighbour,
+        'connections': list(connections.object_list),
+        'connections_page': connections,
+        'attendances': [],
+        'summary': neighbour_summary(neighbour.pk),
+    }
+
+    if attendances:
+        page = profile_page(neighbour.atriaeventattendance_set.select_related(
+            'attendance_type', 'volunteer_opportunity', 'occurrence__event__atriaevent',
+        ).order_by('-occurrence__start_time', '-pk'), pages.get('attendances_page'))
+        context.update({'attendances': list(page.object_list), 'attendances_page': page})
+
+    return context
+
+
+def organization_profile(org, pages=None):
+    # AtriaOrganization, Dictionary -> Dictionary
+    # Produce the template context of an organization's profile: the org, a
+    # page of its member connections and its summary.
+
+    connections = profile_page(org.atriarelationship_set.filter(
+        relation_type__relation_type=MEMBER_RELATION,
+    ).select_related('user', 'relation_type').order_by('user__email', 'pk'),
+        (pages or {}).get('connections_page'))
+
+    return {
+        'org': org,
+        'connections': list(connections.object_list),
+        'connections_page': connections,
+        'summary': organization_summary(org.pk),
+    }
+
+
+def occurrence_org_id(occurrence_id):
+    return AtriaOccurrence.objects.filter(pk=occurrence_id)\
+        .values_list('event__atriaevent__calendar__org_owner_id', flat=True).first()
+
+
+def invalidate_summaries(user_id=None, org_id=None):
+    cache = calendar_cache()
+    if user_id:
+        cache.delete(neighbour_summary_key(user_id))
+    if org_id:
+        cache.delete(organization_summary_key(org_id))
+
+
+def invalidate_relationship(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_summaries(instance.user_id, instance.org_id)
+
+
+def invalidate_attendance(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_summaries(instance.user_id, occurrence_org_id(instance.occurrence_id))
+
+
+post_save.connect(invalidate_relationship, sender=AtriaRelationship)
+post_delete.connect(invalidate_relationship, sender=AtriaRelationship)
+post_save.connect(invalidate_attendance, sender=AtriaEventAttendance)
+post_delete.connect(invalidate_attendance, sender=AtriaEventAttendance)
@@ -0,0 +1,287 @@
+"""
+Recurring events stored as a rule instead of occurrence rows.
+
+With EVENT_RECURRENCE_STORAGE = 'rule', a repeating series is saved on its
+AtriaEvent as an RRULE (in local wall-clock time, so repetitions keep their
+time of day across daylight saving changes), a start, a duration and a list
+of exception dates, instead of as two rows per repetition.  Calendar queries
+expand the rules of the events overlapping their window in memory
+(``virtual_occurrences``) and merge the results with the stored occurrences.
+
+A repetition gets a concrete AtriaOccurrence only when it is attended,
+published individually or edited (``materialize_occurrence``).  Its start
+is then added to the event's exception dates, so it is never produced
+virtually again, and kept as the row's ``recurrence_start``.
+"""
+
+import json
+
+import pytz
+from dateutil import rrule
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import (
+    AtriaEvent, AtriaEventAttendance, AtriaOccurrence, EventAttendanceType)
+
+
+VIRTUAL_START_FORMAT = '%Y%m%dT%H%M%SZ'
+
+# AtriaEvent fields maintained here rather than by the event forms
+RECURRENCE_FIELDS = (
+    'recurrence_rule', 'recurrence_start', 'recurrence_end', 'recurrence_duration',
+    'recurrence_exdates', 'recurrence_published', 'recurrence_contact')
+
+
+def rule_storage_enabled():
+    return getattr(settings, 'EVENT_RECURRENCE_STORAGE', 'rows') == 'rule'
+
+
+def local_naive(dt):
+    # Datetime -> Datetime
+    # Produce dt as a naive local wall-clock time, as the rules are stored.
+
+    if timezone.is_aware(dt):
+        dt = timezone.localtime(dt)
+    return dt.replace(tzinfo=None)
+
+
+def local_aware(dt):
+    # Datetime -> Datetime
+    # Produce a naive local wall-clock time as an aware datetime.  Like
+    # RFC 5545, a time repeated when daylight saving time ends is taken as
+    # the first (daylight) one, and a time skipped when it starts is read
+    # with the offset before the gap (02:30 becomes 03:30 daylight time).
+
+    try:
+        return timezone.make_aware(dt)
+    except pytz.AmbiguousTimeError:
+        return timezone.make_aware(dt, is_dst=True)
+    except pytz.NonExistentTimeError:
+        return timezone.make_aware(dt, is_dst=False)
+
+
+def event_rule(event):
+    # AtriaEvent -> rrule
+    # Produce the rule of a recurring event.
+
+    return rrule.rrulestr(
+        event.recurrence_rule, dtstart=local_naive(event.recurrence_start))
+
+
+def exception_dates(event):
+    # AtriaEvent -> Set
+    # Produce the starts of the repetitions the event's rule skips.
+
+    return set(
+        parse_datetime(value) for value in json.loads(event.recurrence_exdates or '[]'))
+
+
+def set_recurrence(event, start_time, end_time, contact=None, **rrule_params):
+    # AtriaEvent, Datetime, Datetime, User, ... -> AtriaEvent
+    # Store a series on the event as a rule, like create_series would store
+    # it as rows.  The rule must have a count or until.
+
+    rrule_params.setdefault('freq', rrule.DAILY)
+    if isinstance(rrule_params.get('until'), timezone.datetime):
+        rrule_params['until'] = local_naive(rrule_params['until'])
+    rule = rrule.rrule(dtstart=local_naive(start_time), **rrule_params)
+    starts = list(rule)
+    duration = end_time - start_time
+
+    event.recurrence_rule = [
+        line for line in str(rule).splitlines() if line.startswith('RRULE:')][0]
+    event.recurrence_start = start_time
+    event.recurrence_end = local_aware(starts[-1]) + duration if starts else start_time
+    event.recurrence_duration = duration
+    event.recurrence_exdates = '[]'
+    event.recurrence_contact = contact
+    event.save()
+
+    return event
+
+
+def expand_event(event, start, end):
+    # AtriaEvent, Datetime, Datetime -> List
+    # Produce the (start, end) times of the repetitions of the event's rule
+    # overlapping start to end, without its exception dates.
+
+    duration = event.recurrence_duration
+    exdates = exception_dates(event)
+    starts = event_rule(event).between(
+        local_naive(start) - duration, local_naive(end), inc=True)
+
+    times = []
+    for repetition in starts:
+        repetition = local_aware(repetition)
+        if repetition not in exdates and repetition + duration >= start:
+            times.append((repetition, repetition + duration))
+
+    return times
+
+
+def virtual_occurrence(event, start_time, end_time):
+    # AtriaEvent, Datetime, Datetime -> AtriaOccurrence
+    # Produce an unsaved occurrence for a repetition of the event's rule.
+
+    # occurrence.event.atriaevent is the event itself, without a query
+    AtriaEvent._meta.get_field('event_ptr').remote_field.set_cached_value(event, event)
+
+    return AtriaOccurrence(
+        event=event, start_time=start_time, end_time=end_time,
+        published=event.recurrence_published, recurrence_start=start_time)
+
+
+def recurring_events(start, end):
+    # Datetime, Datetime -> QuerySet
+    # Produce the events whose rules may have repetitions overlapping start
+    # to end.
+
+    if timezone.is_naive(start):
+        start = local_aware(start)
+    if timezone.is_naive(end):
+        end = local_aware(end)
+
+    return AtriaEvent.objects.exclude(recurrence_rule='').filter(
+        recurrence_start__lte=end, recurrence_end__gte=start)
+
+
+def virtual_occurrences(events, start, end):
+    # QuerySet, Datetime, Datetime -> List
+    # Produce the virtual occurrences of the recurring events overlapping
+    # start to end, by start time.
+
+    if timezone.is_naive(start):
+        start = local_aware(start)
+    if timezone.is_naive(end):
+        end = local_aware(end)
+
+    occurrences = [
+        virtual_occurrence(event, start_time, end_time)
+        for event in events
+        for (start_time, end_time) in expand_event(event, start, end)
+    ]
+
+    return sorted(occurrences, key=lambda occurrence: (occurrence.start_time, occurrence.event_id))
+
+
+def virtual_start(occurrence):
+    # AtriaOccurrence -> String
+    # Produce the URL form of a virtual occurrence's start, or None for a
+    # stored occurrence.
+
+    if occurrence.pk is not None:
+        return None
+    return occurrence.start_time.astimezone(timezone.utc).strftime(VIRTUAL_START_FORMAT)
+
+
+def parse_virtual_start(value):
+    # String -> Datetime
+    # Produce the start a virtual_start value stands for, or None.
+
+    try:
+        return timezone.datetime.strptime(value, VIRTUAL_START_FORMAT)\
+            .replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def recurrence_visible(event, user):
+    # AtriaEvent, User -> Boolean
+    # Produce whether user may see the repetitions of the event's rule: the
+    # rule is published, or user is related to the org owning its calendar.
+
+    if event.recurrence_published:
+        return True
+
+    return user.is_authenticated and AtriaEvent.objects.filter(
+        pk=event.pk, calendar__org_owner__atriarelationship__user=user).exists()
+
+
+def find_virtual_occurrence(event, start_time, user=None):
+    # AtriaEvent, Datetime, User -> AtriaOccurrence
+    # Produce the virtual occurrence of the event starting at start_time, or
+    # None if its rule has no such repetition, or if user is given and may
+    # not see it.
+
+    if not event.recurrence_rule:
+        return None
+    if user is not None and not recurrence_visible(event, user):
+        return None
+
+    for (repetition, end_time) in expand_event(event, start_time, start_time):
+        if repetition == start_time:
+            return virtual_occurrence(event, repetition, end_time)
+
+    return None
+
+
+def materialize_occurrence(event, start_time, user=None, **fields):
+    # AtriaEvent, Datetime, User, ... -> AtriaOccurrence
+    # Produce the stored occurrence for the repetition of the event starting
+    # at start_time, creating it (with the given field values) if it is
+    # still virtual.  Raises AtriaOccurrence.DoesNotExist if the rule has no
+    # such repetition, or if user is given and may not see it.
+
+    with transaction.atomic():
+        event = AtriaEvent.objects.select_for_update().get(pk=event.pk)
+        occurrence = AtriaOccurrence.objects.filter(
+            event_id=event.pk, recurrence_start=start_time).first()
+        if occurrence is not None:
+            return occurrence
+
+        virtual = find_virtual_occurrence(event, start_time, user)
+        if virtual is None:
+            raise AtriaOccurrence.DoesNotExist(
+                'No repetition of event %s starts at %s.' % (event.pk, start_time))
+
+        for (name, value) in fields.items():
+            setattr(virtual, name, value)
+        virtual.save()
+
+        if event.recurrence_contact_id:
+            AtriaEventAttendance.objects.create(
+                occurrence=virtual,
+                user_id=event.recurrence_contact_id,
+                attendance_type=EventAttendanceType.objects.filter(
+                    attendance_type='Contact').get(),
+                user_count=1)
+
+        exdates = json.loads(event.recurrence_exdates or '[]')
+        exdates.append(start_time.isoformat())
+        event.recurrence_exdates = json.dumps(sorted(exdates))
+        event.save(update_fields=['recurrence_exdates'])
+
+    return virtual
+
+
+def merge_occurrences(occurrences, virtual):
+    # Iterable, List -> List
+    # Produce the stored and virtual occurrences together, by start time.
+
+    return sorted(
+        list(occurrences) + virtual,
+        key=lambda occurrence: (occurrence.start_time, occurrence.pk or 0))
+
+
+def filter_recurring_events(events, calendar_ids=None, program_ids=None):
+    # QuerySet, List, List -> QuerySet
+    # Produce the recurring events of the given calendars and programs (None
+    # for any).
+
+    if calendar_ids is not None:
+        events = events.filter(calendar_id__in=calendar_ids)
+    if program_ids is not None:
+        events = events.filter(event_program_id__in=program_ids)
+    return events
+
+
+def publish_recurrence(event, published=True):
+    # AtriaEvent, Boolean ->
+    # Publishes (or unpublishes) the virtual occurrences of an event.
+
+    event.recurrence_published = published
+    event.save(update_fields=['recurrence_published'])
@@ -0,0 +1,282 @@
+"""
+Per-day counts of published occurrences, for the month grid summary.
+
+``AtriaDailyCount`` holds the number of published occurrences starting on
+each local day, per calendar and program, counting the virtual repetitions
+of published recurrence rules too.  Writes don't add or subtract one from
+the counts: the cells a write touches are recounted from the occurrences
+(``refresh_daily_counts``), so the table can't drift away from them, and
+``rebuild_daily_counts`` recounts everything.  Both take a migration's apps
+to count with its historical models.  A refresh counts and writes its cells
+in one transaction, holding a lock on their programs.
+
+The signal handlers below refresh the cells of single occurrence and event
+writes; occurrences updated in bulk are refreshed by
+``bulk.occurrences_changed`` through ``occurrences_counts_changed``.
+"""
+
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models.functions import TruncDay
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.utils import timezone
+
+from .models import AtriaDailyCount, AtriaEvent, AtriaOccurrence
+from .recurrence import RECURRENCE_FIELDS, expand_event
+
+
+# AtriaEvent fields that change which days and cells its occurrences count in
+EVENT_COUNT_FIELDS = (
+    'calendar_id', 'event_program_id', 'recurrence_rule', 'recurrence_start',
+    'recurrence_end', 'recurrence_duration', 'recurrence_exdates', 'recurrence_published')
+
+
+def local_day(dt):
+    # Datetime -> Date
+    # Produce the local day of dt (naive datetimes are already local).
+
+    if timezone.is_naive(dt):
+        return dt.date()
+    return timezone.localtime(dt, timezone.get_default_timezone()).date()
+
+
+def day_start(day):
+    # Date -> Datetime
+    # Produce the start of a local day.
+
+    return timezone.make_aware(
+        timezone.datetime(day.year, day.month, day.day), timezone.get_default_timezone())
+
+
+def rollup_models(apps=None):
+    # Apps -> Tuple
+    # Produce the AtriaDailyCount, AtriaEvent and AtriaOccurrence models, or
+    # a migration's historical ones.
+
+    if apps is None:
+        return (AtriaDailyCount, AtriaEvent, AtriaOccurrence)
+    return tuple(
+        apps.get_model('atriacalendar', name)
+        for name in ('AtriaDailyCount', 'AtriaEvent', 'AtriaOccurrence'))
+
+
+def scope_q(calendar_ids, program_ids, calendar_field, program_field):
+    # Iterable, Iterable, String, String -> Q
+    # Produce a filter on the given calendars (None standing for events
+    # without one) and programs.
+
+    calendar_ids = set(calendar_ids)
+    calendars = models.Q(**{calendar_field + '__in': calendar_ids - {None}})
+    if None in calendar_ids:
+        calendars |= models.Q(**{calendar_field + '__isnull': True})
+
+    return calendars & models.Q(**{program_field + '__in': set(program_ids)})
+
+
+def count_days(first_day, last_day, calendar_ids, program_ids, apps=None):
+    # Date, Date, Iterable, Iterable, Apps -> Dictionary
+    # Produce the number of published occurrences, stored and virtual,
+    # starting on each day from first_day to last_day, by (day, calendar id,
+    # program id).
+
+    (_, event_model, occurrence_model) = rollup_models(apps)
+    (start, end) = (day_start(first_day), day_start(last_day + timedelta(days=1)))
+    counts = {}
+
+    stored = occurrence_model.objects.filter(
+        scope_q(calendar_ids, program_ids,
+                'event__atriaevent__calendar_id', 'event__atriaevent__event_program_id'),
+        published=True, start_time__gte=start, start_time__lt=end,
+    ).annotate(
+        day=TruncDay('start_time', tzinfo=timezone.get_default_timezone()),
+    ).order_by().values_list(
+        'day', 'event__atriaevent__calendar_id', 'event__atriaevent__event_program_id',
+    ).annotate(count=models.Count('pk'))
+
+    for (day, calendar_id, program_id, count) in stored:
+        key = (local_day(day), calendar_id, program_id)
+        counts[key] = counts.get(key, 0) + count
+
+    events = event_model.objects.exclude(recurrence_rule='').filter(
+        scope_q(calendar_ids, program_ids, 'calendar_id', 'event_program_id'),
+        recurrence_published=True, recurrence_start__lt=end, recurrence_end__gte=start,
+    ).only('calendar_id', 'event_program_id', *RECURRENCE_FIELDS)
+
+    for event in events:
+        for (start_time, _) in expand_event(event, start, end - timedelta(microseconds=1)):
+            if start_time >= start:
+                key = (local_day(start_time), event.calendar_id, event.event_program_id)
+                counts[key] = counts.get(key, 0) + 1
+
+    return counts
+
+
+def refresh_daily_counts(first_day, last_day, calendar_ids, program_ids, apps=None):
+    # Date, Date, Iterable, Iterable, Apps ->
+    # Recounts the cells of the given days, calendars and programs.
+
+    (count_model, _, _) = rollup_models(apps)
+    calendar_ids = set(calendar_ids)
+    program_ids = set(program_ids) - {None}
+    if not program_ids:
+        return
+
+    # Every cell belongs to one program: locking the programs (in id order)
+    # serializes the refreshes of overlapping cells, and counting after
+    # taking the lock sees every write committed before it.
+    program_model = count_model._meta.get_field('event_program').related_model
+    with transaction.atomic():
+        list(program_model.objects.select_for_update()
+             .filter(pk__in=program_ids).order_by('pk').values_list('pk', flat=True))
+
+        counts = count_days(first_day, last_day, calendar_ids, program_ids, apps)
+
+        count_model.objects.filter(
+            scope_q(calendar_ids, program_ids, 'calendar_id', 'event_program_id'),
+            day__gte=first_day, day__lte=last_day,
+        ).delete()
+        count_model.objects.bulk_create([
+            count_model(
+                day=day, calendar_id=calendar_id, event_program_id=program_id, count=count)
+            for ((day, calendar_id, program_id), count) in counts.items()
+        ])
+
+
+def rebuild_daily_counts(apps=None):
+    # Apps -> Integer
+    # Recounts every cell, producing the number of cells.
+
+    (count_model, event_model, occurrence_model) = rollup_models(apps)
+
+    bounds = occurrence_model.objects.filter(published=True).aggregate(
+        first=models.Min('start_time'), last=models.Max('start_time'))
+    rules = event_model.objects.exclude(recurrence_rule='').filter(
+        recurrence_published=True,
+    ).aggregate(first=models.Min('recurrence_start'), last=models.Max('recurrence_end'))
+
+    firsts = [dt for dt in (bounds['first'], rules['first']) if dt]
+    lasts = [dt for dt in (bounds['last'], rules['last']) if dt]
+
+    with transaction.atomic():
+        count_model.objects.all().delete()
+        if firsts:
+            refresh_daily_counts(
+                local_day(min(firsts)), local_day(max(lasts)),
+                set(event_model.objects.values_list('calendar_id', flat=True).distinct()),
+                set(event_model.objects.values_list('event_program_id', flat=True).distinct()),
+                apps)
+
+    return count_model.objects.count()
+
+
+def occurrences_counts_changed(queryset):
+    # QuerySet ->
+    # Refreshes the cells of occurrences updated in bulk.
+
+    ranges = queryset.order_by().values_list(
+        'event__atriaevent__calendar_id', 'event__atriaevent__event_program_id',
+    ).annotate(first=models.Min('start_time'), last=models.Max('start_time'))
+
+    for (calendar_id, program_id, first, last) in ranges:
+        refresh_daily_counts(local_day(first), local_day(last), [calendar_id], [program_id])
+
+
+def occurrence_cell(occurrence_id):
+    # Integer -> Tuple
+    # Produce the (start time, published, calendar id, program id) of a
+    # stored occurrence, or None.
+
+    return AtriaOccurrence.objects.filter(pk=occurrence_id).values_list(
+        'start_time', 'published',
+        'event__atriaevent__calendar_id', 'event__atriaevent__event_program_id',
+    ).first()
+
+
+def refresh_cells(*cells):
+    for cell in cells:
+        if cell and cell[1]:
+            day = local_day(cell[0])
+            refresh_daily_counts(day, day, [cell[2]], [cell[3]])
+
+
+def capture_previous_cell(sender, instance, raw=False, **kwargs):
+    # Remembers the cell an occurrence counted in before a save or delete.
+    if not raw and instance.pk:
+        instance._previous_daily_cell = occurrence_cell(instance.pk)
+
+
+def refresh_occurrence(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+
+    cell = None
+    if instance.published:
+        cell = (instance.start_time, True) + tuple(
+            AtriaEvent.objects.filter(pk=instance.event_id)
+            .values_list('calendar_id', 'event_program_id').first() or (None, None))
+
+    previous = getattr(instance, '_previous_daily_cell', None)
+    if previous != cell:
+        refresh_cells(previous, cell)
+
+
+def refresh_deleted_occurrence(sender, instance, **kwargs):
+    refresh_cells(getattr(instance, '_previous_daily_cell', None))
+
+
+def event_count_state(event_id):
+    # Integer -> Dictionary
+    # Produce the values of the EVENT_COUNT_FIELDS of a stored event, or None.
+
+    return AtriaEvent.objects.filter(pk=event_id).values(*EVENT_COUNT_FIELDS).first()
+
+
+def capture_previous_event_state(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk:
+        instance._previous_count_state = event_count_state(instance.pk)
+
+
+def refresh_event(sender, instance, raw=False, **kwargs):
+    # Refreshes the days of an event's occurrences and repetitions, in its
+    # previous and current calendar and program, if the event changed in a
+    # way that moves them between cells.
+    if raw:
+        return
+
+    previous = getattr(instance, '_previous_count_state', None)
+    current = {field: getattr(instance, field) for field in EVENT_COUNT_FIELDS}
+    if previous == current or (previous is None and not instance.recurrence_rule):
+        return
+
+    states = [state for state in (previous, current) if state]
+    bounds = AtriaOccurrence.objects.filter(event_id=instance.pk, published=True)\
+        .aggregate(first=models.Min('start_time'), last=models.Max('start_time'))
+    firsts = [bounds['first']] + [s['recurrence_start'] for s in states]
+    lasts = [bounds['last']] + [s['recurrence_end'] for s in states]
+    firsts = [dt for dt in firsts if dt]
+    lasts = [dt for dt in lasts if dt]
+
+    if firsts and lasts:
+        refresh_daily_counts(
+            local_day(min(firsts)), local_day(max(lasts)),
+            [s['calendar_id'] for s in states], [s['event_program_id'] for s in states])
+
+
+def refresh_deleted_event(sender, instance, **kwargs):
+    # Its stored occurrences are refreshed as they are deleted; this drops
+    # the repetitions of its rule.
+    if instance.recurrence_rule and instance.recurrence_published:
+        refresh_daily_counts(
+            local_day(instance.recurrence_start), local_day(instance.recurrence_end),
+            [instance.calendar_id], [instance.event_program_id])
+
+
+pre_save.connect(capture_previous_cell, sender=AtriaOccurrence)
+post_save.connect(refresh_occurrence, sender=AtriaOccurrence)
+pre_delete.connect(capture_previous_cell, sender=AtriaOccurrence)
+post_delete.connect(refresh_deleted_occurrence, sender=AtriaOccurrence)
+
+pre_save.connect(capture_previous_event_state, sender=AtriaEvent)
+post_save.connect(refresh_event, sender=AtriaEvent)
+post_delete.connect(refresh_deleted_event, sender=AtriaEvent)
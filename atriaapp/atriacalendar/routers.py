@@ -0,0 +1,120 @@
+"""
+Routing of read-only public traffic to read replicas.
+
+``ReplicaRoutingMiddleware`` lets GET and HEAD requests to REPLICA_READ_PATHS
+(the calendar API, search, the directories and the event pages) read from
+one of the DATABASE_REPLICAS aliases, picked at random among the healthy
+ones, through ``ReplicaRouter``.  Everything else, and every write, goes to
+``default``.
+
+A request that writes (or isn't a GET or HEAD) pins its client to the
+primary for REPLICA_PIN_SECONDS with a cookie, so users see their own
+changes while the replicas catch up.  Within a request, reads after the
+first write go to the primary too, and so do the session and user lookups,
+which the middleware makes before choosing a replica.  Lookup threads
+working for a request are routed like it (``request_routing``).
+
+Each replica is checked with a ``SELECT 1`` at most every
+REPLICA_HEALTH_CHECK_SECONDS per process; when none is healthy, reads fall
+back to ``default``.
+"""
+
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.utils import ConnectionDoesNotExist
+
+
+logger = logging.getLogger('atriacalendar.routers')
+
+PIN_COOKIE = 'atria_primary'
+
+# the replica alias the current thread's request reads from, and whether it
+# has written
+routing_state = threading.local()
+
+# replica alias -> (healthy, time.monotonic() of the check)
+replica_health = {}
+
+
+def replica_aliases():
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def replica_healthy(alias):
+    # String -> Boolean
+    # Produce whether the replica answers queries, checking at most every
+    # REPLICA_HEALTH_CHECK_SECONDS.
+
+    now = time.monotonic()
+    checked = replica_health.get(alias)
+    if checked is not None and \
+            now - checked[1] < getattr(settings, 'REPLICA_HEALTH_CHECK_SECONDS', 30):
+        return checked[0]
+
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        healthy = True
+    except (ConnectionDoesNotExist, DatabaseError) as e:
+        logger.warning('Read replica %s is unavailable, reading from default: %s', alias, e)
+        healthy = False
+
+    replica_health[alias] = (healthy, now)
+    return healthy
+
+
+def choose_replica():
+    # -> String
+    # Produce a healthy replica alias, or None.
+
+    healthy = [alias for alias in replica_aliases() if replica_healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+def current_routing():
+    # -> Tuple
+    # Produce the current thread's (replica alias, wrote), to carry into the
+    # threads doing work for its request.
+
+    return (getattr(routing_state, 'alias', None), getattr(routing_state, 'wrote', False))
+
+
+@contextmanager
+def request_routing(alias, wrote):
+    # Routes the current thread as (alias, wrote) for the duration, e.g. a
+    # worker thread as the request it works for (see current_routing).
+    (routing_state.alias, routing_state.wrote) = (alias, wrote)
+    try:
+        yield
+    finally:
+        (routing_state.alias, routing_state.wrote) = (None, False)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica chosen for the current request, if any, and
+    everything else to ``default``.
+    """
+    def db_for_read(self, model, **hints):
+        if getattr(routing_state, 'wrote', False):
+            return None
+        return getattr(routing_state, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        routing_state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in replica_aliases():
+            return False
+        return None
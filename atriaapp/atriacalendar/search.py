@@ -0,0 +1,236 @@
+"""
+Multilingual full-text search over events and their volunteer opportunities.
+
+Each event has an ``AtriaEventSearchDocument`` holding the text of all its
+translated fields, kept up to date by the signal handlers below.  The
+document is indexed with an FTS5 virtual table on SQLite and with a GIN
+``tsvector`` index on PostgreSQL (see migration 0020); other databases
+fall back to an unranked substring match.
+"""
+
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from modeltranslation.utils import get_translation_fields
+
+from .models import (
+    AtriaEvent, AtriaEventProgram, AtriaEventSearchDocument, AtriaVolunteerOpportunity)
+
+
+SEARCH_TABLE = 'atriacalendar_atriaeventsearchdocument'
+SQLITE_FTS_TABLE = 'atriacalendar_atriaeventsearch_fts'
+POSTGRESQL_SEARCH_CONFIG = 'simple'
+
+EVENT_SEARCH_FIELDS = ('title', 'description', 'program')
+
+
+def build_search_document(event):
+    # AtriaEvent -> String
+    # Produce the searchable text of an event in every language.
+
+    text = []
+    for field in EVENT_SEARCH_FIELDS:
+        text += [getattr(event, name, None) for name in get_translation_fields(field)]
+    text += [getattr(event.event_program, name, None)
+             for name in get_translation_fields('label')]
+    text.append(event.location)
+
+    for opportunity in event.atriavolunteeropportunity_set.all():
+        text += [opportunity.title, opportunity.description]
+
+    return '\n'.join(t for t in text if t)
+
+
+def index_event(event_id):
+    event = AtriaEvent.objects.filter(pk=event_id).select_related('event_program')\
+        .prefetch_related('atriavolunteeropportunity_set').first()
+
+    if event:
+        AtriaEventSearchDocument.objects.update_or_create(
+            event=event, defaults={'document': build_search_document(event)})
+
+
+def search_terms(query):
+    # String -> List
+    # Produce the words of a search query, without any search syntax.
+
+    return re.findall(r'\w+', query or '')
+
+
+def search_event_ids(query, events=None, limit=None):
+    # String, QuerySet, Integer -> List
+    # Produce (event id, rank) pairs for events matching all the words in
+    # query, best match first, among events (a queryset of event ids) if
+    # given.
+
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    match = match_sql(terms, events, limit)
+    if match is None:
+        limit = limit or getattr(settings, 'SEARCH_MAX_EVENTS', 500)
+        return [(event_id, 0) for event_id in
+                matching_documents(terms, events).values_list('event_id', flat=True)[:limit]]
+
+    with connection.cursor() as cursor:
+        cursor.execute(*match)
+        return cursor.fetchall()
+
+
+def match_sql(terms, events=None, limit=None):
+    # List, QuerySet, Integer -> Tuple
+    # Produce the SQL and parameters selecting (event_id, rank) for the
+    # events matching all terms, best match first, among events if given; or
+    # None where there is no full-text index.  Restricting to events first
+    # means the limit only cuts matches the caller can use.
+
+    limit = limit or getattr(settings, 'SEARCH_MAX_EVENTS', 500)
+    (among, among_params) = ('', ())
+    if events is not None:
+        (events_sql, among_params) = events.query.sql_with_params()
+        among = ' AND {column} IN (%s)' % events_sql
+
+    if connection.vendor == 'sqlite' and sqlite_fts_available():
+        # prefix match each quoted term; bm25() is lower for better matches
+        sql = (
+            'SELECT rowid AS event_id, -bm25({fts}) AS rank FROM {fts} '
+            'WHERE {fts} MATCH %s' + among + ' ORDER BY bm25({fts}) LIMIT %s'
+        ).format(fts=SQLITE_FTS_TABLE, column='rowid')
+        return (sql, (sqlite_match(terms),) + tuple(among_params) + (limit,))
+    elif connection.vendor == 'postgresql':
+        sql = (
+            'SELECT event_id, ts_rank(to_tsvector(%s, document), query) AS rank '
+            'FROM {table}, to_tsquery(%s, %s) query '
+            'WHERE to_tsvector(%s, document) @@ query' + among +
+            ' ORDER BY rank DESC LIMIT %s'
+        ).format(table=SEARCH_TABLE, column='event_id')
+        config = POSTGRESQL_SEARCH_CONFIG
+        return (sql, (config, config, postgresql_query(terms), config) +
+                tuple(among_params) + (limit,))
+
+    return None
+
+
+def rank_sql(terms, event_column):
+    # List, String -> Tuple
+    # Produce the SQL and parameters of the rank of the event in the
+    # (quoted) event_column against terms, for match_sql's databases.
+
+    if connection.vendor == 'sqlite':
+        sql = '(SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {column})'
+        params = (sqlite_match(terms),)
+    else:
+        sql = (
+            '(SELECT ts_rank(to_tsvector(%s, document), to_tsquery(%s, %s)) '
+            'FROM {table} WHERE event_id = {column})')
+        config = POSTGRESQL_SEARCH_CONFIG
+        params = (config, config, postgresql_query(terms))
+
+    return (sql.format(fts=SQLITE_FTS_TABLE, table=SEARCH_TABLE, column=event_column), params)
+
+
+def sqlite_match(terms):
+    # prefix match each quoted term
+    return ' '.join('"%s"*' % term for term in terms)
+
+
+def postgresql_query(terms):
+    return ' & '.join(t + ':*' for t in terms)
+
+
+def matching_documents(terms, events=None):
+    # List, QuerySet -> QuerySet
+    # Produce the documents containing all terms, among events if given, for
+    # databases without a full-text index.
+
+    documents = AtriaEventSearchDocument.objects.all()
+    for term in terms:
+        documents = documents.filter(document__icontains=term)
+    if events is not None:
+        documents = documents.filter(event_id__in=events)
+
+    return documents
+
+
+def sqlite_fts_available():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            (SQLITE_FTS_TABLE,))
+        return cursor.fetchone() is not None
+
+
+def search_occurrences(occurrences, query=None, start=None, end=None, program=None):
+    # QuerySet, String, Date, Date, Integer -> QuerySet
+    # Produce the occurrences matching query, within the given dates and
+    # program, annotated with search_rank and ordered best match first (or
+    # by start_time only, if there is no query).  Dates are compared as
+    # local day boundaries, like bulk.filter_occurrences, so the start_time
+    # index stays usable.
+
+    if start:
+        occurrences = occurrences.filter(
+            start_time__gte=timezone.make_aware(datetime.combine(start, datetime.min.time())))
+    if end:
+        occurrences = occurrences.filter(
+            start_time__lt=timezone.make_aware(
+                datetime.combine(end + timezone.timedelta(days=1), datetime.min.time())))
+    if program:
+        occurrences = occurrences.filter(event__atriaevent__event_program__id=program)
+
+    terms = search_terms(query)
+    if not terms:
+        return occurrences.order_by('start_time', 'id')
+
+    # the candidate events are matched, ranked and limited among the
+    # filtered occurrences, in the same query
+    events = occurrences.order_by().values('event_id')
+    match = match_sql(terms, events)
+
+    if match is None:
+        return occurrences.filter(
+            event_id__in=matching_documents(terms, events).values('event_id'),
+        ).annotate(
+            search_rank=models.Value(0, output_field=models.FloatField()),
+        ).order_by('start_time', 'id')
+
+    event_field = occurrences.model._meta.get_field('event')
+    event_column = '%s.%s' % (
+        connection.ops.quote_name(event_field.model._meta.db_table),
+        connection.ops.quote_name(event_field.column))
+    occurrences = occurrences.annotate(
+        search_match=RawSQL(
+            '%s IN (SELECT event_id FROM (%s) matches)' % (event_column, match[0]), match[1],
+            output_field=models.BooleanField()),
+        search_rank=RawSQL(*rank_sql(terms, event_column), output_field=models.FloatField()),
+    ).filter(search_match=True)
+
+    return occurrences.order_by('-search_rank', 'start_time', 'id')
+
+
+def index_saved_event(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_event(instance.pk)
+
+
+def index_opportunity_event(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_event(instance.event_id)
+
+
+def index_program_events(sender, instance, raw=False, **kwargs):
+    if not raw:
+        for event_id in instance.atriaevent_set.values_list('pk', flat=True):
+            index_event(event_id)
+
+
+post_save.connect(index_saved_event, sender=AtriaEvent)
+post_save.connect(index_opportunity_event, sender=AtriaVolunteerOpportunity)
+post_delete.connect(index_opportunity_event, sender=AtriaVolunteerOpportunity)
+post_save.connect(index_program_events, sender=AtriaEventProgram)
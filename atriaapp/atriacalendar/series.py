@@ -0,0 +1,158 @@
+"""
+Bulk creation of recurring event series.
+
+Every ``AtriaOccurrence`` is two rows (the swingtime ``Occurrence`` parent
+and the ``AtriaOccurrence`` child), and ``bulk_create`` refuses
+multi-table inherited models, so saving a series one occurrence at a time
+costs two INSERTs per occurrence.  ``create_series`` instead writes all the
+parent rows, then all the child rows, in batches inside one transaction
+(see ``bulk_create_inherited``).
+
+Signal handlers do not run for these rows, so the work they would do
+(interval index buckets, calendar cache versions, change watermarks) is
+done here once for the whole series.
+"""
+
+from dateutil import rrule
+
+from django.db import connection, transaction
+
+from .cache import bump_calendar_versions
+from .models import (
+    AtriaEventAttendance, AtriaOccurrence, AtriaOccurrenceBucket,
+    EventAttendanceType, occurrence_buckets)
+from .watermarks import event_scopes, touch_watermarks
+
+
+def expand_series(start_time, end_time, **rrule_params):
+    # Datetime, Datetime, ... -> List
+    # Produce the (start, end) times of a series.  Like swingtime's
+    # Event.add_occurrences, a rule without count or until produces only
+    # the first occurrence.
+
+    if not (rrule_params.get('count') or rrule_params.get('until')):
+        return [(start_time, end_time)]
+
+    rrule_params.setdefault('freq', rrule.DAILY)
+    duration = end_time - start_time
+
+    return [(start, start + duration)
+            for start in rrule.rrule(dtstart=start_time, **rrule_params)]
+
+
+def create_series(event, start_time, end_time, contact=None, **rrule_params):
+    # Event, Datetime, Datetime, User, ... -> List
+    # Create the occurrences of a series in bulk, with a "Contact"
+    # attendance for contact on each of them if given.
+
+    times = expand_series(start_time, end_time, **rrule_params)
+
+    with transaction.atomic():
+        occurrences = create_occurrences([
+            AtriaOccurrence(start_time=start, end_time=end, event_id=event.pk)
+            for (start, end) in times
+        ], contact=contact)
+
+    (calendar_ids, program_ids) = event_scopes(event.pk)
+    bump_calendar_versions(calendar_ids)
+    touch_watermarks(calendar_ids, program_ids)
+
+    return occurrences
+
+
+def create_occurrences(occurrences, contact=None):
+    # List, User -> List
+    # Save new AtriaOccurrences in bulk with their interval index buckets,
+    # and a "Contact" attendance for contact on each of them if given.  Must
+    # be called inside a transaction; the caller invalidates the calendars.
+
+    occurrences = bulk_create_inherited(AtriaOccurrence, occurrences)
+
+    AtriaOccurrenceBucket.objects.bulk_create([
+        bucket for occurrence in occurrences
+        for bucket in occurrence_buckets(occurrence)
+    ])
+
+    if contact is not None:
+        attendance_type = EventAttendanceType.objects.filter(attendance_type='Contact').get()
+        AtriaEventAttendance.objects.bulk_create([
+            AtriaEventAttendance(
+                occurrence=occurrence,
+                user=contact,
+                attendance_type=attendance_type,
+                user_count=1)
+            for occurrence in occurrences
+        ])
+
+    return occurrences
+
+
+def bulk_create_inherited(model, instances):
+    # Model, List -> List
+    # Produce instances of a model that inherits from one concrete parent,
+    # saved in bulk: the parent rows (see insert_parents), then the child rows
+    # with the parent-less multi-row INSERTs Model.save_base(raw=True) does
+    # for a single row.  bulk_create refuses multi-table inherited models, so
+    # the child rows go through QuerySet._insert, which bulk_create itself
+    # uses.  Must be called inside a transaction.
+
+    parent_model = model._meta.get_parent_list()[0]
+    parent_fields = [
+        field for field in parent_model._meta.local_concrete_fields
+        if not field.primary_key]
+
+    parents = insert_parents(parent_model, [
+        parent_model(**{
+            field.attname: getattr(instance, field.attname)
+            for field in parent_fields})
+        for instance in instances
+    ])
+
+    for (instance, parent) in zip(instances, parents):
+        setattr(instance, parent_model._meta.pk.attname, parent.pk)
+        instance.pk = parent.pk
+
+    fields = model._meta.local_concrete_fields
+    batch_size = max(connection.ops.bulk_batch_size(fields, instances), 1)
+
+    # raw inserts skip pre_save, which fills in auto_now fields
+    for instance in instances:
+        for field in fields:
+            setattr(instance, field.attname, field.pre_save(instance, True))
+
+    for i in range(0, len(instances), batch_size):
+        model.objects._insert(instances[i:i + batch_size], fields=fields, raw=True)
+
+    for instance in instances:
+        instance._state.adding = False
+        instance._state.db = connection.alias
+
+    return instances
+
+
+def insert_parents(parent_model, parents):
+    # Model, List -> List
+    # Produce the new parent rows saved, with their ids.
+    #  - Backends that return ids from bulk inserts (PostgreSQL) save them
+    #    with bulk_create.
+    #  - SQLite saves them with bulk_create and reads the ids back: from its
+    #    first write until it commits, the transaction holds the database
+    #    write lock, and ids only grow, so the newest ids are these rows'.
+    #  - Other backends save them one row at a time.
+
+    features = connection.features
+    if getattr(features, 'can_return_rows_from_bulk_insert',
+               getattr(features, 'can_return_ids_from_bulk_insert', False)):
+        return parent_model.objects.bulk_create(parents)
+
+    if connection.vendor == 'sqlite':
+        parent_model.objects.bulk_create(parents)
+        ids = list(parent_model.objects.order_by('-pk')
+                   .values_list('pk', flat=True)[:len(parents)])
+        for (parent, pk) in zip(parents, reversed(ids)):
+            parent.pk = pk
+        return parents
+
+    for parent in parents:
+        parent.save_base(raw=True, force_insert=True)
+    return parents
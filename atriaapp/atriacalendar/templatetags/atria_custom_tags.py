@@ -19,3 +19,17 @@ def do_assign(parser, token):
         raise template.TemplateSyntaxError("'%s' tag takes two arguments" % bits[0])
     value = parser.compile_filter(bits[2])
     return AssignNode(bits[1], value)
+
+@register.filter
+def newsfeed_card_version(occurrence):
+    # AtriaOccurrence -> String
+    # Produce a stamp of the update times of the occurrence, its event and
+    # the event's volunteer opportunities, which changes whenever the event
+    # news-feed card would render differently.  Uses the prefetched
+    # opportunities, if any.
+    event = occurrence.atriaevent
+    opportunities = event.atriavolunteeropportunity_set.all()
+
+    return '%s:%s:%s' % (
+        occurrence.updated.timestamp(), event.updated.timestamp(),
+        ','.join('%s@%s' % (o.pk, o.updated.timestamp()) for o in opportunities))
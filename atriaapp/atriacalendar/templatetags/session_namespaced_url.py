@@ -1,6 +1,13 @@
+from functools import lru_cache
+
 from django import template
+from django.conf import settings
+from django.core.signals import setting_changed
 from django.template.base import TemplateSyntaxError, kwarg_re
 from django.template.defaulttags import URLNode
+from django.urls import NoReverseMatch, get_script_prefix, get_urlconf, reverse
+from django.utils import translation
+from django.utils.html import conditional_escape
 
 register = template.Library()
 
@@ -8,22 +15,83 @@ register = template.Library()
 def has_namespace_already(view_var):
     return (0 < view_var.find(':'))
 
+
+def namespaced_view_name(view_name, url_namespace):
+    # String, String -> String
+    # Produce the view name with the session's URL namespace prepended, unless
+    # it already has a namespace.
+
+    if url_namespace and not has_namespace_already(view_name):
+        return url_namespace + view_name
+    return view_name
+
+
+@lru_cache(maxsize=getattr(settings, 'SNURL_CACHE_SIZE', 4096))
+def cached_reverse(view_name, args, kwargs, current_app, language, urlconf, script_prefix):
+    # String, Tuple, Tuple, String, String, String, String -> String
+    # Produce reverse(view_name, ...), remembering the URLs of the most
+    # recently used (view, arguments, language) combinations.  The language,
+    # URLconf and script prefix only key the cache: reverse() reads them from
+    # the current thread.
+
+    return reverse(view_name, args=args, kwargs=dict(kwargs), current_app=current_app)
+
+
+def snurl_reverse(view_name, args, kwargs, current_app):
+    try:
+        return cached_reverse(
+            view_name, tuple(args), tuple(sorted(kwargs.items())), current_app,
+            translation.get_language(), get_urlconf(), get_script_prefix())
+    except TypeError:
+        # unhashable arguments
+        return reverse(view_name, args=args, kwargs=kwargs, current_app=current_app)
+
+
+def clear_snurl_cache(**kwargs):
+    # override_settings may swap the URLconf, languages or i18n settings
+    cached_reverse.cache_clear()
+
+
+setting_changed.connect(clear_snurl_cache)
+
+
 class SNURLNode(URLNode):
+    """
+    {% url %} with the session's URL namespace prepended to the view name.
+
+    The namespaced name is worked out per render, leaving the compiled node
+    (shared by every thread rendering the template) untouched, and the URLs
+    are memoized by cached_reverse.
+    """
     def render(self, context):
+        view_name = self.view_name.resolve(context)
         request = context.get('request')
-
         if request:
-            url_namespace = request.session.get('URL_NAMESPACE')
+            view_name = namespaced_view_name(view_name, request.session.get('URL_NAMESPACE'))
 
-            if url_namespace:
-                # TODO not sure if this is a hack, tag is getting called recursively
-                # django.urls.exceptions.NoReverseMatch: 'organization' is not a registered namespace inside 'organization'
-                # organization:swingtime-occurrence organization: organization:organization:swingtime-occurrence
-                if not has_namespace_already(self.view_name.var):
-                    self.view_name.var = url_namespace + self.view_name.var
+        args = [arg.resolve(context) for arg in self.args]
+        kwargs = {k: v.resolve(context) for k, v in self.kwargs.items()}
+        try:
+            current_app = context.request.current_app
+        except AttributeError:
+            try:
+                current_app = context.request.resolver_match.namespace
+            except AttributeError:
+                current_app = None
 
+        url = ''
+        try:
+            url = snurl_reverse(view_name, args, kwargs, current_app)
+        except NoReverseMatch:
+            if self.asvar is None:
+                raise
 
-        return super().render(context)
+        if self.asvar:
+            context[self.asvar] = url
+            return ''
+        if context.autoescape:
+            url = conditional_escape(url)
+        return url
 
 
 # Mostly copied from django.template.defaulttags.url
@@ -1,3 +1,16 @@
-from .model_tests import UserTests, TranslationTests, EventTests
-from .middleware_tests import URLPermissionsMiddlewareTests
-from .template_tag_tests import SNURLTests
+from .model_tests import (
+    UserTests, TranslationTests, EventTests, AtriaOccurrenceTests,
+    AtriaOccurrenceCounterTests)
+from .middleware_tests import (
+    URLPermissionsMiddlewareTests, RequestMetricsMiddlewareTests, ReplicaRoutingMiddlewareTests,
+    ReplicaDatabaseTests)
+from .template_tag_tests import SNURLTests, NewsfeedCardTests
+from .search_tests import SearchTests
+from .series_tests import SeriesTests
+from .load_data_tests import GenerateLoadDataTests
+from .create_manage_tests import CreateManageTests
+from .bulk_tests import BulkOperationTests
+from .directory_tests import NeighbourSearchTests, OrganizationSearchTests
+from .profile_tests import ProfileTests
+from .recurrence_tests import RecurrenceTests
+from .rollup_tests import RollupTests
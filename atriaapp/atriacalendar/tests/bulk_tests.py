@@ -0,0 +1,259 @@
+import json
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from swingtime.models import EventType
+
+from ..bulk import run_bulk_operation
+from ..models import (
+    AtriaBulkOperation, AtriaCalendar, AtriaEvent, AtriaEventAttendance,
+    AtriaEventProgram, AtriaOccurrence, AtriaOrganization, EventAttendanceType)
+
+User = get_user_model()
+
+
+@override_settings(BULK_OPERATION_CHUNK_SIZE=2, BULK_OPERATION_THREADS=False)
+class BulkOperationTests(TestCase):
+    """
+    Tests for chunked bulk publish, unpublish and copy of occurrences.
+    """
+
+    def setUp(self):
+        translation.activate('en')
+
+        self.admin = User.objects.create(email='admin@example.com')
+        EventAttendanceType.objects.create(attendance_type='Contact')
+        self.org = AtriaOrganization.objects.create(org_name='Test Org')
+        event_type = EventType.objects.create()
+        program = AtriaEventProgram.objects.create(abbr='Out', label='Outdoors')
+        self.event = AtriaEvent.objects.create(
+            event_type=event_type, event_program=program,
+            calendar=AtriaCalendar.objects.create(org_owner=self.org))
+
+        now = timezone.now().replace(microsecond=0)
+        self.occurrences = [
+            AtriaOccurrence.objects.create(
+                event=self.event,
+                start_time=now + timezone.timedelta(days=days),
+                end_time=now + timezone.timedelta(days=days, hours=1))
+            for days in range(-1, 4)
+        ]
+
+        other_event = AtriaEvent.objects.create(
+            event_type=event_type, event_program=program,
+            calendar=AtriaCalendar.objects.create(
+                org_owner=AtriaOrganization.objects.create(org_name='Other')))
+        self.other = AtriaOccurrence.objects.create(
+            event=other_event, start_time=now, end_time=now)
+
+        self.client.force_login(self.admin)
+        session = self.client.session
+        session['ACTIVE_ORG'] = str(self.org.pk)
+        session.save()
+
+    def create_operation(self, action, copy_days=0, **criteria):
+        return AtriaBulkOperation.objects.create(
+            org=self.org, user=self.admin, action=action, copy_days=copy_days,
+            criteria=json.dumps(criteria))
+
+    def test_publish_by_filter(self):
+        operation = run_bulk_operation(self.create_operation('publish', status='upcoming').pk)
+
+        self.assertEqual(operation.status, 'done')
+        self.assertEqual((operation.total, operation.processed), (4, 4))
+        self.assertEqual(operation.last_id, self.occurrences[-1].pk)
+        self.assertEqual(
+            list(AtriaOccurrence.objects.filter(published=True).order_by('pk')),
+            self.occurrences[1:])
+        self.assertEqual(
+            AtriaOccurrence.objects.get(pk=self.occurrences[1].pk).publisher, self.admin)
+
+        # already done
+        self.assertEqual(run_bulk_operation(operation.pk).finished, operation.finished)
+
+    def test_unpublish_ids_of_org_only(self):
+        AtriaOccurrence.objects.update(published=True)
+        ids = [self.occurrences[0].pk, self.occurrences[2].pk, self.other.pk]
+
+        operation = run_bulk_operation(self.create_operation('unpublish', ids=sorted(ids)).pk)
+
+        self.assertEqual((operation.total, operation.processed), (3, 3))
+        self.assertEqual(
+            set(AtriaOccurrence.objects.filter(published=False).values_list('pk', flat=True)),
+            set(ids[:2]))
+
+    def test_copy_id_ranges(self):
+        first = self.occurrences[1]
+        operation = run_bulk_operation(self.create_operation(
+            'copy', copy_days=7,
+            id_ranges=[(first.pk, self.occurrences[3].pk)]).pk)
+
+        self.assertEqual((operation.status, operation.processed), ('done', 3))
+        copies = AtriaOccurrence.objects.filter(pk__gt=self.other.pk).order_by('pk')
+        self.assertEqual(
+            [(c.start_time, c.end_time) for c in copies],
+            [(o.start_time + timezone.timedelta(days=7),
+              o.end_time + timezone.timedelta(days=7))
+             for o in self.occurrences[1:4]])
+        self.assertFalse(any(c.published for c in copies))
+        self.assertEqual(AtriaEventAttendance.objects.filter(
+            occurrence__in=copies, user=self.admin,
+            attendance_type__attendance_type='Contact').count(), 3)
+
+    def test_copy_ignores_own_copies(self):
+        operation = run_bulk_operation(
+            self.create_operation('copy', copy_days=1, status='upcoming').pk)
+
+        self.assertEqual((operation.total, operation.processed), (4, 4))
+        self.assertEqual(AtriaOccurrence.objects.get_for_org_id(self.org.pk).count(), 9)
+
+    def test_resume_failed(self):
+        operation = self.create_operation('publish', status='draft')
+        AtriaBulkOperation.objects.filter(pk=operation.pk).update(
+            status='failed', total=5, processed=2, last_id=self.occurrences[1].pk,
+            max_id=self.occurrences[-1].pk)
+
+        call_command('run_bulk_operations', stdout=StringIO())
+        self.assertEqual(AtriaBulkOperation.objects.get(pk=operation.pk).status, 'failed')
+
+        call_command('run_bulk_operations', resume_failed=True, stdout=StringIO())
+        operation.refresh_from_db()
+
+        self.assertEqual((operation.status, operation.processed), ('done', 5))
+        self.assertEqual(
+            list(AtriaOccurrence.objects.filter(published=True).order_by('pk')),
+            self.occurrences[2:])
+
+    @override_settings(BULK_OPERATION_LEASE_SECONDS=60)
+    def test_resume_abandoned(self):
+        now = timezone.now()
+        abandoned = self.create_operation('publish', ids=[self.occurrences[0].pk])
+        live = self.create_operation('publish', ids=[self.occurrences[1].pk])
+        AtriaBulkOperation.objects.filter(pk=abandoned.pk).update(
+            status='running', started=now - timezone.timedelta(minutes=5),
+            heartbeat=now - timezone.timedelta(minutes=2))
+        AtriaBulkOperation.objects.filter(pk=live.pk).update(
+            status='running', started=now - timezone.timedelta(minutes=5), heartbeat=now)
+
+        call_command('run_bulk_operations', stdout=StringIO())
+        abandoned.refresh_from_db()
+        live.refresh_from_db()
+
+        self.assertEqual((abandoned.status, abandoned.processed), ('done', 1))
+        self.assertEqual(live.status, 'running')
+        self.assertEqual(
+            list(AtriaOccurrence.objects.filter(published=True)), self.occurrences[:1])
+
+    def test_lease_lost(self):
+        from .. import bulk
+
+        operation = self.create_operation('publish', status='upcoming')
+        stolen = timezone.now() + timezone.timedelta(minutes=1)
+        operation_chunks = bulk.operation_chunks
+
+        def stolen_after_first_chunk(*args):
+            chunks = operation_chunks(*args)
+            yield next(chunks)
+            # another runner claims the operation
+            AtriaBulkOperation.objects.filter(pk=operation.pk).update(heartbeat=stolen)
+            yield from chunks
+
+        with mock.patch.object(bulk, 'operation_chunks', stolen_after_first_chunk):
+            operation = run_bulk_operation(operation.pk)
+
+        # the second chunk is rolled back, and the operation left to its new
+        # runner
+        self.assertEqual((operation.status, operation.processed), ('running', 2))
+        self.assertEqual(operation.heartbeat, stolen)
+        self.assertEqual(AtriaOccurrence.objects.filter(published=True).count(), 2)
+
+    def test_api(self):
+        url = reverse('organization:bulk_operations')
+
+        response = self.client.post(url, {'action': 'publish'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url, {
+            'action': 'publish', 'status': 'upcoming', 'background': 'on'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'pending')
+        status_url = response.json()['url']
+
+        call_command('run_bulk_operations', stdout=StringIO())
+
+        response = self.client.get(status_url)
+        self.assertEqual(response.json()['status'], 'done')
+        self.assertEqual(response.json()['processed'], 4)
+
+        response = self.client.post(url, {
+            'action': 'unpublish', 'ids': '%s,%s' % (
+                self.occurrences[1].pk, self.occurrences[2].pk)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'done')
+        self.assertEqual(AtriaOccurrence.objects.filter(published=True).count(), 2)
+
+        self.client.force_login(User.objects.create(email='other@example.com'))
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+    def test_create_manage_publish(self):
+        url = reverse('organization:create_manage')
+        response = self.client.post(url, {
+            'publish': 'Publish',
+            'occ_checked_%s' % self.occurrences[0].pk: 'on',
+            'occ_checked_%s' % self.other.pk: 'on',
+            'occ_checked_x': 'on',
+        })
+
+        # the operation runs in the background; the list shows it pending
+        operation = AtriaBulkOperation.objects.get()
+        self.assertRedirects(
+            response, '%s?operation=%s' % (url, operation.pk), fetch_redirect_response=False)
+        self.assertEqual(json.loads(operation.criteria), {
+            'ids': sorted([self.occurrences[0].pk, self.other.pk])})
+        status_url = response.url
+        response = self.client.get(status_url)
+        self.assertEqual(response.context['bulk_operation']['id'], operation.pk)
+        self.assertContains(response, 'Publish: pending')
+
+        call_command('run_bulk_operations', stdout=StringIO())
+        self.assertEqual(
+            list(AtriaOccurrence.objects.filter(published=True)), [self.occurrences[0]])
+        self.assertContains(self.client.get(status_url), 'Publish: done (2 / 2)')
+
+    def test_create_manage_copy(self):
+        url = reverse('organization:create_manage')
+        checked = {
+            'occ_checked_%s' % self.occurrences[0].pk: 'on',
+            'occ_checked_%s' % self.occurrences[1].pk: 'on',
+        }
+
+        # several occurrences need the days to shift them by
+        response = self.client.post(url, dict(checked, copy='Copy'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['copy_error'])
+        self.assertFalse(AtriaBulkOperation.objects.exists())
+
+        response = self.client.post(url, dict(checked, copy='Copy', copy_days='7'))
+        operation = AtriaBulkOperation.objects.get()
+        self.assertRedirects(
+            response, '%s?operation=%s' % (url, operation.pk), fetch_redirect_response=False)
+        self.assertEqual((operation.action, operation.copy_days), ('copy', 7))
+
+        call_command('run_bulk_operations', stdout=StringIO())
+        self.assertEqual(
+            [c.start_time for c in AtriaOccurrence.objects.filter(
+                pk__gt=self.other.pk).order_by('pk')],
+            [o.start_time + timezone.timedelta(days=7) for o in self.occurrences[:2]])
+
+        # a single one opens the copy form
+        response = self.client.post(url, {
+            'occ_checked_%s' % self.occurrences[2].pk: 'on', 'copy': 'Copy'})
+        self.assertRedirects(
+            response, reverse('copy_occurrance', kwargs={'occ_id': self.occurrences[2].pk}),
+            fetch_redirect_response=False)
@@ -0,0 +1,128 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from swingtime.models import EventType
+
+from ..models import (
+    AtriaCalendar, AtriaEvent, AtriaEventProgram, AtriaOccurrence,
+    AtriaOrganization)
+from ..views import occurrence_cursor, parse_occurrence_cursor
+
+User = get_user_model()
+
+
+@override_settings(CREATE_MANAGE_PAGE_SIZE=3)
+class CreateManageTests(TestCase):
+    """
+    Tests for the filtered, keyset paginated Create/Manage occurrence list.
+    """
+
+    def setUp(self):
+        translation.activate('en')
+
+        self.admin = User.objects.create(email='admin@example.com')
+        self.org = AtriaOrganization.objects.create(org_name='Test Org')
+        calendar = AtriaCalendar.objects.create(org_owner=self.org)
+        event_type = EventType.objects.create()
+        self.programs = [
+            AtriaEventProgram.objects.create(abbr=label[:4], label=label)
+            for label in ('Outdoors', 'Music')
+        ]
+        events = [
+            AtriaEvent.objects.create(
+                title=program.label, event_type=event_type,
+                event_program=program, calendar=calendar)
+            for program in self.programs
+        ]
+
+        # the same start time twice, to exercise the id tie-break
+        now = timezone.now().replace(microsecond=0)
+        self.occurrences = []
+        for days in (-3, -2, -1, 1, 1, 2, 3):
+            start_time = now + timezone.timedelta(days=days)
+            self.occurrences.append(AtriaOccurrence.objects.create(
+                event=events[len(self.occurrences) % 2],
+                start_time=start_time,
+                end_time=start_time + timezone.timedelta(hours=1),
+                published=days > 0,
+                publisher=self.admin if days > 0 else None))
+
+        # an occurrence of another org
+        other_event = AtriaEvent.objects.create(
+            event_type=event_type, event_program=self.programs[0],
+            calendar=AtriaCalendar.objects.create(
+                org_owner=AtriaOrganization.objects.create(org_name='Other')))
+        AtriaOccurrence.objects.create(
+            event=other_event, start_time=now, end_time=now)
+
+        self.client.force_login(self.admin)
+        session = self.client.session
+        session['ACTIVE_ORG'] = str(self.org.pk)
+        session.save()
+        self.url = reverse('organization:create_manage')
+
+    def list_pages(self, **params):
+        # Follows the next page links, producing the ids of each page
+        pages = []
+        query = params
+
+        while query is not None:
+            response = self.client.get(self.url, query)
+            self.assertEqual(response.status_code, 200)
+            pages.append([o.id for o in response.context['atriaoccurrence_list']])
+            next_query = response.context.get('next_page_query')
+            query = next_query and dict(
+                part.split('=') for part in next_query.split('&'))
+
+        return pages
+
+    def test_cursor(self):
+        occurrence = self.occurrences[0]
+
+        self.assertEqual(
+            parse_occurrence_cursor(occurrence_cursor(occurrence)),
+            (occurrence.start_time, occurrence.id))
+        self.assertIsNone(parse_occurrence_cursor('garbage'))
+        self.assertIsNone(parse_occurrence_cursor('1_2_3'))
+
+    def test_keyset_pages(self):
+        ids = [o.id for o in sorted(
+            self.occurrences, key=lambda o: (o.start_time, o.id))]
+
+        self.assertEqual(self.list_pages(), [ids[0:3], ids[3:6], ids[6:]])
+        self.assertEqual(
+            self.list_pages(order='desc'),
+            [ids[:3:-1], ids[3:0:-1], ids[:1]])
+
+    def test_filters(self):
+        ids = [o.id for o in self.occurrences]
+
+        self.assertEqual(self.list_pages(status='upcoming'), [ids[3:6], ids[6:]])
+        self.assertEqual(self.list_pages(status='past'), [ids[2::-1]])
+        self.assertEqual(self.list_pages(status='draft'), [ids[:3]])
+        self.assertEqual(
+            self.list_pages(program=self.programs[1].pk), [ids[1::2]])
+
+        start = timezone.localtime(self.occurrences[3].start_time).date()
+        self.assertEqual(
+            self.list_pages(start=start.isoformat(), end=start.isoformat()),
+            [ids[3:5]])
+
+    def test_page_queries(self):
+        # The page costs the same whatever its position, the event and
+        # publisher are joined rather than fetched per row
+        counts = []
+        after = ''
+        for _ in range(3):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url, {'after': after})
+            counts.append(len(queries))
+            after = response.context.get('next_page_query', '').split('after=')[-1]
+
+        self.assertEqual(len(set(counts)), 1)
+        self.assertEqual(
+            len([q for q in queries if 'swingtime_occurrence' in q['sql']]), 1)
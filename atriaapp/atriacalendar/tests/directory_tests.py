@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.db.models.functions import Lower
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import translation
+
+from ..directory import search_neighbours, search_organizations, term_q
+from ..models import AtriaOrganization
+
+User = get_user_model()
+
+
+@override_settings(SEARCH_PAGE_SIZE=2)
+class NeighbourSearchTests(TestCase):
+    """
+    Tests for the neighbour directory search.
+    """
+
+    def setUp(self):
+        translation.activate('en')
+
+        group = Group.objects.get_or_create(name=settings.DEFAULT_USER_ROLE)[0]
+        for (email, first_name, last_name) in (
+                ('ann@example.com', 'Ann', 'Smith'),
+                ('bob@example.com', 'Bob', 'Anderson'),
+                ('carol@example.com', 'Carol', 'Smithers'),
+                ('dave@example.com', 'Dave', 'Jones')):
+            User.objects.create(
+                email=email, first_name=first_name, last_name=last_name,
+                phone_number='555-0100').groups.add(group)
+
+        # not a neighbour
+        User.objects.create(email='annex@example.com', first_name='Ann')
+
+    def emails(self, query='', match='contains', limit=10):
+        return [neighbour.email for neighbour in
+                search_neighbours(query, match, limit=limit)[0]]
+
+    def test_match(self):
+        self.assertEqual(
+            self.emails('AN'), ['ann@example.com', 'bob@example.com'])
+        self.assertEqual(self.emails('ann', 'prefix'), ['ann@example.com'])
+        self.assertEqual(
+            self.emails('smith', 'prefix'), ['ann@example.com', 'carol@example.com'])
+        self.assertEqual(self.emails('ith'), ['ann@example.com', 'carol@example.com'])
+        self.assertEqual(self.emails('ith', 'prefix'), [])
+        self.assertEqual(self.emails('carol smith'), ['carol@example.com'])
+        self.assertEqual(len(self.emails()), 4)
+
+    def test_keyset_pages(self):
+        (first, after) = search_neighbours()
+        self.assertEqual([n.email for n in first], ['ann@example.com', 'bob@example.com'])
+
+        (second, after) = search_neighbours(after=after)
+        self.assertEqual([n.email for n in second], ['carol@example.com', 'dave@example.com'])
+        self.assertIsNone(after)
+
+        self.assertEqual(first[0].get_deferred_fields(), {
+            field.attname for field in User._meta.concrete_fields
+            if field.attname not in ('id', 'email', 'first_name', 'last_name')
+        })
+
+    def test_prefix_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite query plan')
+
+        # the lower() index serves prefix matches
+        users = User.objects.annotate(lower_email=Lower('email'))\
+            .filter(term_q(('email',), 'smi', 'prefix')).values('id')
+        (sql, params) = users.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+
+        self.assertIn('atriacalendar_user_lower_email', plan)
+
+    def test_page(self):
+        response = self.client.get(reverse('search_neighbour'), {'q': 'smith'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [n.email for n in response.context['neighbours']],
+            ['ann@example.com', 'carol@example.com'])
+        self.assertIsNone(response.context['next_page_query'])
+
+        response = self.client.get(reverse('search_neighbour'))
+        self.assertEqual(response.context['next_page_query'], 'after=bob%40example.com')
+
+
+class OrganizationSearchTests(TestCase):
+    """
+    Tests for the ranked organization directory search.
+    """
+
+    def setUp(self):
+        translation.activate('en')
+
+        for (name, tagline) in (
+                ('Food Bank', 'Garden produce for all'),
+                ('Community Garden', ''),
+                ('Garden Friends', ''),
+                ('Garden Club', '')):
+            AtriaOrganization.objects.create(
+                org_name=name, tagline=tagline, location='Victoria',
+                description='A long description. ' * 100)
+        AtriaOrganization.objects.filter(org_name_en='Food Bank').update(
+            org_name_fr='Banque Alimentaire')
+
+    def names(self, query, **options):
+        return [org.org_name for org in search_organizations(query, **options)]
+
+    def test_ranking(self):
+        self.assertEqual(self.names('garden'), [
+            'Garden Club', 'Garden Friends', 'Community Garden', 'Food Bank'])
+        self.assertEqual(self.names('GARDEN club'), ['Garden Club'])
+        self.assertEqual(self.names('garden', match='prefix'), [
+            'Garden Club', 'Garden Friends', 'Food Bank'])
+        self.assertEqual(self.names('victoria friends'), ['Garden Friends'])
+        self.assertEqual(self.names(''), [
+            'Community Garden', 'Food Bank', 'Garden Club', 'Garden Friends'])
+
+    def test_translated_names(self):
+        self.assertEqual(self.names('alimentaire'), ['Food Bank'])
+
+        with translation.override('fr'):
+            self.assertEqual(self.names('banque'), ['Banque Alimentaire'])
+
+    @override_settings(SEARCH_PAGE_SIZE=3)
+    def test_pages(self):
+        page = search_organizations('garden', page=2)
+
+        self.assertEqual(page.paginator.count, 4)
+        self.assertEqual([org.org_name for org in page], ['Food Bank'])
+
+    def test_compact(self):
+        org = search_organizations('garden club', compact=True)[0]
+        self.assertIn('description', org.get_deferred_fields())
+
+        response = self.client.get(reverse('search_organization'), {'q': 'garden', 'compact': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'A long description.')
+
+        response = self.client.get(reverse('search_organization'), {'q': 'garden'})
+        self.assertContains(response, 'A long description.')
@@ -0,0 +1,68 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Sum
+from django.test import TestCase
+
+from ..models import (
+    AtriaCalendar, AtriaDailyCount, AtriaEvent, AtriaEventAttendance,
+    AtriaEventSearchDocument, AtriaOccurrence, AtriaOrganization, AtriaRelationship, User)
+from ..search import search_occurrences
+
+
+class GenerateLoadDataTests(TestCase):
+    """
+    Tests for the generate_load_data management command.
+    """
+
+    def generate(self, **options):
+        options = dict(
+            seed=3, start='2030-01-01', orgs=3, neighbours=20, programs=4,
+            calendars_per_org=2, events_per_calendar=5, **options)
+        call_command('generate_load_data', stdout=StringIO(), **options)
+
+    def test_volumes(self):
+        self.generate()
+
+        self.assertEqual(AtriaOrganization.objects.count(), 3)
+        self.assertEqual(User.objects.count(), 23)
+        self.assertEqual(AtriaCalendar.objects.count(), 6)
+        self.assertEqual(AtriaEvent.objects.count(), 30)
+        self.assertEqual(AtriaEventSearchDocument.objects.count(), 30)
+        self.assertTrue(AtriaOccurrence.objects.filter(event__atriaevent__isnull=False).exists())
+        self.assertEqual(
+            AtriaRelationship.objects.filter(relation_type__is_org_relation=True).count(), 3)
+
+    def test_counters_match_attendance(self):
+        self.generate()
+
+        attendees = AtriaEventAttendance.objects.filter(
+            attendance_type__attendance_type='Attendee').aggregate(total=Sum('user_count'))
+        self.assertEqual(
+            AtriaOccurrence.objects.aggregate(total=Sum('attendee_count'))['total'],
+            attendees['total'])
+        self.assertFalse(AtriaEventAttendance.objects.filter(
+            attendance_type__attendance_type='Volunteer',
+            volunteer_opportunity__isnull=True).exists())
+
+    def test_daily_counts_match_published(self):
+        self.generate()
+
+        self.assertEqual(
+            AtriaDailyCount.objects.aggregate(total=Sum('count'))['total'],
+            AtriaOccurrence.objects.filter(published=True).count())
+
+    def test_events_searchable(self):
+        self.generate()
+        event = AtriaEvent.objects.order_by('pk').first()
+
+        self.assertIn(
+            event.pk, [o.event_id for o in search_occurrences(
+                AtriaOccurrence.objects.all(), event.title_en)])
+
+    def test_existing_load_data(self):
+        self.generate()
+
+        with self.assertRaises(CommandError):
+            self.generate()
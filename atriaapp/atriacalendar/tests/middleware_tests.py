@@ -1,5 +1,21 @@
+import time
+
+from unittest import skipUnless
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase, modify_settings, override_settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, TestCase, TransactionTestCase, modify_settings, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils.functional import SimpleLazyObject
+
+from ..metrics import clear_metrics
+from ..middleware import ReplicaRoutingMiddleware, URLPermissionsMiddleware
+from ..models import AtriaCalendar, AtriaEvent, AtriaOrganization
+from ..routers import PIN_COOKIE, ReplicaRouter, replica_health
 
 User = get_user_model()
 
@@ -88,3 +104,187 @@ class URLPermissionsMiddlewareTests(TestCase):
         response = self.client.get('/admin/')
 
         self.assertEqual(200, response.status_code)
+
+    def test_role_queries_per_request(self):
+        middleware = URLPermissionsMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get('/en/neighbour/')
+        request.user = User.objects.get(pk=self.volunteer.pk)
+        request.session = {'URL_NAMESPACE': 'neighbour:'}
+
+        with self.assertNumQueries(1):
+            for i in range(3):
+                self.assertTrue(middleware.request_allowed(request))
+
+    def test_settings_recompiled(self):
+        middleware = URLPermissionsMiddleware(lambda request: HttpResponse())
+
+        self.assertTrue(middleware.applicable_path('/en/neighbour/'))
+        with self.settings(URL_NAMESPACE_PATHS=()):
+            self.assertFalse(middleware.applicable_path('/en/neighbour/'))
+
+
+class RequestMetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        clear_metrics()
+        self.staff = User.objects.create(email='staff@example.com', is_staff=True)
+
+    def metric_lines(self, prefix):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+
+        return [line for line in response.content.decode('utf-8').splitlines()
+                if line.startswith(prefix)]
+
+    def test_histograms(self):
+        self.client.get('/api/atria/search/')
+        self.client.get('/api/atria/search/')
+
+        self.assertIn(
+            'atria_request_duration_seconds_count{view="atriaapi:search"} 2',
+            self.metric_lines('atria_request_duration_seconds_count'))
+        queries = self.metric_lines('atria_request_queries_bucket{view="atriaapi:search"')
+        self.assertEqual(queries[-1], 'atria_request_queries_bucket{view="atriaapi:search",le="+Inf"} 2')
+
+    def test_unresolved(self):
+        self.client.get('/api/atria/nothing-here/')
+
+        self.assertIn(
+            'atria_request_duration_seconds_count{view="<unresolved>"} 1',
+            self.metric_lines('atria_request_duration_seconds_count'))
+
+    def test_server_timing_for_staff(self):
+        response = self.client.get('/en/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+        self.client.force_login(self.staff)
+        response = self.client.get('/en/')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="login"', timing)
+        # the login page is a TemplateResponse, rendered after the view
+        render = float(timing.split('render;dur=')[1].split(',')[0])
+        self.assertGreater(render, 0)
+
+    def test_metrics_allowed_ips(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_slow_request_log(self):
+        with override_settings(REQUEST_METRICS={'SLOW_REQUEST_QUERIES': 0}):
+            with self.assertLogs('atriacalendar.metrics', 'WARNING') as logs:
+                self.client.get('/api/atria/search/?q=garden')
+
+        self.assertIn('Slow request GET /api/atria/search/?q=garden (atriaapi:search)',
+                      logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(REQUEST_METRICS={'ENABLED': False})
+    def test_disabled(self):
+        self.client.get('/api/atria/search/')
+
+        self.assertEqual(self.metric_lines('atria_request_duration_seconds_count'), [])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_READ_PATHS=(r'^/api/atria/',))
+class ReplicaRoutingMiddlewareTests(TestCase):
+    def setUp(self):
+        replica_health.clear()
+        replica_health['replica'] = (True, time.monotonic())
+        self.reads = []
+
+    def tearDown(self):
+        replica_health.clear()
+
+    def view(self, write=False):
+        def get_response(request):
+            router = ReplicaRouter()
+            self.reads.append(router.db_for_read(AtriaEvent))
+            if write:
+                router.db_for_write(AtriaEvent)
+                self.reads.append(router.db_for_read(AtriaEvent))
+            return HttpResponse()
+
+        return ReplicaRoutingMiddleware(get_response)
+
+    def test_replica_reads(self):
+        response = self.view()(RequestFactory().get('/api/atria/calendars/'))
+        self.assertEqual(self.reads, ['replica'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+        # other paths and methods read from default
+        self.view()(RequestFactory().get('/en/neighbour/'))
+        response = self.view()(RequestFactory().post('/api/atria/calendars/'))
+        self.assertEqual(self.reads, ['replica', None, None])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        # outside of requests
+        self.assertIsNone(ReplicaRouter().db_for_read(AtriaEvent))
+
+    def test_pinned_after_write(self):
+        with self.settings(REPLICA_PIN_SECONDS=10):
+            response = self.view(write=True)(RequestFactory().get('/api/atria/calendars/'))
+        self.assertEqual(self.reads, ['replica', None])
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+
+        request = RequestFactory().get('/api/atria/calendars/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.view()(request)
+        self.assertEqual(self.reads, ['replica', None, None])
+
+    def test_user_read_from_primary(self):
+        request = RequestFactory().get('/api/atria/calendars/')
+        request.user = SimpleLazyObject(
+            lambda: self.reads.append(ReplicaRouter().db_for_read(User)) or AnonymousUser())
+
+        self.view()(request)
+        self.assertEqual(self.reads, [None, 'replica'])
+
+    def test_unhealthy_fallback(self):
+        # 'replica' isn't a configured database here
+        replica_health.clear()
+        with self.assertLogs('atriacalendar.routers', 'WARNING'):
+            self.view()(RequestFactory().get('/api/atria/calendars/'))
+        self.assertEqual(self.reads, [None])
+        self.assertFalse(replica_health['replica'][0])
+
+        # checked again only after REPLICA_HEALTH_CHECK_SECONDS
+        replica_health['replica'] = (True, replica_health['replica'][1])
+        self.view()(RequestFactory().get('/api/atria/calendars/'))
+        self.assertEqual(self.reads, [None, 'replica'])
+
+
+@skipUnless('replica' in settings.DATABASES, 'run with ATRIA_SQLITE_REPLICA=1')
+class ReplicaDatabaseTests(TransactionTestCase):
+    """
+    Runs against the two SQLite databases of ATRIA_SQLITE_REPLICA (the test
+    replica mirrors the test primary), e.g.
+
+        ATRIA_SQLITE_REPLICA=1 python manage.py test \\
+            atriacalendar.tests.ReplicaDatabaseTests
+    """
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        replica_health.clear()
+        AtriaCalendar.objects.create(
+            org_owner=AtriaOrganization.objects.create(org_name='Test Org'),
+            calendar_name='Replicated')
+
+    def replica_queries(self, url, **cookies):
+        self.client.cookies.clear()
+        for (name, value) in cookies.items():
+            self.client.cookies[name] = value
+
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'Replicated')
+
+        return len(queries)
+
+    def test_replica_reads(self):
+        self.assertGreater(self.replica_queries('/api/atria/calendars/'), 0)
+        self.assertEqual(self.replica_queries('/api/atria/calendars/', **{PIN_COOKIE: '1'}), 0)
@@ -1,4 +1,7 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import RequestFactory, TestCase
 from django.urls import reverse
 from django.utils import timezone, translation
@@ -7,7 +10,9 @@ from django.views.generic.edit import UpdateView
 from swingtime.models import EventType
 
 from ..forms import AtriaEventForm
-from ..models import AtriaEvent, AtriaEventProgram, AtriaOccurrence, USER_ROLES
+from ..models import (
+    AtriaEvent, AtriaEventAttendance, AtriaEventProgram, AtriaOccurrence,
+    EventAttendanceType, USER_ROLES)
 from ..views import EventUpdateView, TranslatedFormMixin
 
 User = get_user_model()
@@ -56,6 +61,25 @@ class UserTests(TestCase):
 
         self.assertIn(group_name, self.user.roles)
 
+    def test_role_queries_cached(self):
+        # Tests that role checks query the user's groups only once
+        self.user.add_role(USER_ROLES[0])
+
+        with self.assertNumQueries(1):
+            self.assertTrue(self.user.has_role(USER_ROLES[0]))
+            self.assertFalse(self.user.has_role(USER_ROLES[1]))
+            self.assertEqual(tuple(self.user.roles), USER_ROLES[:1])
+
+    def test_role_cache_invalidated(self):
+        # Tests that changing the user's groups refreshes the role cache
+        self.assertFalse(self.user.has_role(USER_ROLES[1]))
+
+        self.user.add_role(USER_ROLES[1])
+        self.assertTrue(self.user.has_role(USER_ROLES[1]))
+
+        self.user.groups.clear()
+        self.assertFalse(self.user.has_role(USER_ROLES[1]))
+
 
 class TranslatedFormView(TranslatedFormMixin, UpdateView):
     """
@@ -286,3 +310,73 @@ class AtriaOccurrenceTests(TestCase):
         self.occurrence.save()
 
         self.assertEquals('today', self.occurrence.status)
+
+
+class AtriaOccurrenceCounterTests(TestCase):
+    """
+    Tests for the attendee and volunteer counters on AtriaOccurrence.
+    """
+
+    def setUp(self):
+        self.event = AtriaEvent.objects.create(
+            event_type=EventType.objects.create(),
+            event_program=AtriaEventProgram.objects.create(),
+        )
+        start_time = timezone.now() + timezone.timedelta(days=1)
+        self.occurrence = AtriaOccurrence.objects.create(
+            start_time=start_time,
+            end_time=start_time + timezone.timedelta(hours=1),
+            event=self.event,
+        )
+        self.attendee = EventAttendanceType.objects.create(attendance_type='Attendee')
+        self.volunteer = EventAttendanceType.objects.create(attendance_type='Volunteer')
+        self.contact = EventAttendanceType.objects.create(attendance_type='Contact')
+
+    def attend(self, attendance_type, user_count):
+        return AtriaEventAttendance.objects.create(
+            occurrence=self.occurrence,
+            attendance_type=attendance_type,
+            user_count=user_count,
+        )
+
+    def assertTotals(self, attendees, volunteers):
+        self.occurrence.refresh_from_db()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.occurrence.attendee_total, attendees)
+            self.assertEqual(self.occurrence.volunteer_total, volunteers)
+
+    def test_create(self):
+        self.attend(self.attendee, 2)
+        self.attend(self.attendee, 3)
+        self.attend(self.volunteer, 1)
+        self.attend(self.contact, 1)
+
+        self.assertTotals(5, 1)
+
+    def test_update(self):
+        attendance = self.attend(self.attendee, 2)
+
+        attendance.user_count = 4
+        attendance.save()
+        self.assertTotals(4, 0)
+
+        attendance.attendance_type = self.volunteer
+        attendance.save()
+        self.assertTotals(0, 4)
+
+    def test_delete(self):
+        self.attend(self.attendee, 2)
+        self.attend(self.volunteer, 1).delete()
+
+        self.assertTotals(2, 0)
+
+    def test_reconcile_command(self):
+        self.attend(self.attendee, 2)
+        self.attend(self.volunteer, 3)
+        AtriaOccurrence.objects.filter(pk=self.occurrence.pk).update(
+            attendee_count=7, volunteer_count=0)
+
+        call_command('reconcile_occurrence_counters', stdout=StringIO())
+
+        self.assertTotals(2, 3)
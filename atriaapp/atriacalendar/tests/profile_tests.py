@@ -0,0 +1,170 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from swingtime.models import EventType
+
+from ..bulk import occurrences_changed
+from ..cache import calendar_cache
+from ..models import (
+    AtriaCalendar, AtriaEvent, AtriaEventAttendance, AtriaEventProgram,
+    AtriaOccurrence, AtriaOrganization, AtriaRelationship, AtriaVolunteerOpportunity,
+    EventAttendanceType, RelationType)
+from ..profiles import neighbour_summary, organization_summary
+from .utils import commit_callbacks
+
+User = get_user_model()
+
+
+class ProfileTests(TestCase):
+    """
+    Tests for the neighbour and organization profile loaders and summaries.
+    """
+
+    def setUp(self):
+        translation.activate('en')
+        calendar_cache().clear()
+
+        self.member = RelationType.objects.create(relation_type='Member')
+        self.attendee = EventAttendanceType.objects.create(attendance_type='Attendee')
+        self.volunteer = EventAttendanceType.objects.create(attendance_type='Volunteer')
+
+        self.neighbour = User.objects.create(email='neighbour@example.com')
+        self.org = AtriaOrganization.objects.create(org_name='Test Org')
+        self.event = AtriaEvent.objects.create(
+            title='Garden', event_type=EventType.objects.create(),
+            event_program=AtriaEventProgram.objects.create(),
+            calendar=AtriaCalendar.objects.create(org_owner=self.org))
+        self.opportunity = AtriaVolunteerOpportunity.objects.create(
+            event=self.event, title='Weeding')
+        self.relate(self.neighbour)
+
+        now = timezone.now()
+        self.past = self.create_occurrence(now - timezone.timedelta(days=7), hours=2)
+        self.future = self.create_occurrence(now + timezone.timedelta(days=7), hours=1)
+
+        self.attend(self.past, self.volunteer, user_count=2)
+        self.attend(self.future, self.volunteer)
+        self.attend(self.future, self.attendee)
+
+    def create_occurrence(self, start_time, hours):
+        return AtriaOccurrence.objects.create(
+            event=self.event, start_time=start_time,
+            end_time=start_time + timezone.timedelta(hours=hours), published=True)
+
+    def attend(self, occurrence, attendance_type, user_count=1):
+        return AtriaEventAttendance.objects.create(
+            occurrence=occurrence, user=self.neighbour, attendance_type=attendance_type,
+            user_count=user_count,
+            volunteer_opportunity=self.opportunity if attendance_type == self.volunteer else None)
+
+    def relate(self, user):
+        return AtriaRelationship.objects.create(
+            user=user, org=self.org, relation_type=self.member, status='Active')
+
+    def test_summaries(self):
+        self.assertEqual(neighbour_summary(self.neighbour.pk), {
+            'connections': 1, 'upcoming': 2, 'volunteer_hours': 5.0})
+        self.assertEqual(organization_summary(self.org.pk), {
+            'connections': 1, 'upcoming': 1, 'volunteer_hours': 5.0})
+
+        # cached
+        with self.assertNumQueries(0):
+            neighbour_summary(self.neighbour.pk)
+            organization_summary(self.org.pk)
+
+    def test_summary_invalidation(self):
+        neighbour_summary(self.neighbour.pk)
+        organization_summary(self.org.pk)
+
+        self.relate(User.objects.create(email='other@example.com'))
+        self.attend(self.past, self.volunteer)
+        self.assertEqual(organization_summary(self.org.pk)['connections'], 2)
+        self.assertEqual(neighbour_summary(self.neighbour.pk)['volunteer_hours'], 7.0)
+
+        # bulk updates send no signals, but bump the calendar versions
+        occurrences = AtriaOccurrence.objects.filter(pk=self.future.pk)
+        occurrences.update(published=False)
+        with commit_callbacks():
+            occurrences_changed(occurrences)
+        self.assertEqual(organization_summary(self.org.pk)['upcoming'], 0)
+
+    def profile_queries(self, url, session=None):
+        self.client.logout()
+        self.client.force_login(self.neighbour)
+        if session:
+            stored = self.client.session
+            stored.update(session)
+            stored.save()
+
+        # count the summary queries too
+        calendar_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        return len(queries)
+
+    def test_constant_queries(self):
+        # Profiles cost the same number of queries however many attendances
+        # and connections they have
+        org_session = {'ACTIVE_ORG': str(self.org.pk), 'URL_NAMESPACE': 'organization:'}
+        urls = (
+            (reverse('neighbour:profile'), None),
+            (reverse('view_neighbour_id', args=(self.neighbour.email,)), None),
+            (reverse('view_organization_id', args=(self.org.pk,)), None),
+            (reverse('organization:profile'), org_session),
+        )
+        before = [self.profile_queries(url, session) for (url, session) in urls]
+
+        for i in range(5):
+            self.attend(self.future, self.volunteer)
+            self.attend(self.past, self.attendee)
+            self.relate(User.objects.create(email='member%s@example.com' % i))
+
+        after = [self.profile_queries(url, session) for (url, session) in urls]
+
+        self.assertEqual(before, after)
+
+    def test_profile_context(self):
+        self.client.force_login(self.neighbour)
+        response = self.client.get(reverse('neighbour:profile'))
+
+        self.assertEqual(
+            [a.occurrence_id for a in response.context['attendances']],
+            [self.future.pk, self.future.pk, self.past.pk])
+        self.assertContains(response, 'Weeding')
+        self.assertEqual(response.context['summary']['upcoming'], 2)
+
+        # other people's profiles don't list attendances
+        self.client.force_login(User.objects.create(email='other@example.com'))
+        response = self.client.get(reverse('view_neighbour_id', args=(self.neighbour.email,)))
+        self.assertEqual(response.context['attendances'], [])
+
+    @override_settings(PROFILE_LIST_LIMIT=2)
+    def test_profile_pages(self):
+        for i in range(3):
+            self.relate(User.objects.create(email='member%s@example.com' % i))
+        url = reverse('view_organization_id', args=(self.org.pk,))
+
+        response = self.client.get(url)
+        self.assertEqual(
+            [c.user.email for c in response.context['connections']],
+            ['member0@example.com', 'member1@example.com'])
+        self.assertContains(response, 'Connections: 4')
+        self.assertContains(response, '?connections_page=2')
+
+        response = self.client.get(url, {'connections_page': 2})
+        self.assertEqual(
+            [c.user.email for c in response.context['connections']],
+            ['member2@example.com', 'neighbour@example.com'])
+
+        self.client.force_login(self.neighbour)
+        response = self.client.get(reverse('neighbour:profile'), {'attendances_page': 2})
+        self.assertEqual(
+            [a.occurrence_id for a in response.context['attendances']], [self.past.pk])
+        self.assertContains(response, 'Attendances: 3')
+        self.assertContains(response, '?attendances_page=1')
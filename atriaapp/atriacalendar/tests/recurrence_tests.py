@@ -0,0 +1,359 @@
+import json
+from datetime import datetime
+from io import StringIO
+
+from dateutil import rrule
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from swingtime.models import EventType
+
+from ..cache import calendar_cache
+from ..forms import AtriaOccurrenceForm
+from ..models import (
+    AtriaCalendar, AtriaEvent, AtriaEventAttendance, AtriaEventProgram,
+    AtriaOccurrence, AtriaOrganization, AtriaRelationship, AtriaVolunteerOpportunity,
+    EventAttendanceType, RelationType)
+from ..recurrence import (
+    expand_event, materialize_occurrence, set_recurrence, virtual_occurrences, virtual_start)
+from .utils import commit_callbacks
+
+User = get_user_model()
+
+
+class RecurrenceTests(TestCase):
+    """
+    Tests for events stored as recurrence rules and their virtual occurrences.
+    """
+
+    def setUp(self):
+        translation.activate('en')
+        calendar_cache().clear()
+
+        self.contact = User.objects.create(email='contact@example.com')
+        self.neighbour = User.objects.create(email='neighbour@example.com')
+        EventAttendanceType.objects.create(attendance_type='Contact')
+        EventAttendanceType.objects.create(attendance_type='Attendee')
+
+        self.org = AtriaOrganization.objects.create(org_name='Test Org')
+        self.calendar = AtriaCalendar.objects.create(org_owner=self.org, calendar_name='Events')
+        AtriaRelationship.objects.create(
+            user=self.contact, org=self.org, status='Active',
+            relation_type=RelationType.objects.create(
+                relation_type='Employee', is_org_relation=True))
+        self.event = AtriaEvent.objects.create(
+            title='Weekly Garden', event_type=EventType.objects.create(abbr='t', label='Type'),
+            event_program=AtriaEventProgram.objects.create(abbr='p', label='Program'),
+            calendar=self.calendar)
+        self.opportunity = AtriaVolunteerOpportunity.objects.create(
+            event=self.event, title='Weeding')
+
+        # 9am Wednesdays in Vancouver, across the end of daylight saving time
+        self.start_time = timezone.make_aware(datetime(2019, 10, 16, 9))
+        set_recurrence(
+            self.event, self.start_time, self.start_time + timezone.timedelta(hours=2),
+            contact=self.contact, freq=rrule.WEEKLY, count=10)
+        self.event.recurrence_published = True
+        self.event.save()
+
+    def repetition(self, weeks):
+        return timezone.make_aware(datetime(2019, 10, 16, 9) + timezone.timedelta(weeks=weeks))
+
+    def month(self, query=''):
+        response = self.client.get('/api/atria/calendar/2019/11/' + query)
+        self.assertEqual(response.status_code, 200)
+
+        return json.loads(response.content)['occurrences']
+
+    def test_expand(self):
+        self.assertFalse(AtriaOccurrence.objects.filter(event=self.event).exists())
+        self.assertEqual(self.event.recurrence_end, self.repetition(9) + timezone.timedelta(hours=2))
+
+        times = expand_event(
+            self.event, timezone.make_aware(datetime(2019, 10, 30, 10)),
+            timezone.make_aware(datetime(2019, 11, 13, 8)))
+        self.assertEqual(
+            [timezone.localtime(start).hour for (start, _) in times], [9, 9])
+        self.assertEqual([start for (start, _) in times], [self.repetition(2), self.repetition(3)])
+
+        occurrences = virtual_occurrences(
+            AtriaEvent.objects.filter(pk=self.event.pk),
+            datetime(2019, 12, 1), datetime(2020, 1, 31))
+        self.assertEqual([o.start_time for o in occurrences], [
+            self.repetition(7), self.repetition(8), self.repetition(9)])
+        self.assertIsNone(occurrences[0].pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(occurrences[0].atriaevent, self.event)
+
+    def test_daylight_saving_changes(self):
+        # 01:30 happens twice on Nov 3 2019 in Vancouver, and 02:30 not at
+        # all on Mar 8 2020
+        night = AtriaEvent.objects.create(
+            title='Night Watch', event_type=self.event.event_type,
+            event_program=self.event.event_program, calendar=self.calendar)
+        set_recurrence(
+            night, timezone.make_aware(datetime(2019, 11, 2, 1, 30)),
+            timezone.make_aware(datetime(2019, 11, 2, 2, 30)), freq=rrule.DAILY, count=3)
+        early = AtriaEvent.objects.create(
+            title='Early Watch', event_type=self.event.event_type,
+            event_program=self.event.event_program, calendar=self.calendar)
+        set_recurrence(
+            early, timezone.make_aware(datetime(2020, 3, 7, 2, 30)),
+            timezone.make_aware(datetime(2020, 3, 7, 3)), freq=rrule.DAILY, count=3)
+        AtriaEvent.objects.filter(pk__in=(night.pk, early.pk)).update(recurrence_published=True)
+
+        times = expand_event(night, night.recurrence_start, night.recurrence_end)
+        self.assertEqual(
+            [(timezone.localtime(start).isoformat(), timezone.localtime(end).isoformat())
+             for (start, end) in times], [
+                ('2019-11-02T01:30:00-07:00', '2019-11-02T02:30:00-07:00'),
+                ('2019-11-03T01:30:00-07:00', '2019-11-03T01:30:00-08:00'),
+                ('2019-11-04T01:30:00-08:00', '2019-11-04T02:30:00-08:00'),
+            ])
+        times = expand_event(early, early.recurrence_start, early.recurrence_end)
+        self.assertEqual(
+            [timezone.localtime(start).isoformat() for (start, _) in times], [
+                '2020-03-07T02:30:00-08:00',
+                '2020-03-08T03:30:00-07:00',
+                '2020-03-09T02:30:00-07:00',
+            ])
+
+        self.assertEqual(
+            [o['virtual_start'] for o in self.month() if o['event']['event_id'] == night.pk],
+            ['20191102T083000Z', '20191103T083000Z', '20191104T093000Z'])
+        response = self.client.get('/api/atria/calendar/2020/3/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [o['virtual_start'] for o in json.loads(response.content)['occurrences']
+             if o['event']['event_id'] == early.pk],
+            ['20200307T103000Z', '20200308T103000Z', '20200309T093000Z'])
+
+    def test_api_merge(self):
+        stored = AtriaOccurrence.objects.create(
+            event=self.event, start_time=self.repetition(3) - timezone.timedelta(hours=1),
+            end_time=self.repetition(3), published=True)
+
+        occurrences = self.month()
+        self.assertEqual(
+            [(o['occurrence_id'], o['virtual_start']) for o in occurrences[:3]], [
+                (None, virtual_start(AtriaOccurrence(start_time=self.repetition(2)))),
+                (stored.pk, None),
+                (None, virtual_start(AtriaOccurrence(start_time=self.repetition(3)))),
+            ])
+        # the month view runs from Sunday Oct 27 to Saturday Nov 30
+        self.assertEqual(len(occurrences), 6)
+        self.assertEqual(occurrences[0]['event']['opportunities'][0]['title'], 'Weeding')
+
+        self.event.recurrence_published = False
+        with commit_callbacks():
+            self.event.save()
+        self.assertEqual([o['occurrence_id'] for o in self.month()], [stored.pk])
+
+    def test_attend(self):
+        start = virtual_start(AtriaOccurrence(start_time=self.repetition(3)))
+        url = reverse('view_virtual_event', args=(self.event.pk, start))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, reverse(
+            'view_virtual_opportunity', args=(self.event.pk, start, self.opportunity.pk)))
+        self.assertFalse(AtriaOccurrence.objects.filter(event=self.event).exists())
+
+        self.assertEqual(self.client.get(url.replace(start, start[:-2] + '1Z')).status_code, 404)
+
+        self.client.force_login(self.neighbour)
+        response = self.client.post(url, {'attendee_count': 2})
+        self.assertEqual(response.status_code, 200)
+
+        occurrence = AtriaOccurrence.objects.get(event=self.event)
+        self.assertEqual(
+            (occurrence.start_time, occurrence.recurrence_start, occurrence.published),
+            (self.repetition(3), self.repetition(3), True))
+        self.assertEqual(occurrence.attendee_count, 2)
+        self.assertEqual(
+            sorted(AtriaEventAttendance.objects.filter(occurrence=occurrence)
+                   .values_list('attendance_type__attendance_type', flat=True)),
+            ['Attendee', 'Contact'])
+
+        # the stored occurrence replaces the virtual one
+        occurrences = self.month()
+        self.assertEqual(len(occurrences), 5)
+        self.assertEqual(occurrences[1]['occurrence_id'], occurrence.pk)
+        self.assertRedirects(
+            self.client.get(url), reverse('view_event', args=(occurrence.pk,)))
+        self.assertEqual(materialize_occurrence(self.event, self.repetition(3)), occurrence)
+
+    def test_unpublished_rule(self):
+        self.event.recurrence_published = False
+        self.event.save()
+        start = virtual_start(AtriaOccurrence(start_time=self.repetition(3)))
+        url = reverse('view_virtual_event', args=(self.event.pk, start))
+        opportunity_url = reverse(
+            'view_virtual_opportunity', args=(self.event.pk, start, self.opportunity.pk))
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.neighbour)
+        self.assertEqual(self.client.get(opportunity_url).status_code, 404)
+        self.assertEqual(self.client.post(url, {'attendee_count': 2}).status_code, 404)
+        self.assertFalse(AtriaOccurrence.objects.filter(event=self.event).exists())
+        with self.assertRaises(AtriaOccurrence.DoesNotExist):
+            materialize_occurrence(self.event, self.repetition(3), self.neighbour)
+
+        # the org's own users still see it
+        AtriaRelationship.objects.create(
+            user=self.neighbour, org=self.org, status='Active',
+            relation_type=RelationType.objects.create(relation_type='Member'))
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(opportunity_url).status_code, 200)
+
+    def test_store(self):
+        self.client.force_login(self.contact)
+        session = self.client.session
+        session['ACTIVE_ORG'] = str(self.org.pk)
+        session['URL_NAMESPACE'] = 'organization:'
+        session.save()
+
+        start = virtual_start(AtriaOccurrence(start_time=self.repetition(1)))
+        url = reverse('organization:store_occurrence', args=(self.event.pk, start))
+
+        self.event.recurrence_published = False
+        self.event.save()
+        response = self.client.post(url, {'publish': 'Publish'})
+        self.assertRedirects(response, reverse('organization:create_manage'))
+
+        occurrence = AtriaOccurrence.objects.get(event=self.event)
+        self.assertEqual((occurrence.published, occurrence.publisher), (True, self.contact))
+        self.assertEqual([o['occurrence_id'] for o in self.month()], [])
+        self.assertEqual(
+            json.loads(self.client.get('/api/atria/calendar/2019/10/').content)
+            ['occurrences'][-1]['occurrence_id'], occurrence.pk)
+
+        # edit
+        start = virtual_start(AtriaOccurrence(start_time=self.repetition(2)))
+        response = self.client.post(
+            reverse('organization:store_occurrence', args=(self.event.pk, start)))
+        occurrence = AtriaOccurrence.objects.get(event=self.event, recurrence_start=self.repetition(2))
+        self.assertRedirects(
+            response, reverse('organization:swingtime-occurrence', args=(self.event.pk, occurrence.pk)),
+            fetch_redirect_response=False)
+        self.assertFalse(occurrence.published)
+
+    def test_feed(self):
+        calendar_cache().clear()
+        with self.settings(ICAL_FEED_PAST_DAYS=(timezone.now() - self.start_time).days + 1):
+            response = self.client.get('/api/atria/calendars/%s/feed.ics' % self.calendar.pk)
+            content = b''.join(response.streaming_content).decode('utf-8')
+
+        self.assertEqual(content.count('BEGIN:VEVENT'), 10)
+        self.assertIn('UID:event-%s-20191016T160000Z@' % self.event.pk, content)
+
+    @override_settings(EVENT_RECURRENCE_STORAGE='rule')
+    def test_form_save(self):
+        event = AtriaEvent.objects.create(
+            event_type=self.event.event_type, event_program=self.event.event_program)
+        form = AtriaOccurrenceForm({
+            'day': '2019-10-16',
+            'start_time_delta': 18 * 3600,
+            'end_time_delta': 19 * 3600,
+            'repeats': 'until',
+            'until': '2019-12-31',
+            'freq': rrule.WEEKLY,
+            'interval': 1,
+            'week_days': ['3'],
+            'month_ordinal': 1,
+            'month_ordinal_day': 1,
+            'each_month_day': [1],
+            'year_months': [1],
+            'year_month_ordinal': 1,
+            'year_month_ordinal_day': 1,
+            'month_option': 'each',
+        }, contact=self.contact)
+
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save(event)
+
+        event.refresh_from_db()
+        self.assertFalse(AtriaOccurrence.objects.filter(event=event).exists())
+        self.assertTrue(event.recurrence_rule.startswith('RRULE:FREQ=WEEKLY;'))
+        self.assertIn('UNTIL=20191231T000000', event.recurrence_rule)
+        self.assertEqual(
+            len(expand_event(event, event.recurrence_start, event.recurrence_end)), 11)
+        self.assertEqual(event.recurrence_contact, self.contact)
+
+        # further series are stored as occurrences
+        form.save(event)
+        self.assertEqual(AtriaOccurrence.objects.filter(event=event).count(), 11)
+
+    @override_settings(EVENT_RECURRENCE_STORAGE='rule', BULK_OPERATION_THREADS=False)
+    def test_publish_new_series(self):
+        self.client.force_login(self.contact)
+        session = self.client.session
+        session['ACTIVE_ORG'] = str(self.org.pk)
+        session['URL_NAMESPACE'] = 'organization:'
+        session.save()
+
+        event = AtriaEvent.objects.create(
+            title='Monthly Cleanup', event_type=self.event.event_type,
+            event_program=self.event.event_program, calendar=self.calendar)
+        event_url = reverse('organization:swingtime-event', args=(event.pk,))
+        response = self.client.post(event_url, {
+            '_add': 'Add',
+            'day': '2019-11-05',
+            'start_time_delta': 10 * 3600,
+            'end_time_delta': 12 * 3600,
+            'repeats': 'until',
+            'until': '2019-11-26',
+            'freq': rrule.WEEKLY,
+            'interval': 1,
+            'week_days': ['2'],
+            'month_ordinal': 1,
+            'month_ordinal_day': 1,
+            'each_month_day': [1],
+            'year_months': [1],
+            'year_month_ordinal': 1,
+            'year_month_ordinal_day': 1,
+            'month_option': 'each',
+        })
+        self.assertRedirects(response, event_url, fetch_redirect_response=False)
+
+        # a draft until published from Create/Manage
+        def cleanups():
+            return [o['virtual_start'] for o in self.month()
+                    if o['event']['event_id'] == event.pk]
+        self.assertEqual(cleanups(), [])
+
+        first = virtual_start(AtriaOccurrence(
+            start_time=timezone.make_aware(datetime(2019, 11, 5, 10))))
+        response = self.client.get(event_url)
+        self.assertContains(response, reverse('view_virtual_event', args=(event.pk, first)))
+
+        response = self.client.get(reverse('view_virtual_event', args=(event.pk, first)))
+        self.assertContains(
+            response, reverse('organization:store_occurrence', args=(event.pk, first)))
+        self.assertContains(response, 'Publish This Date')
+
+        create_manage = reverse('organization:create_manage')
+        response = self.client.get(create_manage)
+        self.assertContains(response, 'name="event_checked_%s"' % event.pk)
+        self.assertContains(response, 'name="event_checked_%s"' % self.event.pk)
+
+        response = self.client.post(create_manage, {
+            'publish': 'Publish', 'event_checked_%s' % event.pk: 'on'})
+        self.assertEqual(response.status_code, 302)
+        with commit_callbacks():
+            call_command('run_bulk_operations', stdout=StringIO())
+
+        self.assertEqual(len(cleanups()), 3)
+        self.assertEqual(cleanups()[0], first)
+
+        response = self.client.post(create_manage, {
+            'unpublish': 'Unpublish', 'event_checked_%s' % event.pk: 'on'})
+        with commit_callbacks():
+            call_command('run_bulk_operations', stdout=StringIO())
+
+        self.assertEqual(cleanups(), [])
+        self.assertTrue(AtriaEvent.objects.get(pk=self.event.pk).recurrence_published)
@@ -0,0 +1,84 @@
+from datetime import date, datetime
+from io import StringIO
+
+from dateutil import rrule
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from swingtime.models import EventType
+
+from ..bulk import occurrences_changed
+from ..models import (
+    AtriaCalendar, AtriaDailyCount, AtriaEvent, AtriaEventProgram, AtriaOccurrence,
+    AtriaOrganization)
+from ..recurrence import materialize_occurrence, publish_recurrence, set_recurrence
+
+
+class RollupTests(TestCase):
+    """
+    Tests for the per-day published occurrence counts.
+    """
+
+    def setUp(self):
+        self.program = AtriaEventProgram.objects.create(abbr='p', label='Program')
+        self.calendar = AtriaCalendar.objects.create(
+            org_owner=AtriaOrganization.objects.create(org_name='Test Org'))
+        self.event = AtriaEvent.objects.create(
+            title='Garden', event_type=EventType.objects.create(),
+            event_program=self.program, calendar=self.calendar)
+
+    def create_occurrence(self, day, published=True):
+        start_time = timezone.make_aware(datetime(2019, 10, day, 9))
+        return AtriaOccurrence.objects.create(
+            event=self.event, start_time=start_time,
+            end_time=start_time + timezone.timedelta(hours=1), published=published)
+
+    def counts(self):
+        return {
+            (cell.day.day, cell.calendar_id, cell.event_program_id): cell.count
+            for cell in AtriaDailyCount.objects.all()
+        }
+
+    def test_bulk_update(self):
+        occurrences = [self.create_occurrence(day, published=False) for day in (1, 1, 5)]
+        self.assertEqual(self.counts(), {})
+
+        # queryset.update() sends no signals
+        updated = AtriaOccurrence.objects.filter(id__in=[o.id for o in occurrences])
+        updated.update(published=True)
+        occurrences_changed(updated)
+        self.assertEqual(self.counts(), {
+            (1, self.calendar.id, self.program.id): 2,
+            (5, self.calendar.id, self.program.id): 1,
+        })
+
+    def test_recurrence(self):
+        start_time = timezone.make_aware(datetime(2019, 10, 2, 18))
+        set_recurrence(
+            self.event, start_time, start_time + timezone.timedelta(hours=1),
+            freq=rrule.WEEKLY, count=3)
+        self.assertEqual(self.counts(), {})
+
+        publish_recurrence(self.event)
+        key = (self.calendar.id, self.program.id)
+        self.assertEqual(self.counts(), {(2,) + key: 1, (9,) + key: 1, (16,) + key: 1})
+
+        # a stored repetition still counts once
+        materialize_occurrence(self.event, start_time, published=True)
+        self.assertEqual(self.counts()[(2,) + key], 1)
+
+        self.event.delete()
+        self.assertEqual(self.counts(), {})
+
+    def test_rebuild(self):
+        self.create_occurrence(3)
+        AtriaDailyCount.objects.update(count=5)
+        AtriaDailyCount.objects.create(
+            day=date(2019, 10, 4), calendar=self.calendar, event_program=self.program, count=1)
+
+        output = StringIO()
+        call_command('rebuild_daily_counts', stdout=output)
+        self.assertIn('1 daily count(s) rebuilt.', output.getvalue())
+        self.assertEqual(self.counts(), {(3, self.calendar.id, self.program.id): 1})
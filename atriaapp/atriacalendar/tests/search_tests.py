@@ -0,0 +1,154 @@
+from datetime import date, datetime
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from swingtime.models import EventType
+
+from ..models import (
+    AtriaEvent, AtriaEventProgram, AtriaEventSearchDocument, AtriaOccurrence,
+    AtriaVolunteerOpportunity)
+from ..search import search_event_ids, search_occurrences
+
+
+class SearchTests(TestCase):
+    """
+    Tests for full-text search over events and opportunities.
+    """
+
+    def setUp(self):
+        self.event_type = EventType.objects.create(abbr='test', label='Test')
+        self.program = AtriaEventProgram.objects.create(abbr='out', label='Outdoors')
+        self.start = timezone.now() + timezone.timedelta(days=1)
+
+    def create_event(self, days=0, program=None, **fields):
+        event = AtriaEvent.objects.create(
+            event_type=self.event_type,
+            event_program=program or self.program,
+            **fields
+        )
+        start_time = self.start + timezone.timedelta(days=days)
+        AtriaOccurrence.objects.create(
+            start_time=start_time,
+            end_time=start_time + timezone.timedelta(hours=1),
+            event=event,
+            published=True,
+        )
+        return event
+
+    def search(self, query, **filters):
+        return [o.event_id for o in search_occurrences(
+            AtriaOccurrence.objects.all(), query, **filters)]
+
+    def test_document_indexed(self):
+        event = self.create_event(title_en='Community garden', title_fr='Jardin communautaire')
+        AtriaVolunteerOpportunity.objects.create(
+            event=event, title='Compost volunteers', description='Turn the piles')
+
+        document = AtriaEventSearchDocument.objects.get(event=event).document
+        self.assertIn('Jardin communautaire', document)
+        self.assertIn('Compost volunteers', document)
+        self.assertIn('Outdoors', document)
+
+    def test_multilingual_match(self):
+        event = self.create_event(title_en='Community garden', title_fr='Jardin communautaire')
+        self.create_event(title_en='Book club')
+
+        self.assertEqual(self.search('jardin'), [event.pk])
+        self.assertEqual(self.search('communaut'), [event.pk])
+        self.assertEqual(self.search('garden'), [event.pk])
+
+    def test_program_labels_indexed(self):
+        event = self.create_event(title_en='Community garden')
+        self.program.label_fr = 'Plein air'
+        self.program.save()
+
+        with translation.override('fr'):
+            self.assertEqual(self.search('outdoors'), [event.pk])
+        self.assertEqual(self.search('plein air'), [event.pk])
+
+    def test_all_terms_required(self):
+        garden = self.create_event(title_en='Community garden')
+        self.create_event(title_en='Community kitchen')
+
+        self.assertEqual(self.search('community garden'), [garden.pk])
+        self.assertEqual(self.search('"garden" OR kitchen*'), [])
+
+    def test_ranking(self):
+        passing = self.create_event(
+            title_en='Book club', description_en='Bring a snack, maybe something from the garden')
+        focused = self.create_event(
+            days=1, title_en='Garden work party', description_en='Garden beds and garden tools')
+
+        self.assertEqual(self.search('garden'), [focused.pk, passing.pk])
+        self.assertEqual(
+            [event_id for (event_id, _) in search_event_ids('garden')],
+            [focused.pk, passing.pk])
+
+    def test_filters(self):
+        other_program = AtriaEventProgram.objects.create(abbr='oth', label='Other')
+        early = self.create_event(title_en='Garden one')
+        late = self.create_event(days=10, title_en='Garden two')
+        other = self.create_event(title_en='Garden three', program=other_program)
+
+        start_date = self.start.date()
+        self.assertEqual(
+            sorted(self.search('garden', end=start_date)), sorted([early.pk, other.pk]))
+        self.assertEqual(
+            self.search('garden', start=start_date + timezone.timedelta(days=5)), [late.pk])
+        self.assertEqual(
+            sorted(self.search('garden', program=self.program.pk)), sorted([early.pk, late.pk]))
+        self.assertEqual(self.search('', program=other_program.pk), [other.pk])
+
+    @override_settings(SEARCH_MAX_EVENTS=2)
+    def test_limit_after_filters(self):
+        # better matches outside the filters don't crowd out the one inside
+        for days in range(3):
+            self.create_event(days=days, title_en='Garden garden', description_en='Garden')
+        upcoming = self.create_event(
+            days=10, title_en='Book club', description_en='Snacks from the garden')
+
+        start_date = self.start.date() + timezone.timedelta(days=5)
+        self.assertEqual(self.search('garden', start=start_date), [upcoming.pk])
+        self.assertEqual(len(self.search('garden')), 2)
+
+    def test_local_day_filters(self):
+        # 23:30 in Vancouver is the next day in UTC
+        event = self.create_event(title_en='Night sky')
+        late = timezone.make_aware(datetime(2030, 6, 1, 23, 30))
+        AtriaOccurrence.objects.filter(event=event).update(
+            start_time=late, end_time=late + timezone.timedelta(hours=1))
+
+        day = date(2030, 6, 1)
+        self.assertEqual(self.search('night', start=day, end=day), [event.pk])
+        self.assertEqual(self.search('night', end=day - timezone.timedelta(days=1)), [])
+        self.assertEqual(self.search('night', start=day + timezone.timedelta(days=1)), [])
+
+    def test_opportunity_search_view(self):
+        translation.activate('en')
+        garden = self.create_event(title_en='Garden')
+        AtriaVolunteerOpportunity.objects.create(event=garden, title='Weeding')
+        AtriaVolunteerOpportunity.objects.create(event=garden, title='Watering')
+        draft = self.create_event(title_en='Draft')
+        AtriaVolunteerOpportunity.objects.create(event=draft, title='Planning')
+        AtriaOccurrence.objects.filter(event=draft).update(published=False)
+        self.create_event(title_en='Concert')
+
+        response = self.client.get(reverse('search_opportunity'))
+
+        # only published occurrences with opportunities, once each
+        self.assertEqual([o.event_id for o in response.context['occurrences']], [garden.pk])
+
+    def test_reindexed_on_change(self):
+        event = self.create_event(title_en='Garden')
+        opportunity = AtriaVolunteerOpportunity.objects.create(event=event, title='Weeding')
+        self.assertEqual(self.search('weeding'), [event.pk])
+
+        opportunity.delete()
+        self.assertEqual(self.search('weeding'), [])
+
+        event.title_en = 'Orchard'
+        event.save()
+        self.assertEqual(self.search('garden'), [])
+        self.assertEqual(self.search('orchard'), [event.pk])
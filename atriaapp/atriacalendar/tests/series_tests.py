@@ -0,0 +1,124 @@
+from unittest import mock
+
+from dateutil import rrule
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from swingtime.models import EventType, Occurrence
+
+from ..forms import AtriaOccurrenceForm
+from ..models import (
+    AtriaEvent, AtriaEventAttendance, AtriaEventProgram, AtriaOccurrence,
+    AtriaOccurrenceBucket, EventAttendanceType)
+from ..series import create_series, expand_series
+
+User = get_user_model()
+
+
+class SeriesTests(TestCase):
+    """
+    Tests for bulk creation of recurring event series.
+    """
+
+    def setUp(self):
+        self.event = AtriaEvent.objects.create(
+            event_type=EventType.objects.create(),
+            event_program=AtriaEventProgram.objects.create(),
+        )
+        self.contact = User.objects.create(email='contact@example.com')
+        self.contact_type = EventAttendanceType.objects.create(attendance_type='Contact')
+        self.start_time = timezone.now().replace(microsecond=0)
+        self.end_time = self.start_time + timezone.timedelta(hours=1)
+
+    def test_expand_series(self):
+        times = expand_series(self.start_time, self.end_time, freq=rrule.WEEKLY, count=3)
+
+        self.assertEqual(times, [
+            (self.start_time + timezone.timedelta(weeks=n),
+             self.end_time + timezone.timedelta(weeks=n))
+            for n in range(3)
+        ])
+        self.assertEqual(
+            expand_series(self.start_time, self.end_time),
+            [(self.start_time, self.end_time)])
+
+    def test_create_series(self):
+        # an unrelated occurrence, created before the series
+        Occurrence.objects.create(
+            start_time=self.start_time, end_time=self.end_time,
+            event=AtriaEvent.objects.create(
+                event_type=self.event.event_type,
+                event_program=self.event.event_program))
+
+        # SQLite batches: one parent insert, three child and two attendance
+        # inserts, plus the parent id read-back, type and event lookups, the
+        # savepoint and the change watermarks
+        with self.assertNumQueries(13):
+            occurrences = create_series(
+                self.event, self.start_time, self.end_time,
+                contact=self.contact, freq=rrule.DAILY, count=300)
+
+        saved = AtriaOccurrence.objects.filter(event=self.event).order_by('start_time')
+        self.assertEqual(
+            [(o.pk, o.start_time, o.end_time) for o in saved],
+            [(o.pk, o.start_time, o.end_time) for o in occurrences])
+        self.assertEqual(len(occurrences), 300)
+        self.assertEqual(occurrences[-1].start_time,
+                         self.start_time + timezone.timedelta(days=299))
+        self.assertFalse(any(o.published for o in saved))
+
+        attendances = AtriaEventAttendance.objects.filter(
+            occurrence__event=self.event, user=self.contact,
+            attendance_type=self.contact_type, user_count=1)
+        self.assertEqual(attendances.count(), 300)
+
+    def test_create_series_row_by_row(self):
+        # backends that neither return bulk insert ids nor are SQLite save
+        # the parent rows one at a time
+        with mock.patch.object(connection, 'vendor', 'other'):
+            occurrences = create_series(
+                self.event, self.start_time, self.end_time, freq=rrule.DAILY, count=3)
+
+        self.assertEqual(
+            [(o.pk, o.start_time) for o in
+             AtriaOccurrence.objects.filter(event=self.event).order_by('start_time')],
+            [(o.pk, o.start_time) for o in occurrences])
+
+    @override_settings(OCCURRENCE_INTERVAL_INDEX={'ENABLED': True})
+    def test_long_occurrences_indexed(self):
+        occurrences = create_series(
+            self.event, self.start_time, self.start_time + timezone.timedelta(days=20),
+            freq=rrule.MONTHLY, count=2)
+
+        for occurrence in occurrences:
+            self.assertTrue(
+                AtriaOccurrenceBucket.objects.filter(occurrence=occurrence).exists())
+
+    def test_form_save(self):
+        form = AtriaOccurrenceForm({
+            'day': self.start_time.date().isoformat(),
+            'start_time_delta': 18 * 3600,
+            'end_time_delta': 19 * 3600,
+            'repeats': 'count',
+            'count': 4,
+            'freq': rrule.WEEKLY,
+            'interval': 1,
+            'week_days': [str(self.start_time.isoweekday())],
+            'month_ordinal': 1,
+            'month_ordinal_day': 1,
+            'each_month_day': [1],
+            'year_months': [1],
+            'year_month_ordinal': 1,
+            'year_month_ordinal_day': 1,
+            'month_option': 'each',
+        }, contact=self.contact)
+
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save(self.event)
+
+        self.assertEqual(AtriaOccurrence.objects.filter(event=self.event).count(), 4)
+        self.assertEqual(
+            AtriaEventAttendance.objects.filter(user=self.contact).count(), 4)
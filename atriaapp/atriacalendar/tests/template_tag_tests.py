@@ -1,6 +1,14 @@
+from django.core.cache import cache
 from django.template import Context, Engine
-from django.test import SimpleTestCase
+from django.template.loader import render_to_string
+from django.test import SimpleTestCase, TestCase
 from django.urls import reverse
+from django.utils import timezone, translation
+
+from swingtime.models import EventType
+
+from ..models import AtriaEvent, AtriaEventProgram, AtriaOccurrence, AtriaVolunteerOpportunity
+from ..templatetags.session_namespaced_url import cached_reverse, snurl_reverse
 
 
 class DummyRequest:
@@ -26,3 +34,105 @@ class SNURLTests(SimpleTestCase):
         rendered = t.render(c)
 
         self.assertIn(reverse('neighbour:event'), rendered)
+
+    def test_snurl_per_render(self):
+        """
+        The namespace is worked out per render, without changing the node.
+        """
+        t = Engine(app_dirs=True, libraries={
+            'session_namespaced_url': (
+                'atriacalendar.templatetags.session_namespaced_url'),
+        }).from_string(
+            '{% load session_namespaced_url %}{% snurl "opportunities" occ_id %}')
+
+        def render(namespace, language=None):
+            r = DummyRequest()
+            r.session = {'URL_NAMESPACE': namespace} if namespace else {}
+            with translation.override(language or translation.get_language()):
+                return t.render(Context({"request": r, "occ_id": 3}))
+
+        self.assertEqual(render('neighbour:'), reverse('neighbour:opportunities', args=(3,)))
+        self.assertEqual(
+            render('organization:'), reverse('organization:opportunities', args=(3,)))
+        self.assertEqual(render('neighbour:', 'fr'), '/fr/neighbour/event/3/opportunities/')
+        self.assertEqual(render(None), reverse('opportunities', args=(3,)))
+
+    def test_snurl_cache(self):
+        cached_reverse.cache_clear()
+        with translation.override('en'):
+            for i in range(3):
+                self.assertEqual(
+                    snurl_reverse('neighbour:opportunities', [3], {}, None),
+                    '/en/neighbour/event/3/opportunities/')
+            self.assertEqual(cached_reverse.cache_info().hits, 2)
+
+            # unhashable arguments are reversed uncached
+            self.assertEqual(
+                snurl_reverse('view_neighbour_id', [['a']], {}, None),
+                "/en/view_neighbour/%5B'a'%5D/")
+            self.assertEqual(cached_reverse.cache_info().currsize, 1)
+
+        # cleared when settings change
+        with self.settings(SNURL_CACHE_SIZE=1):
+            self.assertEqual(cached_reverse.cache_info().currsize, 0)
+
+
+class NewsfeedCardTests(TestCase):
+    def setUp(self):
+        translation.activate('en')
+        cache.clear()
+
+        self.event = AtriaEvent.objects.create(
+            title='Garden', event_type=EventType.objects.create(),
+            event_program=AtriaEventProgram.objects.create())
+        start_time = timezone.now() + timezone.timedelta(days=1)
+        self.occurrence = AtriaOccurrence.objects.create(
+            event=self.event, start_time=start_time,
+            end_time=start_time + timezone.timedelta(hours=1), published=True)
+        self.opportunity = AtriaVolunteerOpportunity.objects.create(
+            event=self.event, title='Weeding')
+
+    def render_card(self, occurrence=None, namespace=None):
+        request = DummyRequest()
+        request.session = {'URL_NAMESPACE': namespace} if namespace else {}
+        if occurrence is None:
+            occurrence = AtriaOccurrence.objects.select_related('event__atriaevent')\
+                .prefetch_related('event__atriaevent__atriavolunteeropportunity_set')\
+                .get(pk=self.occurrence.pk)
+
+        return render_to_string(
+            'atriacalendar/pageIncludes/eventnewsfeed.html',
+            {'occurrence': occurrence, 'request': request})
+
+    def test_cached(self):
+        occurrence = AtriaOccurrence.objects.get(pk=self.occurrence.pk)
+        first = self.render_card(occurrence)
+        self.assertIn('Weeding', first)
+        self.assertIn(reverse('view_event', args=(self.occurrence.pk,)), first)
+
+        # unsaved changes don't move the version stamp, so the cached card is
+        # used, per language and URL namespace
+        occurrence.atriaevent.title = 'Changed'
+        self.assertEqual(self.render_card(occurrence), first)
+        self.assertIn('Changed', self.render_card(occurrence, namespace='neighbour:'))
+        translation.activate('fr')
+        self.assertIn('Changed', self.render_card(occurrence))
+
+    def test_invalidated(self):
+        self.render_card()
+
+        self.event.title = 'Community Garden'
+        self.event.save()
+        self.assertIn('Community Garden', self.render_card())
+
+        self.opportunity.title = 'Composting'
+        self.opportunity.save()
+        self.assertIn('Composting', self.render_card())
+
+        self.opportunity.delete()
+        self.assertNotIn('Composting', self.render_card())
+
+        self.occurrence.start_time += timezone.timedelta(days=1)
+        self.occurrence.save()
+        self.assertIn(
+            '>%s<' % timezone.localtime(self.occurrence.start_time).day, self.render_card())
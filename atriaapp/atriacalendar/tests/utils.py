@@ -0,0 +1,16 @@
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def commit_callbacks():
+    # Runs the transaction.on_commit callbacks registered in the block once
+    # it ends, as committing would; a TestCase's transaction never commits.
+    start = len(connection.run_on_commit)
+    yield
+
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for (_, callback) in callbacks:
+        callback()
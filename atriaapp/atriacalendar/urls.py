@@ -21,6 +21,10 @@ urlpatterns = [
     path('contact/', contact_view, name='contact'),
     path('event/<int:occ_id>/', view_event_view, name='view_event'),
     path('opportunity/<int:occ_id>/<int:opp_id>/', view_opportunity_view, name='view_opportunity'),
+    path('event/<int:event_id>/at/<str:start>/', view_virtual_event_view,
+         name='view_virtual_event'),
+    path('opportunity/<int:event_id>/at/<str:start>/<int:opp_id>/',
+         view_virtual_opportunity_view, name='view_virtual_opportunity'),
     path('search_event/', search_event_view, name='search_event'),
     path('search_opportunity/', search_opportunity_view, name='search_opportunity'),
     path('search_neighbour/', search_neighbour_view, name='search_neighbour'),
@@ -79,6 +83,11 @@ organizationpatterns = [
         path('create-event/', add_atria_event, name='swingtime-add-event'),
         path('create-event/participants/', add_participants,
              name='add_participants'),
+        path('bulk-operations/', bulk_operation_view, name='bulk_operations'),
+        path('bulk-operations/<int:operation_id>/', bulk_operation_status_view,
+             name='bulk_operation'),
+        path('event/<int:event_id>/at/<str:start>/store/', store_occurrence_view,
+             name='store_occurrence'),
         path('', include(calendarpatterns)),
         path('', include(loggedinuserpatterns)),
         ])),
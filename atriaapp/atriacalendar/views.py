@@ -1,6 +1,10 @@
-from django.http import HttpResponseBadRequest, HttpResponseRedirect
+from django.core.paginator import Paginator
+from django.core.exceptions import PermissionDenied
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse)
 from django.shortcuts import render, redirect
 from django.utils import timezone, translation
+from django.utils.dateparse import parse_date
 from django.contrib.auth import authenticate, get_user_model, login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -9,14 +13,26 @@ from django.views.generic.list import ListView
 from django.urls import reverse, reverse_lazy
 from django.conf import settings
 
+import json
 from datetime import datetime
+from functools import partial
 
 from swingtime import forms as swingtime_forms
 from swingtime import views as swingtime_views
 from swingtime.models import Occurrence
 
+from .bulk import (
+    OCCURRENCE_STATUSES, filter_occurrences, filter_recurrences, occurrences_changed,
+    run_bulk_operation, start_bulk_operation)
+from .directory import MATCH_MODES, search_neighbours, search_organizations
 from .forms import *
+from .metrics import metrics_exposition, request_metrics_settings
 from .models import *
+from .profiles import neighbour_profile, organization_profile
+from .recurrence import (
+    find_virtual_occurrence, materialize_occurrence, parse_virtual_start,
+    virtual_occurrences, virtual_start)
+from .search import search_occurrences
 
 
 USER_ROLE = getattr(settings, "DEFAULT_USER_ROLE", 'Attendee')
@@ -174,7 +190,7 @@ def add_atria_event(
     request,
     template='swingtime/add_event.html',
     event_form_class=AtriaEventForm,
-    recurrence_form_class=swingtime_forms.MultipleOccurrenceForm
+    recurrence_form_class=AtriaOccurrenceForm
 ):
     '''
     Add a new ``Event`` instance and 1 or more associated ``Occurrence``s.
@@ -192,6 +208,10 @@ def add_atria_event(
         a form object for adding occurrences
 
     '''
+    if request.user.is_authenticated:
+        # the organizer becomes the "Contact" of every occurrence
+        recurrence_form_class = partial(recurrence_form_class, contact=request.user)
+
     return swingtime_views.add_event(request, template, event_form_class,
                                      recurrence_form_class)
 
@@ -367,6 +387,15 @@ class EventUpdateView(TranslatedFormMixin, LoginRequiredMixin, UpdateView):
                 initial={'dstart': timezone.now()})
             context_data['event_form'] = AtriaEventForm(instance=self.object, request=self.request)
 
+        if self.object.recurrence_rule:
+            # (occurrence, virtual_start) for each repetition of the rule
+            # that isn't stored
+            context_data['repetitions'] = [
+                (occurrence, virtual_start(occurrence))
+                for occurrence in virtual_occurrences(
+                    AtriaEvent.objects.filter(pk=self.object.pk),
+                    self.object.recurrence_start, self.object.recurrence_end)]
+
         return context_data
 
     def post(self, *args, **kwargs):
@@ -377,8 +406,8 @@ class EventUpdateView(TranslatedFormMixin, LoginRequiredMixin, UpdateView):
         if '_update' in self.request.POST:
             return super().post(*args, **kwargs)
         elif '_add' in self.request.POST:
-            import pdb; pdb.set_trace()
-            form = self.wrap(self.recurrence_form_class, self.request.POST)
+            form = self.wrap(self.recurrence_form_class, self.request.POST,
+                             contact=self.request.user)
 
             if form.is_valid():
                 form.save(self.get_object())
@@ -402,12 +431,9 @@ def settings_view(request):
 
 def neighbour_profile_view(request):
     if request.user.is_authenticated:
-        my_email = request.user.email
-        neighbour = User.objects.filter(email=my_email).get()
-        connections = neighbour.atriarelationship_set.filter(relation_type__relation_type='Member').all()
-        attendances = neighbour.atriaeventattendance_set.all()
-        return render(request, 'atriacalendar/pagesSite/neighbourPage.html',
-            context={'neighbour': neighbour, 'attendances': attendances, 'connections': connections, 'connection_exists': True, 'is_personal_profile': True})
+        context = neighbour_profile(request.user, pages=request.GET)
+        context.update({'connection_exists': True, 'is_personal_profile': True})
+        return render(request, 'atriacalendar/pagesSite/neighbourPage.html', context=context)
     else:
         return redirect('search_neighbour')
 
@@ -415,9 +441,9 @@ def organization_profile_view(request):
     if 'ACTIVE_ORG' in request.session:
         org_id = request.session['ACTIVE_ORG']
         org = AtriaOrganization.objects.filter(id=org_id).get()
-        connections = org.atriarelationship_set.filter(relation_type__relation_type='Member').all()
-        return render(request, 'atriacalendar/pagesSite/organizationPage.html',
-            context={'org': org, 'connections': connections, 'connection_exists': True, 'is_organization_profile': True})
+        context = organization_profile(org, pages=request.GET)
+        context.update({'connection_exists': True, 'is_organization_profile': True})
+        return render(request, 'atriacalendar/pagesSite/organizationPage.html', context=context)
     else:
         return redirect('search_organization')
 
@@ -430,61 +456,223 @@ def view_neighbour_view(request):
 
 def view_neighbour_id_view(request, email):
     neighbour = User.objects.filter(email=email).get()
-    connections = neighbour.atriarelationship_set.filter(relation_type__relation_type='Member').all()
-    connection_exists = request.user.is_authenticated and ('ACTIVE_ORG' in request.session) and AtriaRelationship.objects.filter(org__id=request.session['ACTIVE_ORG'], user=neighbour, relation_type__relation_type='Member').exists()
     is_personal_profile = request.user.is_authenticated and request.user == neighbour
-    return render(request, 'atriacalendar/pagesSite/neighbourPage.html',
-        context={'neighbour': neighbour, 'connections': connections, 'connection_exists': connection_exists, 'is_personal_profile': is_personal_profile})
+    context = neighbour_profile(neighbour, attendances=is_personal_profile, pages=request.GET)
+    connection_exists = request.user.is_authenticated and ('ACTIVE_ORG' in request.session) and AtriaRelationship.objects.filter(org__id=request.session['ACTIVE_ORG'], user=neighbour, relation_type__relation_type='Member').exists()
+    context.update({'connection_exists': connection_exists, 'is_personal_profile': is_personal_profile})
+    return render(request, 'atriacalendar/pagesSite/neighbourPage.html', context=context)
 
 def view_organization_view(request):
     if 'ACTIVE_ORG' in request.session:
         org_id = request.session['ACTIVE_ORG']
-        return redirect('view_organization_id', id=my_id)
+        return redirect('view_organization_id', id=org_id)
     else:
         return redirect('search_organization')
 
 def view_organization_id_view(request, id):
     org = AtriaOrganization.objects.filter(id=id).get()
-    connections = org.atriarelationship_set.filter(relation_type__relation_type='Member').all()
+    context = organization_profile(org, pages=request.GET)
     connection_exists = request.user.is_authenticated and (not 'ACTIVE_ORG' in request.session) and AtriaRelationship.objects.filter(org=org, user=request.user, relation_type__relation_type='Member').exists()
-    is_organization_profile = ('ACTIVE_ORG' in request.session) and org.id == request.session['ACTIVE_ORG']
-    return render(request, 'atriacalendar/pagesSite/organizationPage.html',
-        context={'org': org, 'connections': connections, 'connection_exists': connection_exists, 'is_organization_profile': is_organization_profile})
+    is_organization_profile = ('ACTIVE_ORG' in request.session) and str(org.id) == str(request.session['ACTIVE_ORG'])
+    context.update({'connection_exists': connection_exists, 'is_organization_profile': is_organization_profile})
+    return render(request, 'atriacalendar/pagesSite/organizationPage.html', context=context)
 
 def create_manage_view(request):
     return render(request, 'atriacalendar/pagesSite/createManagePage.html')
 
 
+CURSOR_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def occurrence_cursor(occurrence):
+    # AtriaOccurrence -> String
+    # Produce the keyset cursor for the (start_time, id) of occurrence, as
+    # microseconds since the epoch and id so it survives a query string.
+
+    since = occurrence.start_time - CURSOR_EPOCH
+    microseconds = (since.days * 86400 + since.seconds) * 10 ** 6 + since.microseconds
+
+    return '%d_%d' % (microseconds, occurrence.id)
+
+
+def parse_occurrence_cursor(cursor):
+    # String -> (Datetime, Integer)
+    # Produce the (start_time, id) of an occurrence_cursor, or None if it is
+    # malformed.
+
+    try:
+        (microseconds, occurrence_id) = (int(part) for part in cursor.split('_'))
+        return (CURSOR_EPOCH + timezone.timedelta(microseconds=microseconds),
+                occurrence_id)
+    except (ValueError, OverflowError):
+        return None
+
+
+def create_manage_filters(request):
+    # Produce the status, program, start date, end date, sort order and cursor
+    # to list occurrences by from the request parameters, ignoring malformed
+    # values.  Past occurrences list newest first unless asked otherwise.
+    filters = search_filters(request)
+    del filters['query']
+
+    status = request.GET.get('status', '')
+    filters['status'] = status if status in OCCURRENCE_STATUSES else ''
+
+    order = request.GET.get('order', '')
+    if order not in ('asc', 'desc'):
+        order = 'desc' if filters['status'] == 'past' else 'asc'
+    filters['order'] = order
+
+    filters['after'] = parse_occurrence_cursor(request.GET.get('after', ''))
+
+    return filters
+
+
+def filter_create_manage(occurrences, status='', program=None, start=None,
+                         end=None, order='asc', after=None):
+    # QuerySet ... -> QuerySet
+    # Produce occurrences filtered and ordered for the Create/Manage list,
+    # starting after the (start_time, id) keyset position after.
+
+    occurrences = filter_occurrences(occurrences, status, program, start, end)
+
+    if after:
+        (start_time, occurrence_id) = after
+        if order == 'desc':
+            occurrences = occurrences.filter(
+                models.Q(start_time__lt=start_time) |
+                models.Q(start_time=start_time, id__lt=occurrence_id))
+        else:
+            occurrences = occurrences.filter(
+                models.Q(start_time__gt=start_time) |
+                models.Q(start_time=start_time, id__gt=occurrence_id))
+
+    if order == 'desc':
+        return occurrences.order_by('-start_time', '-id')
+    return occurrences.order_by('start_time', 'id')
+
+
 class CreateManageView(LoginRequiredMixin, ListView):
+    """
+    Lists the active org's occurrences a page at a time, keyset paginated
+    over (start_time, id) so later pages cost the same as the first.  The
+    attendee and volunteer totals are the occurrence counter columns, and the
+    event and publisher are joined in the same query.  Events stored as
+    recurrence rules are listed above the occurrences, and are published and
+    unpublished with them.  Copying a single occurrence opens the copy form;
+    checked occurrences are copied together, shifted by ``copy_days``.
+    """
     model = AtriaOccurrence
+    context_object_name = 'atriaoccurrence_list'
     template_name = 'atriacalendar/pagesSite/createManagePage.html'
 
-    def get_queryset(self):
+    def get_org_queryset(self):
         if 'ACTIVE_ORG' in self.request.session:
             org_id = self.request.session['ACTIVE_ORG']
             return AtriaOccurrence.objects.get_for_org_id(org_id)
         else:
             return AtriaOccurrence.objects.get_for_user(self.request.user)
 
-    def post(self, *args, **kwargs):
-        occurrence_ids = []
+    def get_org_recurrences(self):
+        if 'ACTIVE_ORG' in self.request.session:
+            events = AtriaEvent.objects.filter(
+                calendar__org_owner_id=self.request.session['ACTIVE_ORG'])
+        else:
+            events = AtriaEvent.objects.filter(
+                calendar__org_owner__atriarelationship__user=self.request.user)
+
+        filters = {name: self.filters[name] for name in ('status', 'program', 'start', 'end')}
+        return filter_recurrences(events, **filters).order_by('recurrence_start', 'id')
+
+    def get_queryset(self):
+        # Produce one page of the filtered occurrences, plus one more row to
+        # tell whether there is a next page.
+        self.filters = create_manage_filters(self.request)
+        page_size = getattr(settings, 'CREATE_MANAGE_PAGE_SIZE', 50)
 
-        for k, v in self.request.POST.items():
-            if 'occ_checked_' in k and 'on' in v:
-                occurrence_ids.append(k.split('_')[-1])
+        occurrences = filter_create_manage(self.get_org_queryset(), **self.filters)\
+            .select_related('event', 'publisher')
+        occurrences = list(occurrences[:page_size + 1])
 
-        queryset = self.get_queryset().filter(id__in=occurrence_ids)
+        self.has_next = len(occurrences) > page_size
 
-        if 'publish' in self.request.POST:
-            queryset.update(published=True, publisher=self.request.user)
-        elif 'unpublish' in self.request.POST:
-            queryset.update(published=False, publisher=None)
+        return occurrences[:page_size]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        occurrences = context['object_list']
+
+        query = self.request.GET.copy()
+        query.pop('after', None)
+        context.update({
+            'filters': self.filters,
+            'statuses': OCCURRENCE_STATUSES,
+            'programs': AtriaEventProgram.objects.all(),
+            'first_page_query': query.urlencode(),
+        })
+        if self.has_next:
+            query['after'] = occurrence_cursor(occurrences[-1])
+            context['next_page_query'] = query.urlencode()
+        context['recurrence_list'] = self.get_org_recurrences()
+        context['copy_error'] = getattr(self, 'copy_error', False)
+
+        operation_id = self.request.GET.get('operation', '')
+        operation = owned_bulk_operation(self.request, int(operation_id)) \
+            if operation_id.isdigit() else None
+        if operation is not None:
+            context['bulk_operation'] = bulk_operation_json(operation)
+
+        return context
+
+    def post(self, *args, **kwargs):
+        occurrence_ids = checked_ids(self.request.POST, 'occ_checked_')
+
+        if 'publish' in self.request.POST or 'unpublish' in self.request.POST:
+            criteria = {'ids': occurrence_ids}
+            event_ids = checked_ids(self.request.POST, 'event_checked_')
+            if event_ids:
+                criteria['event_ids'] = event_ids
+
+            # runs in the background; the list shows its progress
+            operation = start_bulk_operation(AtriaBulkOperation.objects.create(
+                org_id=self.request.session.get('ACTIVE_ORG'),
+                user=self.request.user,
+                action='publish' if 'publish' in self.request.POST else 'unpublish',
+                criteria=json.dumps(criteria),
+            ))
+            return redirect('%s?operation=%s' % (self.request.path, operation.pk))
         elif 'copy' in self.request.POST and 0 < len(occurrence_ids):
-            return redirect('copy_occurrance', occ_id=occurrence_ids[0])
+            copy_days = self.request.POST.get('copy_days', '').strip()
+            copy_days = int(copy_days) if copy_days.lstrip('-').isdigit() else 0
+
+            if copy_days:
+                # copies every checked occurrence, shifted by copy_days
+                operation = start_bulk_operation(AtriaBulkOperation.objects.create(
+                    org_id=self.request.session.get('ACTIVE_ORG'),
+                    user=self.request.user,
+                    action='copy',
+                    copy_days=copy_days,
+                    criteria=json.dumps({'ids': occurrence_ids}),
+                ))
+                return redirect('%s?operation=%s' % (self.request.path, operation.pk))
+            elif len(occurrence_ids) == 1:
+                return redirect('copy_occurrance', occ_id=occurrence_ids[0])
+
+            # several occurrences need the number of days to shift them by
+            self.copy_error = True
 
         return self.get(*args, **kwargs)
 
 
+def checked_ids(post, prefix):
+    # QueryDict, String -> List
+    # Produce the sorted ids of the checked "<prefix><id>" boxes, skipping
+    # names that don't end in an id.
+    return sorted(set(
+        int(name[len(prefix):]) for (name, value) in post.items()
+        if name.startswith(prefix) and name[len(prefix):].isdigit() and 'on' in value))
+
+
 def view_event_view(request, occ_id):
     if request.method == 'POST' and request.user.is_authenticated:
         # only allow attendance for registered users
@@ -570,6 +758,98 @@ def view_opportunity_view(request, occ_id, opp_id):
             context={'atriaoccurrence': atriaoccurrence, 'opportunity': opportunity, 'attendance': existing_attendance, 'form': form})
 
 
+def virtual_occurrence_or_404(event, start, user=None):
+    # AtriaEvent, String, User -> AtriaOccurrence
+    # Produce the repetition of the event's recurrence rule starting at
+    # start (a virtual_start value): unsaved if it is still virtual (and, if
+    # user is given, its rule is visible to them), or the occurrence it was
+    # stored as.
+    start_time = parse_virtual_start(start)
+    if start_time is None:
+        raise Http404
+
+    occurrence = AtriaOccurrence.objects.filter(
+        event_id=event.pk, recurrence_start=start_time).first() or \
+        find_virtual_occurrence(event, start_time, user)
+    if occurrence is None:
+        raise Http404
+
+    return occurrence
+
+
+def view_virtual_event_view(request, event_id, start):
+    # The event page of a repetition of a recurrence rule, which is stored
+    # as an occurrence when someone attends it.
+    event = AtriaEvent.objects.filter(pk=event_id).first()
+    if event is None:
+        raise Http404
+    occurrence = virtual_occurrence_or_404(event, start, request.user)
+
+    if occurrence.pk is None and request.method == 'POST' and request.user.is_authenticated:
+        occurrence = materialize_occurrence(event, occurrence.start_time, request.user)
+    if occurrence.pk is not None:
+        if request.method == 'POST':
+            return view_event_view(request, occurrence.pk)
+        return redirect('view_event', occ_id=occurrence.pk)
+
+    form = EventAttendanceForm({'attendee_count': 1})
+    return render(request, 'atriacalendar/pagesSite/eventView.html',
+        context={'atriaoccurrence': occurrence, 'virtual_start': start,
+                 'store_url': reverse(ORG_NAMESPACE + 'store_occurrence', args=(event.pk, start)),
+                 'attendance': None, 'form': form})
+
+
+def view_virtual_opportunity_view(request, event_id, start, opp_id):
+    # The volunteer opportunity page of a repetition of a recurrence rule,
+    # which is stored as an occurrence when someone volunteers.
+    event = AtriaEvent.objects.filter(pk=event_id).first()
+    opportunity = AtriaVolunteerOpportunity.objects.filter(pk=opp_id, event_id=event_id).first()
+    if event is None or opportunity is None:
+        raise Http404
+    occurrence = virtual_occurrence_or_404(event, start, request.user)
+
+    if occurrence.pk is None and request.method == 'POST' and request.user.is_authenticated:
+        occurrence = materialize_occurrence(event, occurrence.start_time, request.user)
+    if occurrence.pk is not None:
+        if request.method == 'POST':
+            return view_opportunity_view(request, occurrence.pk, opp_id)
+        return redirect('view_opportunity', occ_id=occurrence.pk, opp_id=opp_id)
+
+    form = EventVolunteerForm({'attendee_count': 1})
+    return render(request, 'atriacalendar/pagesSite/opportunityView.html',
+        context={'atriaoccurrence': occurrence, 'virtual_start': start,
+                 'opportunity': opportunity, 'attendance': None, 'form': form})
+
+
+@login_required
+def store_occurrence_view(request, event_id, start):
+    # Stores a repetition of one of the active org's recurrence rules as an
+    # occurrence, to publish it on its own or to edit it.
+    if request.method != 'POST':
+        return HttpResponseBadRequest()
+
+    event = AtriaEvent.objects.filter(
+        pk=event_id, calendar__org_owner_id=request.session.get('ACTIVE_ORG')).first()
+    if event is None:
+        raise Http404
+    occurrence = virtual_occurrence_or_404(event, start)
+
+    if occurrence.pk is None:
+        fields = {}
+        if 'publish' in request.POST:
+            fields = {'published': True, 'publisher': request.user}
+        occurrence = materialize_occurrence(event, occurrence.start_time, **fields)
+    elif 'publish' in request.POST and not occurrence.published:
+        occurrence.published = True
+        occurrence.publisher = request.user
+        occurrence.save()
+
+    namespace = request.session.get('URL_NAMESPACE', '')
+    if 'publish' in request.POST:
+        return redirect(namespace + 'create_manage')
+    return redirect(namespace + 'swingtime-occurrence', event_pk=event.pk, pk=occurrence.pk)
+
+
 def manage_event_view(request):
     return render(request, 'atriacalendar/pagesForms/eventForm.html')
 
@@ -710,33 +990,94 @@ class OpportunityCreateView(CreateView):
         return success_url
 
 
+def search_filters(request):
+    # Produce the query, start date, end date and program id to search by from
+    # the request parameters, ignoring malformed values.
+    filters = {'query': request.GET.get('q', '').strip()}
+
+    for name in ('start', 'end'):
+        try:
+            filters[name] = parse_date(request.GET.get(name, ''))
+        except ValueError:
+            filters[name] = None
+
+    program = request.GET.get('program', '')
+    filters['program'] = int(program) if program.isdigit() else None
+
+    return filters
+
+
+def search_page(request, occurrences, template):
+    filters = search_filters(request)
+    occurrences = search_occurrences(occurrences, **filters)\
+        .select_related('event__atriaevent')\
+        .prefetch_related('event__atriaevent__atriavolunteeropportunity_set')
+    page = Paginator(
+        occurrences, getattr(settings, 'SEARCH_PAGE_SIZE', 25)
+    ).get_page(request.GET.get('page'))
+
+    return render(request, template, context={
+        'occurrences': page.object_list,
+        'page': page,
+        'filters': filters,
+        'programs': AtriaEventProgram.objects.all(),
+    })
+
+
 def search_event_view(request):
     occurrences = AtriaOccurrence.objects.filter(
         start_time__gte=timezone.now().date(),
         published=True,
     ).all()
 
-    return render(request, 'atriacalendar/pagesSearch/eventsSearch.html',
-        context={'occurrences': occurrences})
+    return search_page(request, occurrences,
+                       'atriacalendar/pagesSearch/eventsSearch.html')
 
 def search_opportunity_view(request):
+    # Upcoming published occurrences of the events that have volunteer
+    # opportunities, each listed once however many opportunities it has.
     occurrences = AtriaOccurrence.objects.filter(
-        models.Q(
-                start_time__gte=timezone.now()
-            )
-        ).all()
-    return render(request, 'atriacalendar/pagesSearch/opportunitiesSearch.html',
-        context={'occurrences': occurrences})
+        start_time__gte=timezone.now(),
+        published=True,
+        event_id__in=AtriaVolunteerOpportunity.objects.values('event_id'),
+    )
+    return search_page(request, occurrences,
+                       'atriacalendar/pagesSearch/opportunitiesSearch.html')
+
+def directory_filters(request):
+    # Produce the query, match mode and keyset position to search the
+    # directory by from the request parameters.
+    match = request.GET.get('match', '')
+
+    return {
+        'query': request.GET.get('q', '').strip(),
+        'match': match if match in MATCH_MODES else MATCH_MODES[0],
+        'after': request.GET.get('after', '') or None,
+    }
+
 
 def search_neighbour_view(request):
-    neighbours = User.objects.filter(groups__name=settings.DEFAULT_USER_ROLE).all()
+    filters = directory_filters(request)
+    (neighbours, next_after) = search_neighbours(**filters)
+
+    next_page_query = None
+    if next_after:
+        query = request.GET.copy()
+        query['after'] = next_after
+        next_page_query = query.urlencode()
+
     return render(request, 'atriacalendar/pagesSearch/neighboursSearch.html',
-        context={'neighbours': neighbours})
+        context={'neighbours': neighbours, 'filters': filters,
+                 'next_page_query': next_page_query})
 
 def search_organization_view(request):
-    orgs = AtriaOrganization.objects.all()
+    filters = directory_filters(request)
+    del filters['after']
+    filters['compact'] = request.GET.get('compact') == '1'
+    page = search_organizations(page=request.GET.get('page'), **filters)
+
     return render(request, 'atriacalendar/pagesSearch/organizationsSearch.html',
-        context={'orgs': orgs})
+        context={'orgs': page.object_list, 'page': page, 'filters': filters})
 
 def make_connection(request):
     if request.method == 'POST':
@@ -792,3 +1133,71 @@ def form_response(request):
     msg_txt = request.GET.get('msg_txt', None)
     return render(request, 'atriacalendar/pagesForms/form_response.html', {'msg': msg, 'msg_txt': msg_txt})
 
+
+def metrics_view(request):
+    # Request metrics in the Prometheus text format, for scrapers on the
+    # allowed addresses and for staff.
+    allowed_ips = request_metrics_settings()['METRICS_ALLOWED_IPS']
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in allowed_ips):
+        raise PermissionDenied
+
+    return HttpResponse(
+        metrics_exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def owned_bulk_operation(request, operation_id):
+    # HttpRequest, Integer -> AtriaBulkOperation
+    # Produce one of the user's or active org's bulk operations, or None.
+    owner = models.Q(user=request.user)
+    if request.session.get('ACTIVE_ORG'):
+        owner |= models.Q(org_id=request.session['ACTIVE_ORG'])
+
+    return AtriaBulkOperation.objects.filter(owner, pk=operation_id).first()
+
+
+def bulk_operation_json(operation):
+    return {
+        'id': operation.pk,
+        'action': operation.action,
+        'status': operation.status,
+        'total': operation.total,
+        'processed': operation.processed,
+        'error': operation.error,
+        'created': operation.created,
+        'started': operation.started,
+        'finished': operation.finished,
+        'url': reverse(ORG_NAMESPACE + 'bulk_operation', args=(operation.pk,)),
+    }
+
+
+@login_required
+def bulk_operation_view(request):
+    # Publishes, unpublishes or copies the selected occurrences of the active
+    # org in chunks (see atriacalendar.bulk), in this request or, with
+    # background set, after answering 202 with the progress URL.
+    if request.method != 'POST':
+        return HttpResponseBadRequest()
+
+    form = AtriaBulkOperationForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    org = AtriaOrganization.objects.filter(pk=request.session.get('ACTIVE_ORG')).first()
+    operation = form.save(org=org, user=request.user)
+
+    if form.cleaned_data['background']:
+        start_bulk_operation(operation)
+        return JsonResponse(bulk_operation_json(operation), status=202)
+
+    operation = run_bulk_operation(operation.pk)
+    return JsonResponse(bulk_operation_json(operation))
+
+
+@login_required
+def bulk_operation_status_view(request, operation_id):
+    # The progress of one of the user's or active org's bulk operations.
+    operation = owned_bulk_operation(request, operation_id)
+    if operation is None:
+        raise Http404
+
+    return JsonResponse(bulk_operation_json(operation))
@@ -0,0 +1,114 @@
+"""
+Change watermarks for conditional GETs on the public calendar API.
+
+Every write to an event, occurrence or volunteer opportunity bumps the
+``AtriaChangeWatermark`` rows of the event's calendar and program, and the
+shared "all" row.  A request for calendar data reads the rows covering its
+filters (one small query) and derives its ETag and Last-Modified from them,
+so unchanged data can be answered with 304 Not Modified before the
+occurrences are queried.
+
+Unlike the cache versions in cache.py, watermarks are stored in the
+database, so they survive cache evictions and restarts.
+"""
+
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from .models import (
+    AtriaChangeWatermark, AtriaEvent, AtriaOccurrence, AtriaVolunteerOpportunity)
+
+
+ALL_EVENTS = 'all'
+
+
+def watermark_scopes(calendar_ids=(), program_ids=()):
+    # Iterable, Iterable -> Set
+    # Produce the watermark scopes of the given calendars and programs.
+
+    return set(
+        ['calendar:%d' % int(calendar_id) for calendar_id in calendar_ids if calendar_id] +
+        ['program:%d' % int(program_id) for program_id in program_ids if program_id])
+
+
+def touch_watermarks(calendar_ids=(), program_ids=()):
+    # Iterable, Iterable ->
+    # Records a change to the events of the given calendars and programs.
+
+    scopes = watermark_scopes(calendar_ids, program_ids)
+    scopes.add(ALL_EVENTS)
+    now = timezone.now()
+
+    updated = AtriaChangeWatermark.objects.filter(scope__in=scopes)\
+        .update(version=F('version') + 1, modified=now)
+
+    if updated < len(scopes):
+        existing = set(AtriaChangeWatermark.objects.filter(scope__in=scopes)
+                       .values_list('scope', flat=True))
+        AtriaChangeWatermark.objects.bulk_create([
+            AtriaChangeWatermark(scope=scope, version=1, modified=now)
+            for scope in scopes - existing
+        ], ignore_conflicts=True)
+
+
+def request_watermarks(request, calendar_ids=None, program_ids=None):
+    # HttpRequest, Iterable, Iterable -> Tuple
+    # Produce the (versions, last modified) of the watermarks covering a
+    # request for the given calendars and programs (or all events).  Read
+    # once per request, as both the ETag and Last-Modified need them.
+
+    scopes = watermark_scopes(calendar_ids or (), program_ids or ()) or {ALL_EVENTS}
+    key = tuple(sorted(scopes))
+    memo = request.__dict__.setdefault('_atria_watermarks', {})
+
+    if key not in memo:
+        watermarks = dict(
+            (scope, (version, modified)) for (scope, version, modified) in
+            AtriaChangeWatermark.objects.filter(scope__in=scopes)
+            .values_list('scope', 'version', 'modified'))
+        versions = tuple((scope, watermarks.get(scope, (0, None))[0]) for scope in key)
+        modified = [m for (_, m) in watermarks.values()]
+        memo[key] = (versions, max(modified) if modified else None)
+
+    return memo[key]
+
+
+def event_scopes(event_id):
+    # Integer -> Tuple
+    # Produce the ([calendar id], [program id]) of an event.
+
+    row = AtriaEvent.objects.filter(pk=event_id)\
+        .values_list('calendar_id', 'event_program_id').first()
+    return ([row[0]], [row[1]]) if row else ([], [])
+
+
+def capture_previous_scopes(sender, instance, raw=False, **kwargs):
+    # Remembers the calendar and program an event is being moved away from.
+    if not raw and instance.pk:
+        instance._previous_watermark_scopes = event_scopes(instance.pk)
+
+
+def touch_event(sender, instance, raw=False, **kwargs):
+    if not raw:
+        (calendar_ids, program_ids) = getattr(
+            instance, '_previous_watermark_scopes', ([], []))
+        touch_watermarks(
+            calendar_ids + [instance.calendar_id],
+            program_ids + [instance.event_program_id])
+
+
+def touch_event_child(sender, instance, raw=False, **kwargs):
+    # Handles occurrences and volunteer opportunities of an event
+    if not raw:
+        touch_watermarks(*event_scopes(instance.event_id))
+
+
+pre_save.connect(capture_previous_scopes, sender=AtriaEvent)
+post_save.connect(touch_event, sender=AtriaEvent)
+post_delete.connect(touch_event, sender=AtriaEvent)
+
+post_save.connect(touch_event_child, sender=AtriaOccurrence)
+post_delete.connect(touch_event_child, sender=AtriaOccurrence)
+post_save.connect(touch_event_child, sender=AtriaVolunteerOpportunity)
+post_delete.connect(touch_event_child, sender=AtriaVolunteerOpportunity)
@@ -1 +1,8 @@
-DJANGO_SETTINGS_MODULE=atriaapp.heroku_settings python manage.py runserver 0.0.0.0:$PORT
+# One process, several threads: the calendar cache in settings is per
+# process (LocMemCache), so only raise GUNICORN_WORKERS with a shared cache
+# backend configured
+DJANGO_SETTINGS_MODULE=atriaapp.heroku_settings gunicorn atriaapp.wsgi \
+    --bind 0.0.0.0:$PORT \
+    --workers ${GUNICORN_WORKERS:-1} \
+    --threads ${GUNICORN_THREADS:-8} \
+    --worker-class gthread